@@ -0,0 +1,222 @@
+"""
+Benchmarks every operation of the redis backend against ``redis-server`` processes spawned on local ports, one
+per nydus host, so the numbers include the grouping of commands by host.
+
+For every combination of the parameters, each operation is called ``--calls`` times and the suite reports
+operations per second, p50 and p99 latency, and the round trips and redis commands per call. Results are
+printed as a table and written as JSON with ``--output``. Pass the JSON of an earlier run to ``--compare`` to
+see how every operation changed.
+
+Usage::
+
+    python benchmarks/backend.py --ports 6400,6401,6402 --index-sizes 100,10000 --fanouts 10,1000 \\
+        --limits 10,100 --output results.json [--compare baseline.json]
+"""
+import datetime
+import json
+import optparse
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+import redis
+from redis.connection import Connection
+
+from sandsnake import create_sandsnake_backend
+
+
+class RoundTripCounter(object):
+    """
+    Counts the packets sent to redis. A pipeline is sent as a single packet, so this is the number of round trips
+    """
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+        self._send = Connection.send_packed_command
+
+    def install(self):
+        counter = self
+
+        def send_packed_command(connection, command):
+            with counter._lock:
+                counter.count += 1
+            return counter._send(connection, command)
+        Connection.send_packed_command = send_packed_command
+
+    def uninstall(self):
+        Connection.send_packed_command = self._send
+
+
+def spawn_servers(server, ports):
+    processes = []
+    devnull = open(os.devnull, "w")
+    for port in ports:
+        processes.append(subprocess.Popen([server, "--port", str(port), "--save", "", "--appendonly", "no"], \
+            stdout=devnull, stderr=devnull))
+
+    for port in ports:
+        client = redis.StrictRedis(port=port)
+        for attempt in xrange(100):
+            try:
+                client.ping()
+                break
+            except redis.ConnectionError:
+                time.sleep(0.05)
+        else:
+            raise RuntimeError("redis-server did not start on port %d" % port)
+    return processes
+
+
+def commands_processed(ports):
+    #``INFO`` counts itself once it has run, so every call adds one command per host
+    return sum(redis.StrictRedis(port=port).info("stats")["total_commands_processed"] for port in ports)
+
+
+def percentile(latencies, percent):
+    latencies = sorted(latencies)
+    return latencies[min(int(len(latencies) * percent / 100.0), len(latencies) - 1)]
+
+
+def measure(name, parameters, func, calls, ports, counter):
+    """
+    Calls ``func(i)`` ``calls`` times and summarizes the calls
+    """
+    latencies = []
+    commands = commands_processed(ports)
+    counter.count = 0
+    for i in xrange(calls):
+        started = time.time()
+        func(i)
+        latencies.append(time.time() - started)
+    round_trips = counter.count
+    commands = commands_processed(ports) - commands - len(ports)
+
+    result = {
+        "operation": name,
+        "calls": calls,
+        "ops_per_sec": calls / sum(latencies),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "round_trips_per_call": float(round_trips) / calls,
+        "commands_per_call": float(commands) / calls,
+    }
+    result.update(parameters)
+    return result
+
+
+def run(backend, ports, index_sizes, fanouts, limits, calls):
+    counter = RoundTripCounter()
+    counter.install()
+    results = []
+    now = datetime.datetime.utcnow()
+
+    try:
+        for size in index_sizes:
+            backend.clear_all()
+            obj = "bench:%d" % size
+            backend.add_many(obj, (("homefeed", "item:%d" % i, 1000 + i) for i in xrange(size)))
+            backend.add_many_objects(("delete:%d" % i, "homefeed", "item", None) for i in xrange(calls))
+            parameters = {"index_size": size}
+
+            results.append(measure("add", parameters, \
+                lambda i: backend.add(obj, "homefeed", "new:%d" % i, published=now), calls, ports, counter))
+            for limit in limits:
+                results.append(measure("get", dict(parameters, limit=limit), \
+                    lambda i: backend.get(obj, "homefeed", marker=now, limit=limit), calls, ports, counter))
+                results.append(measure("get_page", dict(parameters, limit=limit), \
+                    lambda i: backend.get_page(obj, "homefeed", limit=limit), calls, ports, counter))
+            results.append(measure("get_count", parameters, \
+                lambda i: backend.get_count(obj, "homefeed", 1000 + size / 2), calls, ports, counter))
+            results.append(measure("set_markers", parameters, \
+                lambda i: backend.set_markers(obj, "homefeed", {"read": 1000 + i}), calls, ports, counter))
+            results.append(measure("get_markers", parameters, \
+                lambda i: backend.get_markers(obj, "homefeed", "read"), calls, ports, counter))
+            results.append(measure("bubble_values", parameters, \
+                lambda i: backend.bubble_values(obj, "homefeed", {"item:%d" % (i % size): now}), calls, ports, counter))
+            results.append(measure("remove_values", parameters, \
+                lambda i: backend.remove_values(obj, "homefeed", "item:%d" % (i % size)), calls, ports, counter))
+            results.append(measure("delete_index", parameters, \
+                lambda i: backend.delete_index("delete:%d" % i, "homefeed"), calls, ports, counter))
+
+        for fanout in fanouts:
+            followers = ["follower:%d" % i for i in xrange(fanout)]
+            parameters = {"fanout": fanout}
+            results.append(measure("fanout_add", parameters, \
+                lambda i: backend.fanout_add(followers, "homefeed", "new:%d" % i, published=now), calls, ports, counter))
+            results.append(measure("get_counts_since_markers", parameters, \
+                lambda i: backend.get_counts_since_markers(followers, "homefeed"), calls, ports, counter))
+    finally:
+        counter.uninstall()
+        backend.clear_all()
+
+    return results
+
+
+def parameters_key(result):
+    return tuple((name, result.get(name)) for name in ("operation", "index_size", "fanout", "limit"))
+
+
+def describe(result):
+    return " ".join("%s=%s" % (name, value) for name, value in parameters_key(result)[1:] if value is not None)
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("--redis-server", default="redis-server", help="the redis-server binary")
+    parser.add_option("--ports", default="6400,6401,6402", help="ports to spawn redis-server on, one per host")
+    parser.add_option("--index-sizes", default="100,10000", help="sizes of the benchmarked indexes")
+    parser.add_option("--fanouts", default="10,1000", help="numbers of objects to fan out to")
+    parser.add_option("--limits", default="10,100", help="page sizes to get")
+    parser.add_option("--calls", type="int", default=200, help="number of calls per operation")
+    parser.add_option("--label", default=None, help="a name for this run, such as a version or a commit")
+    parser.add_option("--output", help="file to write the results to as JSON")
+    parser.add_option("--compare", help="JSON results of an earlier run to compare with")
+    options, args = parser.parse_args(argv)
+
+    ports = [int(port) for port in options.ports.split(",")]
+    processes = spawn_servers(options.redis_server, ports)
+    try:
+        backend = create_sandsnake_backend({
+            "backend": "sandsnake.backends.redis.RedisWithBubbling",
+            "settings": {"hosts": [{"port": port, "db": 0} for port in ports]},
+        })
+        results = run(backend, ports, [int(size) for size in options.index_sizes.split(",")], \
+            [int(fanout) for fanout in options.fanouts.split(",")], \
+            [int(limit) for limit in options.limits.split(",")], options.calls)
+        redis_version = redis.StrictRedis(port=ports[0]).info()["redis_version"]
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    report = {
+        "label": options.label,
+        "python": platform.python_version(),
+        "redis_version": redis_version,
+        "hosts": len(ports),
+        "results": results,
+    }
+    if options.output:
+        with open(options.output, "w") as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+
+    baseline = {}
+    if options.compare:
+        with open(options.compare) as compare:
+            baseline = dict((parameters_key(result), result) for result in json.load(compare)["results"])
+
+    for result in results:
+        line = "%-26s %-28s %10.0f ops/s  p50 %7.3f ms  p99 %7.3f ms  %6.2f round trips  %8.2f commands" % (
+            result["operation"], describe(result), result["ops_per_sec"], result["p50_ms"], result["p99_ms"],
+            result["round_trips_per_call"], result["commands_per_call"])
+        previous = baseline.get(parameters_key(result))
+        if previous is not None:
+            line += "  %+6.1f%% ops/s" % ((result["ops_per_sec"] / previous["ops_per_sec"] - 1) * 100)
+        print line
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
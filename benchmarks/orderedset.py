@@ -0,0 +1,98 @@
+"""
+Benchmark comparing ``sandsnake.utils.OrderedSet`` with the ActiveState based recipe it replaced, whose
+deletes copied the whole list.
+
+Usage::
+
+    python benchmarks/orderedset.py [size ...]
+
+Sizes default to 100000 and 1000000. Deletes and pops are timed over a fixed number of operations, since
+the old recipe takes O(n) for each of them.
+"""
+import collections
+import random
+import sys
+import time
+
+from sandsnake.utils import OrderedSet
+
+OPERATIONS = 1000
+
+
+class LegacyOrderedSet(collections.MutableSet):
+    """
+    The ``OrderedSet`` sandsnake used to ship
+    """
+    def __init__(self, iterable=None):
+        self.items = []
+        self.map = {}
+        if iterable is not None:
+            self |= iterable
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.map
+
+    def add(self, key):
+        if key not in self.map:
+            self.map[key] = len(self.items)
+            self.items.append(key)
+        return self.map[key]
+
+    def index(self, key):
+        return self.map[key]
+
+    def discard(self, key):
+        if key in self.map:
+            loc = self.map.pop(key)
+            self.items = self.items[:loc] + self.items[loc + 1:]
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __reversed__(self):
+        return reversed(self.items)
+
+    def pop(self, last=True):
+        if not self:
+            raise KeyError('set is empty')
+        key = next(reversed(self)) if last else next(iter(self))
+        self.discard(key)
+        return key
+
+
+def timed(func):
+    started = time.time()
+    func()
+    return time.time() - started
+
+
+def bench(cls, size):
+    keys = ["activity:%d" % i for i in xrange(size)]
+    #merged feeds repeat values, so build from keys with duplicates
+    merged = keys + keys[::10]
+    deletes = random.Random(1).sample(keys, OPERATIONS)
+
+    results = {}
+    results['build'] = timed(lambda: cls(merged)) / len(merged)
+
+    ordered = cls(merged)
+    results['contains'] = timed(lambda: [key in ordered for key in keys]) / size
+    results['discard'] = timed(lambda: [ordered.discard(key) for key in deletes]) / OPERATIONS
+    results['pop first'] = timed(lambda: [ordered.pop(last=False) for i in xrange(OPERATIONS)]) / OPERATIONS
+    results['iterate'] = timed(lambda: list(ordered)) / len(ordered)
+    return results
+
+
+if __name__ == "__main__":
+    sizes = [int(size) for size in sys.argv[1:]] or [100000, 1000000]
+
+    for size in sizes:
+        old = bench(LegacyOrderedSet, size)
+        new = bench(OrderedSet, size)
+        print "%d items" % size
+        for name in ['build', 'contains', 'discard', 'pop first', 'iterate']:
+            print "  %-10s old: %10.3f us/item  new: %10.3f us/item  speedup: %8.1fx" % (
+                name, old[name] * 1e6, new[name] * 1e6, old[name] / new[name])
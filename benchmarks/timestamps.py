@@ -0,0 +1,57 @@
+"""
+Micro-benchmark comparing the timestamp conversion sandsnake used to do (``dateutil`` parsing and
+``calendar.timegm``) with the fast paths in ``sandsnake.utils``.
+
+Usage::
+
+    python benchmarks/timestamps.py [iterations]
+"""
+import calendar
+import datetime
+import sys
+import timeit
+
+from dateutil.parser import parse
+
+from sandsnake.utils import datetime_to_timestamp, datetimes_to_timestamps, parse_iso8601
+
+MARKER = "2012-01-01T12:00:00.123456"
+DATETIMES = [datetime.datetime(2012, 1, 1) + datetime.timedelta(seconds=i) for i in xrange(1000)]
+
+
+def old_timestamp(dt):
+    return long((calendar.timegm(dt.utctimetuple()) * 1000)) + (dt.microsecond / 1000)
+
+
+def old_marker():
+    return old_timestamp(parse(MARKER))
+
+
+def new_marker():
+    return datetime_to_timestamp(parse_iso8601(MARKER))
+
+
+def old_batch():
+    return [old_timestamp(dt) for dt in DATETIMES]
+
+
+def new_batch():
+    return datetimes_to_timestamps(DATETIMES)
+
+
+def bench(name, old, new, number):
+    old_time = min(timeit.repeat(old, number=number, repeat=3))
+    new_time = min(timeit.repeat(new, number=number, repeat=3))
+    print "%-20s old: %8.2f us/call  new: %8.2f us/call  speedup: %5.1fx" % (
+        name, old_time / number * 1e6, new_time / number * 1e6, old_time / new_time)
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    assert old_marker() == new_marker()
+    assert old_batch() == new_batch()
+
+    bench("string marker", old_marker, new_marker, iterations)
+    bench("datetime", lambda: old_timestamp(DATETIMES[0]), lambda: datetime_to_timestamp(DATETIMES[0]), iterations)
+    bench("batch of 1000", old_batch, new_batch, max(iterations / 1000, 10))
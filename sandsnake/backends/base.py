@@ -15,10 +15,419 @@ KIND, either express or implied.  See the License for the
 specific language governing permissions and limitations
 under the License.
 """
+from sandsnake.exceptions import SandsnakeValidationException
+from sandsnake.instrumentation import instrumented
+from sandsnake.utils import datetime_to_timestamp, datetimes_to_timestamps, parse_iso8601, prefetched
+
+from dateutil.parser import parse
+
+import base64
+import datetime
+import heapq
+
+
+#Pass as the value of a marker to ``set_markers_many`` to set it to the score of the newest item of its index
+LATEST = object()
 
 
 class BaseSandsnakeBackend(object):
+    """
+    Reads and helpers shared by every sandsnake backend. Backends set ``_max_length``, ``_max_lengths``,
+    ``_retention`` and ``_retentions`` from their settings, and implement ``_get_ranges`` and
+    ``_get_page_range`` to read from their storage.
+    """
     _backend = None
+    _instrumentation = None
+    _hot_keys = None
+    #``False`` for backends that don't wait on the network, so ``iter_indexes`` has nothing to prefetch
+    _prefetch_pages = True
 
     def get_backend(self):
         return self._backend
+
+    @instrumented
+    def get(self, obj, index_name, marker=None, limit=30, after=False, withscores=False, **kwargs):
+        """
+        Gets a list of values. Returns a maximum of ``limit`` index items. If ``after`` is ``True``
+        returns a list of values after the marker.
+
+        :type obj: string
+        :param obj: string representation of the object for who the index belongs to
+        :type index_name: string or list of strings
+        :param index_name: the name of the index(s) you want to delete
+        :type marker: string or datetime representing a date and a time
+        :param marker: the starting point to retrieve values from
+        :type limit: int
+        :param limit: the maximum number of values to get
+        :type after: boolean
+        :param after: if ``True`` gets values after ``marker`` otherwise gets it before ``marker``
+        :type withscores: boolean
+        :param withscores: if ``True``, returns results as tuples where the second item is the score
+        for that index item.
+        """
+        if self._hot_keys is not None:
+            self._hot_keys.sample('get', obj, index_name)
+
+        if marker is None:
+            raise SandsnakeValidationException("You must provide a marker to get index items.")
+        timestamp = self._get_score(marker)
+
+        results = self._get_ranges(obj, self._listify(index_name), timestamp, limit, after)
+        results = self._post_get(results, obj, index_name, marker, limit, after, withscores, **kwargs)
+
+        if len(results) == 1:
+            return results[0]
+        return results
+
+    @instrumented
+    def get_merged(self, obj, indexes, marker=None, limit=30, after=False, withscores=False, **kwargs):
+        """
+        Gets a single list of at most ``limit`` values from many indexes, ordered by score as if they
+        were a single index. Values that are in more than one index are only returned once.
+
+        :type obj: string
+        :param obj: string representation of the object for who the indexes belong to
+        :type indexes: list of strings
+        :param indexes: the names of the indexes you want to merge
+        :type marker: string or datetime representing a date and a time
+        :param marker: the starting point to retrieve values from
+        :type limit: int
+        :param limit: the maximum number of values to get
+        :type after: boolean
+        :param after: if ``True`` gets values after ``marker`` otherwise gets it before ``marker``
+        :type withscores: boolean
+        :param withscores: if ``True``, returns results as tuples where the second item is the score
+        for that index item.
+        """
+        if marker is None:
+            raise SandsnakeValidationException("You must provide a marker to get index items.")
+        timestamp = self._get_score(marker)
+
+        indexes = self._listify(indexes)
+        num = limit
+        while True:
+            results = self._get_ranges(obj, indexes, timestamp, num, after)
+            merged = self._merge_ranges(results, limit, after)
+
+            #values in more than one index can leave us short, so fetch more if any index has more to give
+            if len(merged) >= limit or all(len(result) < num for result in results):
+                break
+            num *= 2
+
+        return self._post_get([merged], obj, indexes, marker, limit, after, withscores, **kwargs)[0]
+
+    @instrumented
+    def get_page(self, obj, index_name, cursor=None, limit=30, after=False, withscores=False, **kwargs):
+        """
+        Gets a page of at most ``limit`` values and a cursor for the next page. Unlike ``get``, pages
+        never skip or repeat values that share the same score.
+
+        :type obj: string
+        :param obj: string representation of the object for who the index belongs to
+        :type index_name: string
+        :param index_name: the name of the index
+        :type cursor: string
+        :param cursor: the cursor returned with the previous page, or ``None`` to get the first page
+        :type limit: int
+        :param limit: the maximum number of values to get
+        :type after: boolean
+        :param after: if ``True`` pages from the oldest value to the newest otherwise from the newest to the oldest
+        :type withscores: boolean
+        :param withscores: if ``True``, returns results as tuples where the second item is the score
+        for that index item.
+
+        :return a tuple of the list of values and the cursor for the next page, which is ``None`` if there
+        are no more values
+        """
+        if limit < 1:
+            raise SandsnakeValidationException("The limit of a page must be at least 1, not %r." % (limit,))
+        results = self._get_page_range(obj, index_name, cursor, limit, after)
+        next_cursor = self._encode_cursor(*results[-1][::-1]) if len(results) == limit else None
+        results = self._post_get([results], obj, index_name, cursor, limit, after, withscores, **kwargs)[0]
+
+        return results, next_cursor
+
+    def iter_index(self, obj, index_name, batch_size=100, reverse=False, withscores=False, prefetch=False):
+        """
+        Iterates over every value in an index, fetching ``batch_size`` values at a time so memory use stays
+        constant no matter how big the index is.
+
+        :type obj: string
+        :param obj: string representation of the object for who the index belongs to
+        :type index_name: string
+        :param index_name: the name of the index
+        :type batch_size: int
+        :param batch_size: the number of values to fetch at a time
+        :type reverse: boolean
+        :param reverse: if ``True`` iterates from the newest value to the oldest otherwise from the oldest to the newest
+        :type withscores: boolean
+        :param withscores: if ``True``, yields tuples where the second item is the score for that index item.
+        :type prefetch: boolean
+        :param prefetch: if ``True``, the next batch is fetched in the background while the current one is consumed
+        """
+        for obj, index_name, value in self.iter_indexes([(obj, index_name)], batch_size=batch_size, \
+                reverse=reverse, withscores=withscores, prefetch=prefetch):
+            yield value
+
+    def iter_indexes(self, pairs, batch_size=100, reverse=False, withscores=False, prefetch=True):
+        """
+        Iterates over every value in many indexes, one index after the other. Yields ``(obj, index_name, value)``
+        tuples.
+
+        :type pairs: iterable
+        :param pairs: an iterable of ``(obj, index_name)`` tuples
+        :type batch_size: int
+        :param batch_size: the number of values to fetch at a time
+        :type reverse: boolean
+        :param reverse: if ``True`` iterates from the newest value to the oldest otherwise from the oldest to the newest
+        :type withscores: boolean
+        :param withscores: if ``True``, values are tuples where the second item is the score for that index item.
+        :type prefetch: boolean
+        :param prefetch: if ``True``, the next batch is fetched in the background while the current one is consumed.
+        Ignored by backends that don't wait on the network to get a batch.
+        """
+        pages = self._iter_pages(pairs, batch_size, not reverse, withscores)
+        if prefetch and self._prefetch_pages:
+            pages = prefetched(pages)
+
+        for obj, index_name, page in pages:
+            for value in page:
+                yield obj, index_name, value
+
+    def _iter_pages(self, pairs, batch_size, after, withscores):
+        """
+        Yields ``(obj, index_name, page)`` tuples for every page of every index in ``pairs``
+        """
+        for obj, index_name in pairs:
+            cursor = None
+            while True:
+                page, cursor = self.get_page(obj, index_name, cursor=cursor, limit=batch_size, \
+                    after=after, withscores=withscores)
+                if page:
+                    yield obj, index_name, page
+                if cursor is None:
+                    break
+
+    def _get_ranges(self, obj, indexes, timestamp, limit, after):
+        """
+        Gets at most ``limit`` ``(value, score)`` tuples from every index, starting at ``timestamp``.
+        Implemented by every backend.
+
+        :type obj: string
+        :param obj: string representation of the object for who the index belongs to
+        :type indexes: list
+        :param indexes: the names of the indexes
+        :type timestamp: long
+        :param timestamp: the score to start retrieving values from
+        :type limit: int
+        :param limit: the maximum number of values to get from each index
+        :type after: boolean
+        :param after: if ``True`` gets values after ``timestamp`` otherwise gets it before ``timestamp``
+        """
+        raise NotImplementedError()
+
+    def _get_page_range(self, obj, index_name, cursor, limit, after):
+        """
+        Gets the ``(value, score)`` tuples of a page of ``get_page``. Implemented by every backend.
+
+        :type obj: string
+        :param obj: string representation of the object for who the index belongs to
+        :type index_name: string
+        :param index_name: the name of the index
+        :type cursor: string
+        :param cursor: the cursor of the page, or ``None`` for the first page
+        :type limit: int
+        :param limit: the maximum number of values to get
+        :type after: boolean
+        :param after: if ``True`` pages from the oldest value to the newest otherwise from the newest to the oldest
+        """
+        raise NotImplementedError()
+
+    def _post_get(self, results, obj, index_name, marker, limit, after, withscores, **kwargs):
+        """
+        Returns a list of values after processing it.
+
+        :type obj: string
+        :param obj: string representation of the object for who the index belongs to
+        :type index_name: string or list of strings
+        :param index_name: the name of the index(s) you want to delete
+        :type marker: string or datetime representing a date and a time
+        :param marker: the starting point to retrieve values from
+        :type limit: int
+        :param limit: the maximum number of values to get
+        :type after: boolean
+        :param after: if ``True`` gets values after ``marker`` otherwise gets it before ``marker``
+        :type withscores: boolean
+        :param withscores: if ``True``, returns results as tuples where the second item is the score
+        for that index item.
+        """
+        if withscores:
+            processed_values = results
+        else:
+            processed_values = []
+            for result in results:
+                processed_values.append(map(lambda x: x[0], result))
+
+        return processed_values
+
+    def _listify(self, list_or_string):
+        """
+        A simple helper that converts a single ``index_name`` into a list of 1
+
+        :type list_or_string: string or list
+        :param list_or_string: the name of things as a string or a list of strings
+        """
+        if isinstance(list_or_string, basestring):
+            list_or_string = [list_or_string]
+        else:
+            list_or_string = list_or_string
+
+        return list_or_string
+
+    def _parse_date(self, date=None):
+        """
+        Makes a best effort to convert ``date`` into a datetime object, resorting to ``datetime.datetime.utcnow()`` when everything fales
+
+        :type date: anything
+        :param date: something that represents a date and a time
+        """
+        dt = None
+        if date is None or not isinstance(date, datetime.datetime):
+            if isinstance(date, basestring):
+                dt = parse_iso8601(date)
+                if dt is None:
+                    try:
+                        dt = parse(date)
+                    except ValueError:
+                        dt = datetime.datetime.utcnow()
+            else:
+                dt = datetime.datetime.utcnow()
+        else:
+            dt = date
+        return dt
+
+    def _get_timestamp(self, dt_obj):
+        """
+        returns a unix timestamp representing the ``datetime`` object
+        """
+        return datetime_to_timestamp(dt_obj)
+
+    def _get_score(self, value):
+        """
+        Converts ``value`` into a score. Integers are assumed to already be scores (milliseconds since the
+        epoch) and are used as is, anything else is parsed with ``_parse_date``.
+
+        :type value: anything
+        :param value: something that represents a date and a time
+        """
+        if isinstance(value, (int, long)) and not isinstance(value, bool):
+            return long(value)
+        return self._get_timestamp(self._parse_date(value))
+
+    def _get_scores(self, values):
+        """
+        Converts many values into scores at once. See ``_get_score``.
+
+        :type values: list
+        :param values: things that represent dates and times
+        """
+        if all(type(value) is datetime.datetime for value in values):
+            return datetimes_to_timestamps(values)
+        return [self._get_score(value) for value in values]
+
+    def _merge_ranges(self, results, limit, after):
+        """
+        Merges lists of ``(value, score)`` tuples that are already ordered by score into a single list of
+        at most ``limit`` unique values.
+
+        :type results: list
+        :param results: a list of lists of ``(value, score)`` tuples
+        :type limit: int
+        :param limit: the maximum number of values in the merged list
+        :type after: boolean
+        :param after: ``True`` if the lists are in ascending order, ``False`` if they are in descending order
+        """
+        direction = 1 if after else -1
+        ranges = [[(direction * score, i, j, value) for j, (value, score) in enumerate(result)] \
+            for i, result in enumerate(results)]
+
+        values = set()
+        merged = []
+        for score, i, j, value in heapq.merge(*ranges):
+            if value in values:
+                continue
+            values.add(value)
+            merged.append((value, direction * score))
+            if len(merged) == limit:
+                break
+        return merged
+
+    def _encode_cursor(self, score, value):
+        """
+        Encodes the score and value of the last item of a page into an opaque cursor
+
+        :type score: long
+        :param score: the score of the item
+        :type value: string
+        :param value: the value of the item
+        """
+        return base64.urlsafe_b64encode("%d:%s" % (score, value))
+
+    def _decode_cursor(self, cursor):
+        """
+        Decodes a cursor created by ``_encode_cursor`` into a ``(score, value)`` tuple
+
+        :type cursor: string
+        :param cursor: the cursor
+        """
+        try:
+            score, value = base64.urlsafe_b64decode(str(cursor)).split(":", 1)
+            return long(score), value
+        except (TypeError, ValueError):
+            raise SandsnakeValidationException("Invalid cursor: %r" % (cursor,))
+
+    def _get_max_length(self, index):
+        """
+        Gets the maximum number of items ``index`` can hold, or ``None`` if the index is not capped.
+        ``max_lengths`` in the backend settings overrides the global ``max_length`` for specific indexes.
+
+        :type index: string
+        :param index: the name of the index
+        """
+        return self._max_lengths.get(index, self._max_length)
+
+    def _get_retention(self, index):
+        """
+        Gets the retention window of ``index`` in milliseconds, or ``None`` if items in the index never expire.
+        ``retentions`` in the backend settings overrides the global ``retention`` for specific indexes.
+
+        :type index: string
+        :param index: the name of the index
+        """
+        retention = self._retentions.get(index, self._retention)
+        if retention is None:
+            return None
+        if isinstance(retention, datetime.timedelta):
+            return (retention.days * 86400 + retention.seconds) * 1000 + retention.microseconds / 1000
+        return long(retention * 1000)
+
+    def _get_bubble_scores(self, values_dict):
+        """
+        Parses the scores of a ``values_dict`` passed to ``bubble_values`` into a new dictionary
+
+        :type values_dict: dict
+        :param values_dict: a dictionary where keys are the keys for the activity and values are the new score
+        """
+        scores = {}
+        for key, value in values_dict.items():
+            #we we did not provide a custom score, then just set it the the current timestamp
+            if value is None:
+                score = self._get_timestamp(datetime.datetime.utcnow())
+            else:
+                #Try to parse the score as a long. If it doesn't work, try to parse a date.
+                try:
+                    score = long(value)
+                except (ValueError, TypeError):
+                    score = self._get_timestamp(self._parse_date(date=value))
+            scores[key] = score
+        return scores
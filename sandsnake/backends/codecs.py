@@ -0,0 +1,241 @@
+"""
+Copyright 2012 Numan Sachwani <numan@7Geese.com>
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+from __future__ import absolute_import
+
+from sandsnake.backends import scripts
+from sandsnake.cache import LRUCache
+from sandsnake.exceptions import SandsnakeValidationException
+
+import binascii
+import collections
+import uuid
+
+
+class IdentityCodec(object):
+    """
+    Encodes activities into the members of the sorted sets that hold indexes, and decodes them back.
+
+    This codec stores activities as they are. Other codecs store them in less memory, which also makes
+    big pages faster to read. Every value read back from an index is a string, whatever type was added.
+    """
+    #``True`` if members are the activities themselves, so there is nothing to decode
+    transparent = True
+
+    def bind(self, backend):
+        """
+        Called once by the backend that uses this codec
+
+        :type backend: sandsnake.backends.redis.Redis
+        :param backend: the backend
+        """
+        pass
+
+    def encode(self, value):
+        return value
+
+    def decode(self, member):
+        return member
+
+    def encode_many(self, values, create=True):
+        """
+        Encodes a list of activities into members
+
+        :type values: list
+        :param values: the activities
+        :type create: boolean
+        :param create: if ``False``, activities that were never encoded before are encoded as ``None``
+        instead of being assigned a member
+        """
+        return map(self.encode, values)
+
+    def decode_many(self, members):
+        """
+        Decodes a list of members back into activities. Members that can't be decoded are left out.
+
+        :type members: list
+        :param members: the members
+        """
+        return map(self.decode, members)
+
+    def decode_known(self, members):
+        """
+        Decodes a list of members into a dictionary of activities by member. Members that can't be decoded
+        are left out.
+
+        :type members: list
+        :param members: the members
+        """
+        return dict((member, self.decode(member)) for member in members)
+
+
+class IntegerCodec(IdentityCodec):
+    """
+    Stores non negative integer ids (``123456789`` or ``"123456789"``) as big endian bytes, without
+    leading zero bytes. Ids are decoded as strings.
+    """
+    transparent = False
+
+    def encode(self, value):
+        try:
+            number = long(value)
+        except (TypeError, ValueError):
+            number = -1
+        if number < 0 or (isinstance(value, basestring) and str(number) != value):
+            raise SandsnakeValidationException("Not an integer id: %r" % (value,))
+
+        hex_number = "%x" % number
+        if len(hex_number) % 2:
+            hex_number = "0" + hex_number
+        return binascii.unhexlify(hex_number)
+
+    def decode(self, member):
+        return str(long(binascii.hexlify(member), 16))
+
+
+class UUIDCodec(IdentityCodec):
+    """
+    Stores UUIDs, in any format ``uuid.UUID`` accepts, as their 16 raw bytes. UUIDs are decoded in their
+    canonical ``12345678-1234-5678-1234-567812345678`` format.
+    """
+    transparent = False
+
+    def encode(self, value):
+        try:
+            return (value if isinstance(value, uuid.UUID) else uuid.UUID(value)).bytes
+        except (AttributeError, TypeError, ValueError):
+            raise SandsnakeValidationException("Not a UUID: %r" % (value,))
+
+    def decode(self, member):
+        return str(uuid.UUID(bytes=member))
+
+
+class InternedCodec(IdentityCodec):
+    """
+    Assigns every activity a sequential integer id the first time it is added, and stores that id like
+    ``IntegerCodec``. Works for activities of any format.
+
+    Ids are kept in redis hashes that every process shares. The dictionary is split into ``shards`` hashes
+    (the schema's ``member_dictionary_shard_name``), spread over the hosts, and an activity belongs to the
+    shard of its CRC32. Every shard counts its own ids, and the shard is kept in the id itself
+    (``id % shards``), so ``shards`` can't change once ids were assigned.
+
+    Ids never change, so every process keeps the ids it has seen in a local cache of ``cache_size`` entries.
+    The dictionary is never trimmed, so it grows with the number of distinct activities. Members whose
+    id is not in the dictionary anymore are left out of what is read.
+    """
+    transparent = False
+
+    def __init__(self, cache_size=100000, shards=16):
+        """
+        :type cache_size: int
+        :param cache_size: the maximum number of ids and activities cached by this process
+        :type shards: int
+        :param shards: the number of hashes the dictionary is split into
+        """
+        self._integers = IntegerCodec()
+        self._cache = LRUCache(max_size=cache_size, ttl=float("inf"))
+        self._shards = shards
+        self._backend = None
+
+    def bind(self, backend):
+        self._backend = backend
+        self._dictionaries = [backend._schema.member_dictionary_shard_name(shard) for shard in xrange(self._shards)]
+        backend._scripts.register('intern', scripts.INTERN)
+
+    def encode(self, value):
+        return self.encode_many([value])[0]
+
+    def decode(self, member):
+        return self.decode_known([member]).get(member)
+
+    def _value_shard(self, value):
+        return binascii.crc32(value) % self._shards
+
+    def _execute_per_shard(self, values_by_shard, get_command):
+        """
+        Runs one command per shard, grouped by host
+
+        :type values_by_shard: dict
+        :param values_by_shard: lists of values by shard number
+        :type get_command: function
+        :param get_command: called with the shard and its values, returns a ``(command, args)`` tuple
+        :return a list of ``(value, result)`` tuples
+        """
+        backend = self._backend
+        commands = collections.defaultdict(list)
+        shards = collections.defaultdict(list)
+        for shard, values in values_by_shard.items():
+            host = backend._get_host(self._dictionaries[shard])
+            commands[host].append(get_command(shard, values))
+            shards[host].append(values)
+
+        found = []
+        for host, results in backend._execute_per_host(commands).items():
+            for values, result in zip(shards[host], results):
+                found.extend(zip(values, result))
+        return found
+
+    def encode_many(self, values, create=True):
+        values = [str(value) for value in values]
+        ids = [self._cache.get("values", value) for value in values]
+
+        #ids are assigned in the order values are first seen
+        missing = collections.defaultdict(list)
+        for value in collections.OrderedDict((value, True) for value, id in zip(values, ids) if id is None):
+            missing[self._value_shard(value)].append(value)
+
+        if missing:
+            if create:
+                get_command = lambda shard, shard_values: self._backend._scripts.get_command('intern', \
+                    [self._dictionaries[shard]], [self._shards, shard] + shard_values)
+            else:
+                get_command = lambda shard, shard_values: ('hmget', \
+                    (self._dictionaries[shard], ["v:" + value for value in shard_values]))
+            found = dict(self._execute_per_shard(missing, get_command))
+
+            for i, value in enumerate(values):
+                if ids[i] is None and found[value] is not None:
+                    ids[i] = found[value]
+                    self._cache.set("values", value, ids[i])
+
+        return [None if id is None else self._integers.encode(id) for id in ids]
+
+    def decode_many(self, members):
+        values = self.decode_known(members)
+        return [values[member] for member in members if member in values]
+
+    def decode_known(self, members):
+        values = {}
+        missing = collections.defaultdict(list)
+        for member in set(members):
+            value = self._cache.get("ids", member)
+            if value is None:
+                id = self._integers.decode(member)
+                missing[long(id) % self._shards].append(id)
+            else:
+                values[member] = value
+
+        if missing:
+            get_command = lambda shard, ids: ('hmget', (self._dictionaries[shard], ["i:" + id for id in ids]))
+            for id, value in self._execute_per_shard(missing, get_command):
+                if value is not None:
+                    member = self._integers.encode(id)
+                    values[member] = value
+                    self._cache.set("ids", member, value)
+
+        return values
@@ -0,0 +1,813 @@
+"""
+Copyright 2012 Numan Sachwani <numan@7Geese.com>
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+from sandsnake.backends.base import BaseSandsnakeBackend, LATEST
+from sandsnake.exceptions import SandsnakeValidationException
+from sandsnake.hotkeys import HotKeyTracker
+from sandsnake.instrumentation import instrumented, Instrumentation
+
+import bisect
+import datetime
+import threading
+
+
+def _to_string(value):
+    """
+    Converts a value into the string redis stores for it, the same way redis-py does
+
+    :param value: the value
+    """
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, long)):
+        return str(value)
+    if isinstance(value, float):
+        return repr(value)
+    if not isinstance(value, unicode):
+        value = unicode(value)
+    return value.encode('utf-8')
+
+
+class SortedIndex(object):
+    """
+    A sorted set of values ordered by integer score, then by value, like a redis sorted set. Items are kept
+    in a sorted list of ``(score, value)`` tuples, searched with ``bisect``, next to a dictionary of values
+    to scores.
+
+    Finding a value or a range of values takes O(log n), but inserting and deleting an item takes O(n):
+    the list is shifted with a ``memmove``. That is cheap for indexes of up to a few hundred thousand items,
+    the sizes ``max_length`` keeps sandsnake indexes at, but an index much bigger than that is better kept
+    in the ``Redis`` backend, whose skip lists insert in O(log n).
+    """
+    __slots__ = ('_items', '_scores')
+
+    def __init__(self):
+        self._items = []
+        self._scores = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, value):
+        return value in self._scores
+
+    def score(self, value):
+        """
+        Gets the score of ``value``, or ``None`` if it is not in the index
+        """
+        return self._scores.get(value)
+
+    def add(self, value, score):
+        """
+        Adds ``value`` with ``score``, moving it if it is already in the index
+
+        :return ``True`` if the value was added or moved
+        """
+        current = self._scores.get(value)
+        if current == score:
+            return False
+        if current is not None:
+            del self._items[bisect.bisect_left(self._items, (current, value))]
+        bisect.insort(self._items, (score, value))
+        self._scores[value] = score
+        return True
+
+    def remove(self, value):
+        """
+        Removes ``value`` from the index
+
+        :return ``True`` if the value was in the index
+        """
+        score = self._scores.pop(value, None)
+        if score is None:
+            return False
+        del self._items[bisect.bisect_left(self._items, (score, value))]
+        return True
+
+    def count(self, low=None, high=None):
+        """
+        Counts the values with a score between ``low`` and ``high``, both inclusive. ``None`` means no bound.
+        """
+        return self._upper(high) - self._lower(low)
+
+    def range_by_score(self, low=None, high=None, limit=None, reverse=False):
+        """
+        Gets at most ``limit`` ``(value, score)`` tuples with a score between ``low`` and ``high``, both
+        inclusive. Items are in ascending order, or descending order if ``reverse`` is ``True``.
+        """
+        start, stop = self._lower(low), self._upper(high)
+        if limit is not None:
+            if reverse:
+                start = max(start, stop - limit)
+            else:
+                stop = min(stop, start + limit)
+        return self._as_results(self._items[start:stop], reverse)
+
+    def range_after(self, score, value, limit, reverse=False):
+        """
+        Gets at most ``limit`` ``(value, score)`` tuples that come strictly after ``(score, value)`` in
+        ascending order, or strictly before it in descending order if ``reverse`` is ``True``.
+        """
+        if reverse:
+            stop = bisect.bisect_left(self._items, (score, value))
+            return self._as_results(self._items[max(stop - limit, 0):stop], reverse)
+        start = bisect.bisect_right(self._items, (score, value))
+        return self._as_results(self._items[start:start + limit], reverse)
+
+    def newest(self):
+        """
+        Gets the ``(value, score)`` tuple with the highest score, or ``None`` if the index is empty
+        """
+        if not self._items:
+            return None
+        score, value = self._items[-1]
+        return value, score
+
+    def trim(self, max_length):
+        """
+        Removes the items with the lowest scores until at most ``max_length`` items are left
+
+        :return the values removed
+        """
+        return self._remove_first(len(self._items) - max_length)
+
+    def remove_below(self, score):
+        """
+        Removes the items with a score lower than ``score``
+
+        :return the values removed
+        """
+        return self._remove_first(self._lower(score))
+
+    def _remove_first(self, count):
+        if count <= 0:
+            return []
+        removed = [value for score, value in self._items[:count]]
+        del self._items[:count]
+        for value in removed:
+            del self._scores[value]
+        return removed
+
+    def _lower(self, score):
+        #``(score,)`` sorts before every item with that score
+        return 0 if score is None else bisect.bisect_left(self._items, (score,))
+
+    def _upper(self, score):
+        #scores are integers, so ``(score + 1,)`` sorts after every item with that score
+        return len(self._items) if score is None else bisect.bisect_left(self._items, (score + 1,))
+
+    def _as_results(self, items, reverse):
+        if reverse:
+            items.reverse()
+        return [(value, score) for score, value in items]
+
+
+class Memory(BaseSandsnakeBackend):
+    """
+    Keeps indexes in the memory of the current process with the same API and ordering as the ``Redis``
+    backend. Useful for tests and for small deployments that run in a single process. Like redis, activities
+    and markers are stored as strings, so values are read back as the strings the ``Redis`` backend returns.
+
+    Supports the ``max_length``, ``max_lengths``, ``retention``, ``retentions``, ``reverse_index``,
+    ``instrumentation`` and ``hot_keys`` settings of the ``Redis`` backend. Every call is serialized by a
+    lock, so the backend can be shared by threads.
+    """
+    _prefetch_pages = False
+
+    def __init__(self, settings, **kwargs):
+        self._reverse_index = settings.get("reverse_index", False)
+        self._max_length = settings.get("max_length", None)
+        self._max_lengths = settings.get("max_lengths", {})
+        self._retention = settings.get("retention", None)
+        self._retentions = settings.get("retentions", {})
+
+        hot_keys_settings = settings.get("hot_keys", None)
+        self._hot_keys = HotKeyTracker(**hot_keys_settings) if hot_keys_settings is not None else None
+
+        sinks = settings.get("instrumentation", None)
+        self._instrumentation = Instrumentation(sinks) if sinks is not None else None
+
+        #``(obj, index name)`` to ``SortedIndex``
+        self._indexes = {}
+        #obj to the set of the names of its indexes
+        self._collections = {}
+        #activity to the set of ``(obj, index name)`` tuples it was added to
+        self._locations = {}
+        self._lock = threading.RLock()
+
+    def get_cache(self):
+        """
+        The memory backend has no read cache, so this always returns ``None``
+        """
+        return None
+
+    def get_instrumentation(self):
+        """
+        returns the ``Instrumentation`` that hands the spans of every operation to its sinks, or ``None`` if
+        instrumentation is not enabled
+        """
+        return self._instrumentation
+
+    def get_hot_keys(self):
+        """
+        returns the ``HotKeyTracker`` of the most frequently accessed indexes, or ``None`` if it is not enabled
+        """
+        return self._hot_keys
+
+    @instrumented
+    def clear_all(self, batch_size=1000, progress=None):
+        """
+        Deletes all ``sandsnake`` related data
+
+        :type batch_size: int
+        :param batch_size: ignored, kept for compatibility with the ``Redis`` backend
+        :type progress: callable
+        :param progress: called with ``0`` and the number of structures deleted once they are deleted
+
+        :return the number of structures (indexes, index collections, markers and reverse index entries) deleted
+        """
+        with self._lock:
+            deleted = self._clear()
+
+        if progress is not None:
+            progress(0, deleted)
+        return deleted
+
+    def _clear(self):
+        deleted = len(self._indexes) + len(self._collections) + len(self._locations)
+        self._indexes.clear()
+        self._collections.clear()
+        self._locations.clear()
+        return deleted
+
+    @instrumented
+    def get_count(self, obj, index, published, after=False):
+        """
+        Gets the number of items in the index. If ``after`` is ``False``,
+        it gets the number of items in the index less than ``published``.
+
+        If ``after`` is ``True``, it gets the number of items in the index
+        greater than ``published``.
+
+        :type obj: string
+        :param obj: string representation of the object for who the index belongs to
+        :type index: string
+        :param index: the name of the index you want to add the activity to
+        :type published: datetime
+        :param published: the published within the index where we want to start the count
+        :type after: boolean
+        :param after: determins if we are dealing with after or before offset
+
+        :return the number of index items before or after the offset
+        """
+        if self._hot_keys is not None:
+            self._hot_keys.sample('get_count', obj, index)
+
+        timestamp = self._get_score(published)
+
+        with self._lock:
+            sorted_index = self._indexes.get((obj, index))
+            if sorted_index is None:
+                return 0
+            if after:
+                return sorted_index.count(low=timestamp)
+            return sorted_index.count(high=timestamp)
+
+    @instrumented
+    def add(self, obj, index_name, activity, published=None):
+        """
+        Adds an activity to a index(s) of an object.
+
+        :type obj: string
+        :param obj: string representation of the object for who the index belongs to
+        :type index_name: string or list of strings
+        :param index_name: the name of the index(s) you want to add the activity to
+        :type activity: string
+        :param activity: string representation of the activity you want to add to the index(s)
+        :type published: datetime
+        :param published: the time this activity was published
+        """
+        self.add_many_objects([(obj, index_name, activity, published)])
+
+    @instrumented
+    def add_many(self, obj, items):
+        """
+        Adds many activities to the indexes of an object.
+
+        :type obj: string
+        :param obj: string representation of the object for who the index belongs to
+        :type items: iterable
+        :param items: an iterable of ``(index_name, activity, published)`` tuples. ``index_name`` can be a string
+        or a list of strings and ``published`` can be ``None``, in which case the current time is used.
+        """
+        self.add_many_objects(((obj,) + tuple(item) for item in items))
+
+    @instrumented
+    def add_many_objects(self, items):
+        """
+        Adds many activities to the indexes of many objects.
+
+        :type items: iterable
+        :param items: an iterable of ``(obj, index_name, activity, published)`` tuples. ``index_name`` can be
+        a string or a list of strings and ``published`` can be ``None``, in which case the current time is used.
+        """
+        items = list(items)
+        timestamps = self._get_scores([item[3] for item in items])
+
+        added = []
+        trimmed = []
+        with self._lock:
+            for (obj, index_name, activity, published), timestamp in zip(items, timestamps):
+                if self._hot_keys is not None:
+                    self._hot_keys.sample('add', obj, index_name)
+
+                activity = _to_string(activity)
+                indexes = self._listify(index_name)
+                for index in indexes:
+                    trimmed.extend((obj, [index], value) for value in self._add(obj, index, activity, timestamp))
+                added.append((obj, indexes, activity, timestamp))
+
+            self._post_add_many(added)
+            self._post_remove_many(trimmed)
+
+    @instrumented
+    def fanout_add(self, objs, index_name, activity, published=None, chunk_size=None):
+        """
+        Adds an activity to the same index of many objects.
+
+        :type objs: iterable
+        :param objs: string representations of the objects for who the indexes belong to
+        :type index_name: string
+        :param index_name: the name of the index you want to add the activity to
+        :type activity: string
+        :param activity: string representation of the activity you want to add to the indexes
+        :type published: datetime
+        :param published: the time this activity was published
+        :type chunk_size: int
+        :param chunk_size: ignored, kept for compatibility with the ``Redis`` backend
+
+        :return ``{0: {'success': ..., 'failure': 0}}`` with the number of writes, counted like the ``Redis``
+        backend counts commands
+        """
+        objs = list(objs)
+        self.add_many_objects((obj, index_name, activity, published) for obj in objs)
+        return {0: {'success': 2 * len(objs), 'failure': 0}}
+
+    def _add(self, obj, index, activity, timestamp):
+        """
+        Adds an activity to an index, trimming the index if it is capped
+
+        :return the values trimmed
+        """
+        sorted_index = self._indexes.get((obj, index))
+        if sorted_index is None:
+            sorted_index = self._indexes[(obj, index)] = SortedIndex()
+            self._collections.setdefault(obj, set()).add(index)
+
+        sorted_index.add(activity, timestamp)
+        max_length = self._get_max_length(index)
+        if max_length is not None:
+            return sorted_index.trim(max_length)
+        return []
+
+    @instrumented
+    def remove_values(self, obj, index_name, value):
+        """
+        Deletes activities from an index that belongs to a object
+
+        :type obj: string
+        :param obj: string representation of the object for who the index belongs to
+        :type index_name: string
+        :param index_name: the name of the index you want to delete the values from
+        :type value: string or list
+        :param value: string representation of the value you want to add to the index(s)
+        """
+        values = map(_to_string, self._listify(value))
+
+        with self._lock:
+            sorted_index = self._indexes.get((obj, index_name))
+            if sorted_index is not None:
+                for value in values:
+                    sorted_index.remove(value)
+            self._post_remove_many([(obj, [index_name], value) for value in values])
+
+    @instrumented
+    def remove(self, obj, index_name, activity):
+        """
+        Deletes an activity from a index or a list of indexes that belongs to a object
+
+        :type obj: string
+        :param obj: string representation of the object for who the index belongs to
+        :type index_name: string or list of strings
+        :param index_name: the name of the index(s) you want to delete the activity from
+        :type activity: string
+        :param activity: string representation of the activity you want to add to the index(s)
+        """
+        indexes = self._listify(index_name)
+        activity = _to_string(activity)
+
+        with self._lock:
+            for index in indexes:
+                sorted_index = self._indexes.get((obj, index))
+                if sorted_index is not None:
+                    sorted_index.remove(activity)
+            self._post_remove_many([(obj, indexes, activity)])
+
+    @instrumented
+    def delete_index(self, obj, index_name):
+        """
+        Completely deletes the index for an object. With the ``reverse_index`` setting, the values of the
+        index are passed on to ``_post_remove_many``.
+
+        :type obj: string
+        :param obj: string representation of the object for who the index belongs to
+        :type index_name: string or list of strings
+        :param index_name: the name of the index(s) you want to delete
+        """
+        indexes = self._listify(index_name)
+        if not indexes:
+            return
+
+        removed = []
+        with self._lock:
+            collection = self._collections.get(obj, set())
+            for index in indexes:
+                sorted_index = self._indexes.pop((obj, index), None)
+                collection.discard(index)
+                if sorted_index is not None and self._reverse_index:
+                    removed.extend((obj, [index], value) for value, score in sorted_index.range_by_score())
+            if not collection:
+                self._collections.pop(obj, None)
+
+            self._post_remove_many(removed)
+            self._post_delete_index(obj, indexes)
+
+    @instrumented
+    def retract(self, activity):
+        """
+        Removes an activity from every index it was added to. Requires the ``reverse_index`` setting.
+
+        :type activity: string
+        :param activity: string representation of the activity you want to remove
+
+        :return the number of indexes the activity was removed from
+        """
+        if not self._reverse_index:
+            raise SandsnakeValidationException("retract requires the reverse_index setting")
+        activity = _to_string(activity)
+
+        with self._lock:
+            removed = []
+            for obj, index in self._locations.pop(activity, ()):
+                sorted_index = self._indexes.get((obj, index))
+                if sorted_index is not None and sorted_index.remove(activity):
+                    removed.append((obj, [index], activity))
+
+            self._post_remove_many(removed)
+            return len(removed)
+
+    @instrumented
+    def trim_expired(self, objs, now=None):
+        """
+        Removes items older than the retention window from all the indexes of ``objs``. The retention
+        window is set with ``retention`` in the backend settings and can be overridden for specific
+        indexes with ``retentions``. Both take a ``timedelta`` or a number of seconds.
+
+        :type objs: list
+        :param objs: string representations of the objects whose indexes should be trimmed
+        :type now: datetime
+        :param now: the time the retention window is relative to. Defaults to the current utc time
+
+        :return the number of items removed
+        """
+        now = self._get_timestamp(now or datetime.datetime.utcnow())
+
+        removed = []
+        with self._lock:
+            for obj in objs:
+                for index in self._collections.get(obj, ()):
+                    retention = self._get_retention(index)
+                    if retention is not None:
+                        removed.extend((obj, [index], value) \
+                            for value in self._indexes[(obj, index)].remove_below(now - retention))
+            self._post_remove_many(removed)
+        return len(removed)
+
+    def _get_page_range(self, obj, index_name, cursor, limit, after):
+        """
+        Gets the ``(value, score)`` tuples of a page of ``get_page``. See ``BaseSandsnakeBackend._get_page_range``.
+        """
+        with self._lock:
+            sorted_index = self._indexes.get((obj, index_name))
+            if sorted_index is None:
+                return []
+            if cursor is None:
+                return sorted_index.range_by_score(limit=limit, reverse=not after)
+            score, value = self._decode_cursor(cursor)
+            return sorted_index.range_after(score, value, limit, reverse=not after)
+
+    def _get_ranges(self, obj, indexes, timestamp, limit, after):
+        """
+        Gets at most ``limit`` ``(value, score)`` tuples from every index, starting at ``timestamp``.
+        """
+        results = []
+        with self._lock:
+            for index in indexes:
+                sorted_index = self._indexes.get((obj, index))
+                if sorted_index is None:
+                    results.append([])
+                elif after:
+                    results.append(sorted_index.range_by_score(low=timestamp, limit=limit))
+                else:
+                    results.append(sorted_index.range_by_score(high=timestamp, limit=limit, reverse=True))
+        return results
+
+    def _post_add(self, obj, indexes, activity, timestamp):
+        """
+        Called after an activity has been added to indexes.
+
+        :type obj: string
+        :param obj: string representation of the object for who the index belongs to
+        :type indexes: list
+        :param indexes: a list of the names of the indexes to which the ``activity`` has been added
+        :type activity: string
+        :param activity: the name of the activity
+        :type timestamp: the score of the activity
+        :param timestamp: the score of the activity
+        """
+        pass
+
+    def _post_add_many(self, added):
+        """
+        Called after a batch of activities has been added to indexes. By default, calls ``_post_add``
+        for every activity and records the locations of the activities in the reverse index.
+
+        :type added: list
+        :param added: a list of ``(obj, indexes, activity, timestamp)`` tuples, one for every activity added
+        """
+        for obj, indexes, activity, timestamp in added:
+            self._post_add(obj, indexes, activity, timestamp)
+            if self._reverse_index:
+                self._locations.setdefault(activity, set()).update((obj, index) for index in indexes)
+
+    def _post_remove(self, obj, indexes, activity):
+        """
+        Called after ``activity`` has been removed from ``indexes``
+
+        :type obj: string
+        :param obj: string representation of the object for who the index belongs to
+        :type indexes: list
+        :param indexes: a list of the names of the indexes from which the ``activity`` has been removed
+        :type activity: string
+        :param activity: the name of the activity
+        """
+        pass
+
+    def _post_remove_many(self, removed):
+        """
+        Called after a batch of activities has been removed from indexes. By default, calls ``_post_remove``
+        for every activity and removes the locations of the activities from the reverse index.
+
+        :type removed: list
+        :param removed: a list of ``(obj, indexes, activity)`` tuples, one for every activity removed
+        """
+        for obj, indexes, activity in removed:
+            self._post_remove(obj, indexes, activity)
+            locations = self._locations.get(activity)
+            if locations is not None:
+                locations.difference_update((obj, index) for index in indexes)
+                if not locations:
+                    del self._locations[activity]
+
+    def _post_delete_index(self, obj, indexes):
+        """
+        Called after ``indexes`` have been deleted.
+
+        :type obj: string
+        :param obj: string representation of the object for who the index belongs to
+        :type indexes: list
+        :param indexes: a list of the names of the indexes that have been deleted
+        """
+        pass
+
+
+class MemoryWithMarker(Memory):
+    """
+    The ``Memory`` backend with the markers of ``RedisWithMarker``
+    """
+    def __init__(self, *args, **kwargs):
+        super(MemoryWithMarker, self).__init__(*args, **kwargs)
+        self._default_marker_name = kwargs.get('default_marker_name', "_ssdefault")
+        #obj to a dictionary of ``(index name, marker name)`` tuples to markers
+        self._markers = {}
+
+    def _clear(self):
+        deleted = super(MemoryWithMarker, self)._clear() + len(self._markers)
+        self._markers.clear()
+        return deleted
+
+    @instrumented
+    def set_markers(self, obj, index_name, markers_dict):
+        """
+        Allows you to set custom markers for a ``index`` belonging to an ``obj`
+
+        :type obj: string
+        :param obj: string representation of the object for who the index belongs to
+        :type index_name: string
+        :param index_name: the name of the index you want to update the markers for
+        :type markers_dict: dict
+        :param markers_dict: a dictionary when they keys are the marker names and values are the marker's new value. If the marker does not exist, it will be created
+        """
+        self.set_markers_many([(obj, index_name, key, value) for key, value in markers_dict.items()])
+
+    @instrumented
+    def set_markers_many(self, markers):
+        """
+        Sets markers of many indexes belonging to many objects. Pass ``LATEST`` as the value of a marker to set
+        it to the score of the newest item in its index (markers of empty indexes are left alone).
+
+        :type markers: iterable
+        :param markers: an iterable of ``(obj, index_name, marker_name, value)`` tuples. ``marker_name`` can
+        be ``None`` to set the default marker
+        """
+        with self._lock:
+            for obj, index_name, marker_name, value in markers:
+                if value is LATEST:
+                    sorted_index = self._indexes.get((obj, index_name))
+                    newest = sorted_index.newest() if sorted_index is not None else None
+                    if newest is None:
+                        continue
+                    value = newest[1]
+
+                marker_name = marker_name if marker_name is not None else self._default_marker_name
+                #stored as redis would store it and parsed when read, like ``RedisWithMarker``
+                self._markers.setdefault(obj, {})[(index_name, marker_name)] = _to_string(value)
+
+    @instrumented
+    def get_markers(self, obj, index_name, marker, **kwargs):
+        """
+        Gets custom markers for a ``index`` belonging to an ``obj``
+
+        :type obj: string
+        :param obj: string representation of the object for who the index belongs to
+        :type index_name: string
+        :param index_name: the name of the index you want to update the markers for
+        :type marker: string or list
+        :param marker: a string or a list of strings of the name of the markers you want
+        """
+        results = self.get_markers_many([(obj, index_name, name) for name in self._listify(marker)])
+        if len(results) == 1:
+            return results[0]
+        return results
+
+    @instrumented
+    def get_markers_many(self, markers):
+        """
+        Gets markers of many indexes belonging to many objects.
+
+        :type markers: iterable
+        :param markers: an iterable of ``(obj, index_name, marker_name)`` tuples. ``marker_name`` can be
+        ``None`` to get the default marker
+
+        :return a list with the value of every marker, in the same order as ``markers``. Markers that are
+        not set are ``None``
+        """
+        results = []
+        with self._lock:
+            for obj, index_name, marker_name in markers:
+                marker_name = marker_name if marker_name is not None else self._default_marker_name
+                value = self._markers.get(obj, {}).get((index_name, marker_name))
+                results.append(None if value is None else long(value))
+        return results
+
+    @instrumented
+    def get_default_marker(self, obj, index_name, **kwargs):
+        """
+        Gets the default marker for the ``index`` belonging to an ``obj``
+
+        :type obj: string
+        :param obj: string representation of the object for who the index belongs to
+        :type index_name: string
+        :param index_name: the name of the index you want to update the markers for
+        """
+        return self.get_markers(obj, index_name, self._default_marker_name)
+
+    @instrumented
+    def get_counts_since_markers(self, objs, index_name, marker_name=None):
+        """
+        Gets the number of items added to the ``index`` of many objects since their marker, like calling
+        ``get_count(obj, index_name, marker, after=True)`` with every object's marker.
+
+        :type objs: list
+        :param objs: string representations of the objects for who the indexes belong to
+        :type index_name: string
+        :param index_name: the name of the index
+        :type marker_name: string
+        :param marker_name: the name of the marker. Defaults to the default marker
+
+        :return a dictionary where keys are the objects and values are the number of items with a score
+        greater than or equal to the object's marker. Objects without the marker count every item
+        """
+        objs = list(objs)
+        counts = {}
+        with self._lock:
+            markers = self.get_markers_many([(obj, index_name, marker_name) for obj in objs])
+            for obj, marker in zip(objs, markers):
+                sorted_index = self._indexes.get((obj, index_name))
+                counts[obj] = sorted_index.count(low=marker) if sorted_index is not None else 0
+        return counts
+
+    def _post_delete_index(self, obj, indexes):
+        """
+        Called after ``indexes`` have been deleted.
+
+        :type obj: string
+        :param obj: string representation of the object for who the index belongs to
+        :type indexes: list
+        :param indexes: a list of the names of the indexes that have been deleted
+        """
+        super(MemoryWithMarker, self)._post_delete_index(obj, indexes)
+        markers = self._markers.get(obj)
+        if markers is not None:
+            #like ``RedisWithMarker``, only the default marker is deleted with the index
+            for index in indexes:
+                markers.pop((index, self._default_marker_name), None)
+            if not markers:
+                del self._markers[obj]
+
+
+class MemoryWithBubbling(MemoryWithMarker):
+    """
+    The ``Memory`` backend with the markers of ``RedisWithMarker`` and the bubbling of ``RedisWithBubbling``
+    """
+    @instrumented
+    def bubble_values(self, obj, index_name, values_dict):
+        """
+        Moves values up and down the sorted set based on score (in most cases, a timestamp)
+        **NOTE:** If you decide to use timestamps, use UTC so you don't get screwed over by timezones.
+
+        :type obj: string
+        :param obj: a unique string identifing the object
+        :type index_name: string
+        :param index_name: a unique string identifing a index
+        :type values_dict: dict
+        :param values_dict: a dictionary where keys are the keys for the activity and values are the new
+        score for the activity. You can pass ``None`` as the score for any activity and it will assign the score
+        to the current utc timestamp.
+        """
+        self.bubble_values_many([(obj, index_name)], values_dict)
+
+    @instrumented
+    def bubble_values_many(self, targets, values_dict, only_if_present=False, only_if_greater=False):
+        """
+        Moves values up and down the indexes of many objects.
+
+        :type targets: iterable
+        :param targets: an iterable of ``(obj, index_name)`` tuples
+        :type values_dict: dict
+        :param values_dict: a dictionary where keys are the keys for the activity and values are the new
+        score for the activity, like ``bubble_values``. ``values_dict`` is not modified
+        :type only_if_present: boolean
+        :param only_if_present: if ``True``, values that are not in an index are not added to it
+        :type only_if_greater: boolean
+        :param only_if_greater: if ``True``, values are only moved up
+
+        :return the number of values whose score changed, added values included
+        """
+        scores = dict((_to_string(value), score) for value, score in self._get_bubble_scores(values_dict).items())
+
+        moved = 0
+        with self._lock:
+            for obj, index_name in targets:
+                sorted_index = self._indexes.get((obj, index_name))
+                if sorted_index is None:
+                    if only_if_present:
+                        continue
+                    sorted_index = self._indexes[(obj, index_name)] = SortedIndex()
+                    self._collections.setdefault(obj, set()).add(index_name)
+
+                for value, score in scores.items():
+                    current = sorted_index.score(value)
+                    if current is None and only_if_present:
+                        continue
+                    if current is not None and only_if_greater and score <= current:
+                        continue
+                    if sorted_index.add(value, score):
+                        moved += 1
+                    if current is None and self._reverse_index:
+                        self._locations.setdefault(value, set()).add((obj, index_name))
+        return moved
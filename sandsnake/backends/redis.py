@@ -15,16 +15,26 @@ KIND, either express or implied.  See the License for the
 specific language governing permissions and limitations
 under the License.
 """
-from sandsnake.backends.base import BaseSandsnakeBackend
+from __future__ import absolute_import
+
+from sandsnake.backends import scripts
+from sandsnake.backends.base import BaseSandsnakeBackend, LATEST
+from sandsnake.backends.codecs import IdentityCodec
+from sandsnake.backends.schema import KeySchema
+from sandsnake.backends.scripts import ScriptRegistry
+from sandsnake.cache import LRUCache
 from sandsnake.exceptions import SandsnakeValidationException
+from sandsnake.hotkeys import HotKeyTracker
+from sandsnake.instrumentation import bind, instrumented, Instrumentation, RecordingMap
+from sandsnake.utils import chunks, import_string, WorkerPool
 
 from nydus.db import create_cluster
+from nydus.utils import ThreadPool
+from redis.exceptions import NoScriptError, RedisError, ResponseError
 
-from dateutil.parser import parse
-
-import calendar
+import collections
 import datetime
-import itertools
+import time
 
 
 class Redis(BaseSandsnakeBackend):
@@ -35,7 +45,11 @@ class Redis(BaseSandsnakeBackend):
         if not hosts:
             raise Exception("No redis hosts specified")
 
+        host_timeout = settings.get("host_timeout", None)
         for i, host in enumerate(hosts):
+            #commands sent outside of ``_execute_per_host`` are bounded by the socket timeout instead
+            if host_timeout is not None and host.get("timeout") is None:
+                host = dict(host, timeout=host_timeout)
             nydus_hosts[i] = host
 
         defaults = settings.get(
@@ -52,7 +66,55 @@ class Redis(BaseSandsnakeBackend):
             'defaults': defaults,
         })
 
-        self._prefix = kwargs.get('prefix', "ssnake:")
+        hot_keys_settings = settings.get("hot_keys", None)
+        self._hot_keys = HotKeyTracker(**hot_keys_settings) if hot_keys_settings is not None else None
+
+        sinks = settings.get("instrumentation", None)
+        if sinks is not None:
+            self._instrumentation = Instrumentation(sinks)
+            self._instrumentation.install(self._backend)
+        else:
+            self._instrumentation = None
+
+        key_schema = settings.get("key_schema", None)
+        if key_schema is None:
+            key_schema = KeySchema(prefix=kwargs.get('prefix', "ssnake:"))
+        elif isinstance(key_schema, basestring):
+            key_schema = import_string(key_schema)(**settings.get("key_schema_options", {}))
+        self._schema = key_schema
+        self._prefix = key_schema.prefix
+
+        self._scripts = ScriptRegistry(self._backend)
+        self._scripts.register('add_trim', scripts.ADD_TRIM)
+        self._scripts.register('delete_indexes', scripts.DELETE_INDEXES)
+        self._scripts.register('pop_indexes', scripts.POP_INDEXES)
+        self._scripts.register('remove_expired', scripts.REMOVE_EXPIRED)
+        self._scripts.register('pop_members', scripts.POP_MEMBERS)
+        self._scripts.register('page_after', scripts.PAGE_AFTER)
+
+        member_codec = settings.get("member_codec", None)
+        if member_codec is None:
+            member_codec = IdentityCodec()
+        elif isinstance(member_codec, basestring):
+            member_codec = import_string(member_codec)(**settings.get("member_codec_options", {}))
+        member_codec.bind(self)
+        self._codec = member_codec
+
+        self._pipeline_size = settings.get("pipeline_size", 500)
+        self._host_timeout = host_timeout
+        self._pool = WorkerPool(settings.get("workers", min(len(hosts), 16)))
+        self._reverse_index = settings.get("reverse_index", False)
+        self._max_length = settings.get("max_length", None)
+        self._max_lengths = settings.get("max_lengths", {})
+        self._retention = settings.get("retention", None)
+        self._retentions = settings.get("retentions", {})
+
+        cache_settings = settings.get("cache", None)
+        if cache_settings is not None:
+            self._cache = LRUCache(max_size=cache_settings.get("max_size", 10000), ttl=cache_settings.get("ttl", 1))
+            self._marker_bucket = cache_settings.get("marker_bucket", 0)
+        else:
+            self._cache = None
 
     def get_backend(self):
         """
@@ -60,21 +122,94 @@ class Redis(BaseSandsnakeBackend):
         """
         return self._backend
 
-    def clear_all(self):
+    def get_cache(self):
+        """
+        returns the in-process read cache, or ``None`` if caching is not enabled
+        """
+        return self._cache
+
+    def get_instrumentation(self):
+        """
+        returns the ``Instrumentation`` that hands the spans of every operation to its sinks, or ``None`` if
+        instrumentation is not enabled
+        """
+        return self._instrumentation
+
+    def get_hot_keys(self):
+        """
+        returns the ``HotKeyTracker`` of the most frequently accessed indexes, or ``None`` if it is not enabled
         """
-        Deletes all ``sandsnake`` related data from redis.
+        return self._hot_keys
+
+    @instrumented
+    def clear_all(self, batch_size=1000, progress=None):
+        """
+        Deletes all ``sandsnake`` related data from redis. Every host is walked in parallel with
+        ``SCAN`` and keys are deleted in batches with ``UNLINK`` so redis is never blocked for long.
 
         .. warning::
 
             Very expensive and destructive operation. Use with causion
+
+        :type batch_size: int
+        :param batch_size: the number of keys to scan and delete at a time
+        :type progress: callable
+        :param progress: called with the host number and the number of keys deleted on that host so far
+        after every batch
+
+        :return the number of keys deleted
         """
-        keys = self._backend.keys()
+        pool = ThreadPool(len(self._backend))
+        for host in self._backend:
+            pool.add(host, bind(self._clear_host), (host, batch_size, progress))
 
-        for key in itertools.chain(*keys):
-            with self._backend.map() as conn:
-                if key.startswith(self._prefix):
-                    conn.delete(key)
+        if self._cache is not None:
+            self._cache.clear()
 
+        deleted = 0
+        for host, results in pool.join().items():
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+                deleted += result
+        return deleted
+
+    def _clear_host(self, host, batch_size, progress):
+        """
+        Deletes all ``sandsnake`` related data from a single host.
+
+        :type host: int
+        :param host: the number of the host
+        :type batch_size: int
+        :param batch_size: the number of keys to scan and delete at a time
+        :type progress: callable
+        :param progress: called with the host number and the number of keys deleted so far after every batch
+        """
+        connection = self._backend[host].connection
+        command = 'UNLINK'
+        cursor, deleted = None, 0
+
+        while cursor != 0:
+            cursor, keys = connection.scan(cursor or 0, match=self._prefix + "*", count=batch_size)
+            cursor = long(cursor)
+            if not keys:
+                continue
+
+            try:
+                deleted += connection.execute_command(command, *keys)
+            except ResponseError:
+                #``UNLINK`` is only available in redis 4.0 and later
+                if command == 'DEL':
+                    raise
+                command = 'DEL'
+                deleted += connection.execute_command(command, *keys)
+
+            if progress is not None:
+                progress(host, deleted)
+
+        return deleted
+
+    @instrumented
     def get_count(self, obj, index, published, after=False):
         """
         Gets the number of items in the index. If ``after`` is ``False``,
@@ -94,9 +229,11 @@ class Redis(BaseSandsnakeBackend):
 
         :return the number of index items before or after the offset
         """
+        if self._hot_keys is not None:
+            self._hot_keys.sample('get_count', obj, index)
+
         index_name = self._get_index_name(obj, index)
-        published = self._parse_date(published)
-        timestamp = self._get_timestamp(published)
+        timestamp = self._get_score(published)
 
         if after:
             start = timestamp
@@ -107,6 +244,7 @@ class Redis(BaseSandsnakeBackend):
 
         return self._backend.zcount(index_name, start, end)
 
+    @instrumented
     def add(self, obj, index_name, activity, published=None):
         """
         Adds an activity to a index(s) of an object.
@@ -120,23 +258,171 @@ class Redis(BaseSandsnakeBackend):
         :type published: datetime
         :param published: the time this activity was published
         """
-        if published is None:
-            published = datetime.datetime.utcnow()
-        published = self._parse_date(published)
-        timestamp = self._get_timestamp(published)
+        if self._hot_keys is not None:
+            self._hot_keys.sample('add', obj, index_name)
+
+        timestamp = self._get_score(published)
+        member = self._codec.encode_many([activity])[0]
 
         indexes = self._listify(index_name)
         indexes_added = []
+        trimmed = []
+        commands = collections.defaultdict(list)
 
-        with self._backend.map() as conn:
-            for index in indexes:
-                index_name = self._get_index_name(obj, index)
-                indexes_added.append(index_name)
-                conn.zadd(index_name, timestamp, activity)
-                conn.sadd(self._get_index_collection_name(obj), index)
+        collection_name = self._get_index_collection_name(obj)
+        for index in indexes:
+            index_name = self._get_index_name(obj, index)
+            indexes_added.append(index_name)
 
-        self._post_add(obj, indexes_added, activity, timestamp)
+            host = self._get_host(index_name)
+            command = self._get_add_command(index, index_name, timestamp, member)
+            if command[0] == 'evalsha':
+                trimmed.append((host, len(commands[host]), index_name))
+            commands[host].append(command)
+            commands[self._get_host(collection_name)].append(('sadd', (collection_name, index)))
 
+        results = self._execute_per_host(commands)
+
+        self._post_add_many([(obj, indexes_added, activity, timestamp)])
+        self._post_remove_many([(obj, [index_name], value) for host, position, index_name in trimmed \
+            for value in self._codec.decode_many(results[host][position])])
+
+    @instrumented
+    def add_many(self, obj, items):
+        """
+        Adds many activities to the indexes of an object. Much faster than calling ``add`` in a loop
+        since commands are grouped by host and sent as pipelines.
+
+        :type obj: string
+        :param obj: string representation of the object for who the index belongs to
+        :type items: iterable
+        :param items: an iterable of ``(index_name, activity, published)`` tuples. ``index_name`` can be a string
+        or a list of strings and ``published`` can be ``None``, in which case the current time is used.
+        """
+        self.add_many_objects(((obj,) + tuple(item) for item in items))
+
+    @instrumented
+    def add_many_objects(self, items):
+        """
+        Adds many activities to the indexes of many objects. Commands are grouped by host and sent in
+        pipelines of at most ``pipeline_size`` items, so ``items`` can be a generator of any size.
+
+        :type items: iterable
+        :param items: an iterable of ``(obj, index_name, activity, published)`` tuples. ``index_name`` can be
+        a string or a list of strings and ``published`` can be ``None``, in which case the current time is used.
+        """
+        collections_added = set()
+
+        for chunk in chunks(items, self._pipeline_size):
+            commands = collections.defaultdict(list)
+            added = []
+            trimmed = []
+
+            timestamps = self._get_scores([item[3] for item in chunk])
+            members = self._codec.encode_many([item[2] for item in chunk])
+            for (obj, index_name, activity, published), timestamp, member in zip(chunk, timestamps, members):
+                if self._hot_keys is not None:
+                    self._hot_keys.sample('add', obj, index_name)
+
+                indexes_added = []
+                for index in self._listify(index_name):
+                    index_name = self._get_index_name(obj, index)
+                    indexes_added.append(index_name)
+
+                    host = self._get_host(index_name)
+                    command = self._get_add_command(index, index_name, timestamp, member)
+                    if command[0] == 'evalsha':
+                        trimmed.append((host, len(commands[host]), obj, index_name))
+                    commands[host].append(command)
+
+                    #only add the index to the collection once per call
+                    if (obj, index) not in collections_added:
+                        collections_added.add((obj, index))
+                        collection_name = self._get_index_collection_name(obj)
+                        commands[self._get_host(collection_name)].append(('sadd', (collection_name, index)))
+
+                added.append((obj, indexes_added, activity, timestamp))
+
+            results = self._execute_per_host(commands)
+            self._post_add_many(added)
+            self._post_remove_many([(obj, [index_name], value) for host, position, obj, index_name in trimmed \
+                for value in self._codec.decode_many(results[host][position])])
+
+    @instrumented
+    def fanout_add(self, objs, index_name, activity, published=None, chunk_size=None):
+        """
+        Adds an activity to the same index of many objects. Objects are grouped by the host their index
+        lives on and written in pipelines of at most ``chunk_size`` commands, so ``objs`` can be a generator
+        of any size.
+
+        :type objs: iterable
+        :param objs: string representations of the objects for who the indexes belong to
+        :type index_name: string
+        :param index_name: the name of the index you want to add the activity to
+        :type activity: string
+        :param activity: string representation of the activity you want to add to the indexes
+        :type published: datetime
+        :param published: the time this activity was published
+        :type chunk_size: int
+        :param chunk_size: the maximum number of commands per pipeline. Defaults to ``pipeline_size``
+
+        :return a dictionary where keys are host numbers and values are dictionaries with the number of
+        commands that succeeded (``success``) and failed (``failure``) on that host
+        """
+        timestamp = self._get_score(published)
+        member = self._codec.encode_many([activity])[0]
+        chunk_size = chunk_size or self._pipeline_size
+
+        counts = {}
+        buffers = collections.defaultdict(list)
+
+        def flush(host):
+            commands, buffers[host] = buffers[host], []
+            host_counts = counts.setdefault(host, {'success': 0, 'failure': 0})
+            try:
+                results = self._execute_on_host(host, [command[:2] for command in commands], raise_on_error=False)
+            except RedisError:
+                results = [None] * len(commands)
+                host_counts['failure'] += len(commands)
+            else:
+                failed = len(filter(lambda result: isinstance(result, Exception), results))
+                host_counts['failure'] += failed
+                host_counts['success'] += len(results) - failed
+
+            added = []
+            trimmed = []
+            for (command, args, obj), result in zip(commands, results):
+                if result is None or isinstance(result, Exception):
+                    continue
+                if command == 'zadd':
+                    added.append((obj, [args[0]], activity, timestamp))
+                elif command == 'evalsha':
+                    added.append((obj, [args[2]], activity, timestamp))
+                    trimmed.extend((obj, [args[2]], value) for value in self._codec.decode_many(result))
+            self._post_add_many(added)
+            self._post_remove_many(trimmed)
+
+        for obj in objs:
+            if self._hot_keys is not None:
+                self._hot_keys.sample('add', obj, index_name)
+
+            index_key = self._get_index_name(obj, index_name)
+            collection_name = self._get_index_collection_name(obj)
+
+            for key, command in ((index_key, self._get_add_command(index_name, index_key, timestamp, member)),\
+                (collection_name, ('sadd', (collection_name, index_name)))):
+                host = self._get_host(key)
+                buffers[host].append(command + (obj,))
+                if len(buffers[host]) >= chunk_size:
+                    flush(host)
+
+        for host in buffers.keys():
+            if buffers[host]:
+                flush(host)
+
+        return counts
+
+    @instrumented
     def remove_values(self, obj, index_name, value):
         """
         Deletes activities from an index that belongs to a object
@@ -150,12 +436,14 @@ class Redis(BaseSandsnakeBackend):
         """
         values = self._listify(value)
         index = self._get_index_name(obj, index_name)
-        for value in values:
-            self._backend.zrem(index, value)
+        #values that were never encoded can't be in the index
+        members = filter(lambda member: member is not None, self._codec.encode_many(values, create=False))
+        if members:
+            self._backend.zrem(index, *members)
 
-        for value in values:
-            self._post_remove(obj, [index], value)
+        self._post_remove_many([(obj, [index], value) for value in values])
 
+    @instrumented
     def remove(self, obj, index_name, activity):
         """
         Deletes an activity from a index or a list of indexes that belongs to a object
@@ -169,18 +457,22 @@ class Redis(BaseSandsnakeBackend):
         """
         indexes = self._listify(index_name)
         indexes_removed = []
+        member = self._codec.encode_many([activity], create=False)[0]
 
-        with self._backend.map() as conn:
+        with self._map() as conn:
             for index in indexes:
                 index_name = self._get_index_name(obj, index)
                 indexes_removed.append(index_name)
-                conn.zrem(index_name, activity)
+                if member is not None:
+                    conn.zrem(index_name, member)
 
-        self._post_remove(obj, indexes_removed, activity)
+        self._post_remove_many([(obj, indexes_removed, activity)])
 
+    @instrumented
     def delete_index(self, obj, index_name):
         """
-        Completely deletes the index for an object
+        Completely deletes the index for an object. With the ``reverse_index`` setting, the values of the
+        index are read as it is deleted and passed on to ``_post_remove_many``.
 
         :type obj: string
         :param obj: string representation of the object for who the index belongs to
@@ -188,90 +480,266 @@ class Redis(BaseSandsnakeBackend):
         :param index_name: the name of the index(s) you want to delete
         """
         indexes = self._listify(index_name)
+        if not indexes:
+            return
         indexes_removed = []
+        index_names = collections.defaultdict(list)
+
+        for index in indexes:
+            index_name = self._get_index_name(obj, index)
+            indexes_removed.append(index_name)
+            index_names[self._get_host(index_name)].append(index_name)
+
+        #The indexes that live with the collection are deleted by the same script that cleans up the
+        #collection. If the collection is empty, there is no point in taking up more room.
+        collection_name = self._get_index_collection_name(obj)
+        collection_host = self._get_host(collection_name)
+        commands = collections.defaultdict(list)
+        popped = {}
+        if self._reverse_index:
+            #read the values of the indexes as they are deleted, so their locations can be removed
+            for host, names in index_names.items():
+                commands[host].append(self._scripts.get_command('pop_indexes', names, []))
+            popped, index_names = index_names, {}
+        commands[collection_host].append(self._scripts.get_command('delete_indexes', \
+            [collection_name] + index_names.pop(collection_host, []), indexes))
+        for host, names in index_names.items():
+            commands[host].append(('delete', tuple(names)))
+
+        results = self._execute_per_host(commands)
+
+        if self._reverse_index:
+            removed = []
+            for host, names in popped.items():
+                for index, values in zip(names, results[host][0]):
+                    removed.extend((obj, [index], value) for value in self._codec.decode_many(values))
+            self._post_remove_many(removed)
 
-        with self._backend.map() as conn:
-            for index in indexes:
-                index_name = self._get_index_name(obj, index)
-                indexes_removed.append(index_name)
+        self._post_delete_index(obj, indexes_removed)
 
-                conn.delete(index_name)
-                conn.srem(self._get_index_collection_name(obj), index)
-        #If the list is empty, there is no point in taking up more room.
-        if self._backend.scard(self._get_index_collection_name(obj)) == 0:
-            self._backend.delete(self._get_index_collection_name(obj))
+    @instrumented
+    def retract(self, activity):
+        """
+        Removes an activity from every index it was added to. Requires the ``reverse_index`` setting, which
+        records where every activity is added, so this costs a round trip per host the activity lives on
+        instead of a scan of every index.
 
-        self._post_delete_index(obj, indexes_removed)
+        Only activities added while ``reverse_index`` was enabled are found.
+
+        :type activity: string
+        :param activity: string representation of the activity you want to remove
+
+        :return the number of indexes the activity was removed from
+        """
+        if not self._reverse_index:
+            raise SandsnakeValidationException("retract requires the reverse_index setting")
+
+        #read and delete the locations atomically, so locations added in the meantime aren't lost
+        locations = self._scripts.call('pop_members', [self._get_activity_locations_name(activity)], [])
+        member = self._codec.encode_many([activity], create=False)[0]
+        if not locations or member is None:
+            return 0
+
+        commands = collections.defaultdict(list)
+        locations = [(obj, self._get_index_name(obj, index)) for obj, index in map(self._decode_location, locations)]
+        for obj, index in locations:
+            commands[self._get_host(index)].append(('zrem', (index, member)))
+        results = self._execute_per_host(commands)
+
+        removed = []
+        positions = collections.defaultdict(int)
+        for obj, index in locations:
+            host = self._get_host(index)
+            if results[host][positions[host]]:
+                removed.append((obj, [index], activity))
+            positions[host] += 1
+
+        self._post_remove_many(removed)
+        return len(removed)
+
+    @instrumented
+    def trim_expired(self, objs, now=None):
+        """
+        Removes items older than the retention window from all the indexes of ``objs``. The retention
+        window is set with ``retention`` in the backend settings and can be overridden for specific
+        indexes with ``retentions``. Both take a ``timedelta`` or a number of seconds.
+
+        :type objs: list
+        :param objs: string representations of the objects whose indexes should be trimmed
+        :type now: datetime
+        :param now: the time the retention window is relative to. Defaults to the current utc time
+
+        :return the number of items removed
+        """
+        now = self._get_timestamp(now or datetime.datetime.utcnow())
+
+        commands = collections.defaultdict(list)
+        host_objs = collections.defaultdict(list)
+        for obj in objs:
+            collection_name = self._get_index_collection_name(obj)
+            host = self._get_host(collection_name)
+            commands[host].append(('smembers', (collection_name,)))
+            host_objs[host].append(obj)
+
+        commands, results = collections.defaultdict(list), self._execute_per_host(commands, raise_on_error=False)
+        for host, host_results in results.items():
+            for obj, indexes in zip(host_objs[host], host_results):
+                #keys that only look like index collections aren't sets
+                if isinstance(indexes, Exception):
+                    continue
+                for index in indexes:
+                    retention = self._get_retention(index)
+                    if retention is None:
+                        continue
+                    index_name = self._get_index_name(obj, index)
+                    commands[self._get_host(index_name)].append((obj, self._scripts.get_command('remove_expired', \
+                        [index_name], ["(%d" % (now - retention)])))
+
+        results = self._execute_per_host(dict((host, [command for obj, command in host_commands]) \
+            for host, host_commands in commands.items()))
+
+        removed = []
+        for host, host_commands in commands.items():
+            for (obj, (command, args)), values in zip(host_commands, results[host]):
+                removed.extend((obj, [args[2]], value) for value in self._codec.decode_many(values))
+        self._invalidate([args[2] for host_commands in commands.values() for obj, (command, args) in host_commands])
+        self._post_remove_many(removed)
+        return len(removed)
+
+    def _get_page_range(self, obj, index_name, cursor, limit, after):
+        """
+        Gets the ``(member, score)`` tuples of a page of ``get_page``. See ``BaseSandsnakeBackend._get_page_range``.
+        """
+        index = self._get_index_name(obj, index_name)
+
+        if cursor is None:
+            if after:
+                results = self._backend.zrangebyscore(index, "-inf", "+inf", start=0, num=limit, \
+                    withscores=True, score_cast_func=long)
+            else:
+                results = self._backend.zrevrangebyscore(index, "+inf", "-inf", start=0, num=limit, \
+                    withscores=True, score_cast_func=long)
+        else:
+            score, value = self._decode_cursor(cursor)
+            page = self._scripts.call('page_after', [index], [score, value, limit, 1 if after else 0])
+            if page is not None:
+                return [(page[i], long(page[i + 1])) for i in xrange(0, len(page), 2)]
+
+            #the last value we returned is gone, so read every value with its score. Values with the same
+            #score are ordered by value, so resume right after the last value we returned
+            with self._map() as conn:
+                if after:
+                    ties = conn.zrangebyscore(index, score, score, withscores=True, score_cast_func=long)
+                    rest = conn.zrangebyscore(index, "(%d" % score, "+inf", start=0, num=limit, \
+                        withscores=True, score_cast_func=long)
+                else:
+                    ties = conn.zrevrangebyscore(index, score, score, withscores=True, score_cast_func=long)
+                    rest = conn.zrevrangebyscore(index, "(%d" % score, "-inf", start=0, num=limit, \
+                        withscores=True, score_cast_func=long)
+
+            if after:
+                ties = [tie for tie in ties if tie[0] > value]
+            else:
+                ties = [tie for tie in ties if tie[0] < value]
+            results = (ties + list(rest))[:limit]
+
+        return results
 
-    def get(self, obj, index_name, marker=None, limit=30, after=False, withscores=False, **kwargs):
+    def _get_ranges(self, obj, indexes, timestamp, limit, after):
         """
-        Gets a list of values. Returns a maximum of ``limit`` index items. If ``after`` is ``True``
-        returns a list of values after the marker.
+        Gets at most ``limit`` ``(value, score)`` tuples from every index, starting at ``timestamp``.
 
         :type obj: string
         :param obj: string representation of the object for who the index belongs to
-        :type index_name: string or list of strings
-        :param index_name: the name of the index(s) you want to delete
-        :type marker: string or datetime representing a date and a time
-        :param marker: the starting point to retrieve values from
+        :type indexes: list
+        :param indexes: the names of the indexes
+        :type timestamp: long
+        :param timestamp: the score to start retrieving values from
         :type limit: int
-        :param limit: the maximum number of values to get
+        :param limit: the maximum number of values to get from each index
         :type after: boolean
-        :param after: if ``True`` gets values after ``marker`` otherwise gets it before ``marker``
-        :type withscores: boolean
-        :param withscores: if ``True``, returns results as tuples where the second item is the score
-        for that index item.
+        :param after: if ``True`` gets values after ``timestamp`` otherwise gets it before ``timestamp``
         """
-        if marker is None:
-            raise SandsnakeValidationException("You must provide a marker to get index items.")
-        marker = self._parse_date(marker)
-        timestamp = self._get_timestamp(marker)
+        index_names = [self._get_index_name(obj, index) for index in indexes]
+        if self._cache is None:
+            return self._fetch_ranges(index_names, range(len(index_names)), [None] * len(index_names), \
+                timestamp, limit, after)
+
+        #markers in the same bucket share a cache entry
+        bucket_timestamp = timestamp
+        if self._marker_bucket:
+            bucket_timestamp -= timestamp % self._marker_bucket
+            if not after:
+                bucket_timestamp += self._marker_bucket - 1
+        cache_key = (bucket_timestamp, limit, after)
+
+        results = [self._cache.get(index_name, cache_key) for index_name in index_names]
+        missing = [i for i, result in enumerate(results) if result is None]
+        self._fetch_ranges(index_names, missing, results, bucket_timestamp, limit, after)
+        for i in missing:
+            results[i] = list(results[i])
+            self._cache.set(index_names[i], cache_key, results[i])
+
+        if bucket_timestamp == timestamp:
+            #never hand out the cached lists themselves
+            return [list(result) for result in results]
+
+        #bring the ranges of the bucket back to the marker. A full range that loses values may have been
+        #cut short by ``limit``, so those indexes are read again from the marker itself
+        incomplete = []
+        for i, result in enumerate(results):
+            if after:
+                results[i] = [item for item in result if item[1] >= timestamp]
+            else:
+                results[i] = [item for item in result if item[1] <= timestamp]
+            if len(result) == limit and len(results[i]) < limit:
+                incomplete.append(i)
+        return self._fetch_ranges(index_names, incomplete, results, timestamp, limit, after)
 
-        indexes = self._listify(index_name)
+    def _fetch_ranges(self, index_names, positions, results, timestamp, limit, after):
+        """
+        Reads the ranges of the indexes at ``positions`` of ``index_names`` into ``results``, in a single
+        round trip per host. See ``_get_ranges``.
 
-        results = []
-        with self._backend.map() as conn:
-            for index in indexes:
+        :return ``results``
+        """
+        if not positions:
+            return results
+
+        with self._map() as conn:
+            for i in positions:
                 if after:
-                    results.append(conn.zrangebyscore(self._get_index_name(obj, index), timestamp, \
-                        "+inf", start=0, num=limit, withscores=True, score_cast_func=long))
+                    results[i] = conn.zrangebyscore(index_names[i], timestamp, \
+                        "+inf", start=0, num=limit, withscores=True, score_cast_func=long)
                 else:
-                    results.append(conn.zrevrangebyscore(self._get_index_name(obj, index), timestamp, \
-                        "-inf", start=0, num=limit, withscores=True, score_cast_func=long))
-
-        results = self._post_get(results, obj, index_name, marker, limit, \
-            after, withscores, **kwargs)
+                    results[i] = conn.zrevrangebyscore(index_names[i], timestamp, \
+                        "-inf", start=0, num=limit, withscores=True, score_cast_func=long)
 
-        if len(results) == 1:
-            return results[0]
+        for i in positions:
+            results[i] = list(results[i])
         return results
 
     def _post_get(self, results, obj, index_name, marker, limit, after, withscores, **kwargs):
         """
-        Returns a list of values after processing it.
+        Decodes the members of ``results`` with the member codec before processing them. See
+        ``BaseSandsnakeBackend._post_get``.
+        """
+        return super(Redis, self)._post_get(self._decode_ranges(results), obj, index_name, marker, limit, \
+            after, withscores, **kwargs)
 
-        :type obj: string
-        :param obj: string representation of the object for who the index belongs to
-        :type index_name: string or list of strings
-        :param index_name: the name of the index(s) you want to delete
-        :type marker: string or datetime representing a date and a time
-        :param marker: the starting point to retrieve values from
-        :type limit: int
-        :param limit: the maximum number of values to get
-        :type after: boolean
-        :param after: if ``True`` gets values after ``marker`` otherwise gets it before ``marker``
-        :type withscores: boolean
-        :param withscores: if ``True``, returns results as tuples where the second item is the score
-        for that index item.
+    def _decode_ranges(self, results):
         """
-        if withscores:
-            processed_values = results
-        else:
-            processed_values = []
-            for result in results:
-                processed_values.append(map(lambda x: x[0], result))
+        Decodes the members of lists of ``(member, score)`` tuples with the member codec. Members that
+        can't be decoded are left out.
 
-        return processed_values
+        :type results: list
+        :param results: a list of lists of ``(member, score)`` tuples
+        """
+        if self._codec.transparent:
+            return results
+
+        values = self._codec.decode_known([member for result in results for member, score in result])
+        return [[(values[member], score) for member, score in result if member in values] for result in results]
 
     def _post_add(self, obj, indexes, activity, timestamp):
         """
@@ -286,7 +754,22 @@ class Redis(BaseSandsnakeBackend):
         :type timestamp: the score of the activity
         :param timestamp: the score of the activity
         """
-        pass
+        self._invalidate(indexes)
+
+    def _post_add_many(self, added):
+        """
+        Called after a batch of activities has been added to indexes. By default, calls ``_post_add``
+        for every activity and records the locations of the activities in the reverse index in bulk.
+        Subclasses can override this to do their work in bulk.
+
+        :type added: list
+        :param added: a list of ``(obj, indexes, activity, timestamp)`` tuples, one for every activity added
+        """
+        for obj, indexes, activity, timestamp in added:
+            self._post_add(obj, indexes, activity, timestamp)
+
+        if self._reverse_index:
+            self._update_locations('sadd', [(obj, indexes, activity) for obj, indexes, activity, timestamp in added])
 
     def _post_remove(self, obj, indexes, activity):
         """
@@ -299,7 +782,43 @@ class Redis(BaseSandsnakeBackend):
         :type activity: string
         :param activity: the name of the activity
         """
-        pass
+        self._invalidate(indexes)
+
+    def _post_remove_many(self, removed):
+        """
+        Called after a batch of activities has been removed from indexes. By default, calls ``_post_remove``
+        for every activity and removes the locations of the activities from the reverse index in bulk.
+        Subclasses can override this to do their work in bulk.
+
+        :type removed: list
+        :param removed: a list of ``(obj, indexes, activity)`` tuples, one for every activity removed
+        """
+        for obj, indexes, activity in removed:
+            self._post_remove(obj, indexes, activity)
+
+        if self._reverse_index:
+            self._update_locations('srem', removed)
+
+    def _update_locations(self, command, changes):
+        """
+        Adds or removes the locations of activities in the reverse index. Locations are stored as the object
+        and the name of the index, not the index key, so they stay valid when the key schema changes.
+
+        :type command: string
+        :param command: ``sadd`` to add locations or ``srem`` to remove them
+        :type changes: list
+        :param changes: a list of ``(obj, indexes, activity)`` tuples, where ``indexes`` are index keys
+        """
+        locations = collections.OrderedDict()
+        for obj, indexes, activity in changes:
+            locations.setdefault(self._get_activity_locations_name(activity), []).extend(\
+                self._encode_location(obj, self._schema.index_from_index_name(obj, index)) for index in indexes)
+
+        commands = collections.defaultdict(list)
+        for locations_name, activity_locations in locations.items():
+            if activity_locations:
+                commands[self._get_host(locations_name)].append((command, (locations_name,) + tuple(activity_locations)))
+        self._execute_per_host(commands)
 
     def _post_delete_index(self, obj, indexes):
         """
@@ -310,7 +829,18 @@ class Redis(BaseSandsnakeBackend):
         :type indexes: list
         :param indexes: a list of ``indexes`` to which the ``activity`` has been added
         """
-        pass
+        self._invalidate(indexes)
+
+    def _invalidate(self, keys):
+        """
+        Removes everything read from ``keys`` from the in-process read cache
+
+        :type keys: list
+        :param keys: the names of redis keys that have changed
+        """
+        if self._cache is not None:
+            for key in keys:
+                self._cache.invalidate(key)
 
     def _get_index_name(self, obj, index):
         """
@@ -321,7 +851,7 @@ class Redis(BaseSandsnakeBackend):
         :type index_name: string
         :param index_name: the name of the index
         """
-        return "%(prefix)sobj:%(obj)s:index:%(index)s" % {'prefix': self._prefix, 'obj': obj, 'index': index}
+        return self._schema.index_name(obj, index)
 
     def _get_index_collection_name(self, obj):
         """
@@ -330,54 +860,168 @@ class Redis(BaseSandsnakeBackend):
         :type obj: string
         :param obj: string representation of the object
         """
-        return "%(prefix)s%(obj)s:indexes" % {'prefix': self._prefix, 'obj': obj}
+        return self._schema.index_collection_name(obj)
 
-    def _listify(self, list_or_string):
+    def _get_activity_locations_name(self, activity):
         """
-        A simple helper that converts a single ``index_name`` into a list of 1
+        Gets the name of the set of locations of an activity in the reverse index
 
-        :type list_or_string: string or list
-        :param list_or_string: the name of things as a string or a list of strings
+        :type activity: string
+        :param activity: string representation of the activity
         """
-        if isinstance(list_or_string, basestring):
-            list_or_string = [list_or_string]
-        else:
-            list_or_string = list_or_string
+        return self._schema.activity_locations_name(str(activity))
 
-        return list_or_string
+    def _encode_location(self, obj, index):
+        """
+        Encodes the object and the name of the index of a location in the reverse index
 
-    def _parse_date(self, date=None):
+        :type obj: string
+        :param obj: string representation of the object for who the index belongs to
+        :type index: string
+        :param index: the name of the index
         """
-        Makes a best effort to convert ``date`` into a datetime object, resorting to ``datetime.datetime.utcnow()`` when everything fales
+        return "%d:%s%s" % (len(obj), obj, index)
 
-        :type date: anything
-        :param date: something that represents a date and a time
+    def _decode_location(self, location):
         """
-        dt = None
-        if date is None or not isinstance(date, datetime.datetime):
-            if isinstance(date, basestring):
-                try:
-                    dt = parse(date)
-                except ValueError:
-                    dt = datetime.datetime.utcnow()
-            else:
-                dt = datetime.datetime.utcnow()
-        else:
-            dt = date
-        return dt
+        Decodes a location created by ``_encode_location`` into an ``(obj, index)`` tuple
+
+        :type location: string
+        :param location: the location
+        """
+        length, location = location.split(":", 1)
+        length = int(length)
+        return location[:length], location[length:]
+
+    def _scan_index_collections(self, host, cursor=0, count=100):
+        """
+        Incrementally walks the objects stored on a host using ``SCAN`` over the index collection sets.
+
+        :type host: int
+        :param host: the number of the host
+        :type cursor: int
+        :param cursor: the cursor returned by the previous call, or ``0`` to start a new walk
+        :type count: int
+        :param count: a hint for the number of keys to look at
+        :return a tuple of the next cursor (``0`` when the walk is complete) and a list of objects
+        """
+        cursor, keys = self._backend[host].connection.scan(cursor, match=self._schema.index_collection_pattern(), count=count)
+        return long(cursor), [self._schema.obj_from_index_collection_name(key) for key in keys]
+
+    def _get_add_command(self, index, index_name, timestamp, activity):
+        """
+        Gets the ``(command, args)`` tuple that adds an activity to an index. If the index is capped, the
+        command is a script that also trims the index down to its maximum length and returns the values
+        trimmed so they can be passed on to ``_post_remove``.
+
+        :type index: string
+        :param index: the name of the index
+        :type index_name: string
+        :param index_name: the unique index name for the obj index pair
+        :type timestamp: long
+        :param timestamp: the score of the activity
+        :type activity: string
+        :param activity: the name of the activity
+        """
+        max_length = self._get_max_length(index)
+        if not max_length:
+            return ('zadd', (index_name, timestamp, activity))
+        return self._scripts.get_command('add_trim', [index_name], [timestamp, activity, max_length])
+
+    def _map(self):
+        """
+        Gets a context manager that sends commands to their hosts in parallel, like ``map()`` of the nydus
+        cluster, recording them if instrumentation is enabled
+        """
+        if self._instrumentation is None:
+            return self._backend.map()
+        return RecordingMap(self._backend, self._get_host)
+
+    def _get_host(self, key):
+        """
+        Gets the number of the host ``key`` is routed to
+
+        :type key: string
+        :param key: the name of a key in redis
+        """
+        return self._backend.router.get_dbs(attr='get_conn', args=(key,))[0]
+
+    def _execute_per_host(self, commands, raise_on_error=True):
+        """
+        Executes commands grouped by host. Every host gets its own pipelines of at most
+        ``pipeline_size`` commands, and hosts are sent their pipelines concurrently by a pool of at most
+        ``workers`` threads. If ``host_timeout`` is set in the backend settings, a
+        ``SandsnakeTimeoutException`` is raised when a host takes longer than that many seconds.
+
+        :type commands: dict
+        :param commands: a dictionary where keys are host numbers and values are lists of
+        ``(command, args)`` tuples
+        :type raise_on_error: boolean
+        :param raise_on_error: if ``False``, errors for individual commands are returned in place of their results
+        :return a dictionary where keys are host numbers and values are lists of results in command order
+        """
+        if len(commands) == 1 and self._host_timeout is None:
+            host, host_commands = commands.items()[0]
+            return {host: self._execute_on_host(host, host_commands, raise_on_error=raise_on_error)}
+
+        futures = {}
+        for host, host_commands in commands.items():
+            futures[host] = self._pool.submit(bind(self._execute_on_host), host, host_commands, raise_on_error=raise_on_error)
+
+        deadline = None if self._host_timeout is None else time.time() + self._host_timeout
+        results = {}
+        for host, future in futures.items():
+            timeout = None if deadline is None else max(deadline - time.time(), 0)
+            results[host] = future.result(timeout=timeout)
+        return results
 
-    def _get_timestamp(self, dt_obj):
+    def _execute_on_host(self, host, commands, raise_on_error=True):
         """
-        returns a unix timestamp representing the ``datetime`` object
+        Executes a list of ``(command, args)`` tuples on a host in pipelines of at most
+        ``pipeline_size`` commands.
+
+        :type host: int
+        :param host: the number of the host
+        :type commands: list
+        :param commands: a list of ``(command, args)`` tuples
+        :type raise_on_error: boolean
+        :param raise_on_error: if ``False``, errors for individual commands are returned in place of their results
+        :return a list of results in command order
         """
-        return long((calendar.timegm(dt_obj.utctimetuple()) * 1000)) + (dt_obj.microsecond / 1000)
+        connection = self._backend[host].connection
+        results = []
+        for chunk in chunks(commands, self._pipeline_size):
+            pipe = connection.pipeline(transaction=False)
+            for command, args in chunk:
+                getattr(pipe, command)(*args)
+            chunk_results = pipe.execute(raise_on_error=False)
+
+            #scripts the host doesn't know yet didn't run, so load them and run them again
+            unknown = [i for i, result in enumerate(chunk_results) if isinstance(result, NoScriptError)]
+            if unknown:
+                pipe = connection.pipeline(transaction=False)
+                for sha in set(chunk[i][1][0] for i in unknown):
+                    self._scripts.load(connection, sha)
+                for i in unknown:
+                    getattr(pipe, chunk[i][0])(*chunk[i][1])
+                for i, result in zip(unknown, pipe.execute(raise_on_error=False)):
+                    chunk_results[i] = result
+
+            if raise_on_error:
+                for result in chunk_results:
+                    if isinstance(result, Exception):
+                        raise result
+            results.extend(chunk_results)
+        return results
 
 
 class RedisWithMarker(Redis):
     def __init__(self, *args, **kwargs):
         super(RedisWithMarker, self).__init__(*args, **kwargs)
         self._default_marker_name = kwargs.get('default_marker_name', "_ssdefault")
+        self._scripts.register('set_latest_markers', scripts.SET_LATEST_MARKERS)
 
+    @instrumented
     def set_markers(self, obj, index_name, markers_dict):
         """
         Allows you to set custom markers for a ``index`` belonging to an ``obj`
@@ -393,8 +1037,107 @@ class RedisWithMarker(Redis):
         for key, value in markers_dict.items():
             parsed_marker_dict[self._get_index_marker_name(index_name, marker_name=key)] = value
 
-        self._backend.hmset(self._get_obj_markers_name(obj), parsed_marker_dict)
+        markers_name = self._get_obj_markers_name(obj)
+        self._backend.hmset(markers_name, parsed_marker_dict)
+        self._invalidate([markers_name])
 
+    @instrumented
+    def set_markers_many(self, markers):
+        """
+        Sets markers of many indexes belonging to many objects. Markers are grouped into one command per
+        markers hash and sent in pipelines grouped by host.
+
+        Pass ``LATEST`` as the value of a marker to set it to the score of the newest item in its index
+        (markers of empty indexes are left alone). This is done by a script on the host of the markers,
+        so it takes a single round trip when the index lives on the same host.
+
+        >>> backend.set_markers_many([("user:1", "homefeed", "read", LATEST), ("user:2", "homefeed", "read", 1000)])
+
+        :type markers: iterable
+        :param markers: an iterable of ``(obj, index_name, marker_name, value)`` tuples. ``marker_name`` can
+        be ``None`` to set the default marker
+        """
+        values = collections.OrderedDict()
+        latest = collections.OrderedDict()
+        remote_latest = []
+
+        for obj, index_name, marker_name, value in markers:
+            markers_name = self._get_obj_markers_name(obj)
+            field = self._get_index_marker_name(index_name, marker_name=marker_name)
+            if value is LATEST:
+                index = self._get_index_name(obj, index_name)
+                if self._get_host(index) == self._get_host(markers_name):
+                    latest.setdefault(markers_name, []).append((index, field))
+                else:
+                    remote_latest.append((markers_name, index, field))
+            else:
+                values.setdefault(markers_name, {})[field] = value
+
+        #the newest item of indexes that live on other hosts has to be read first
+        commands = collections.defaultdict(list)
+        for markers_name, index, field in remote_latest:
+            commands[self._get_host(index)].append(('zrevrange', (index, 0, 0, True, long)))
+        results = self._execute_per_host(commands)
+
+        positions = collections.defaultdict(int)
+        for markers_name, index, field in remote_latest:
+            host = self._get_host(index)
+            newest = results[host][positions[host]]
+            positions[host] += 1
+            if newest:
+                values.setdefault(markers_name, {})[field] = newest[0][1]
+
+        commands = collections.defaultdict(list)
+        for markers_name, fields in values.items():
+            commands[self._get_host(markers_name)].append(('hmset', (markers_name, fields)))
+        for markers_name, pairs in latest.items():
+            commands[self._get_host(markers_name)].append(self._scripts.get_command('set_latest_markers', \
+                [markers_name] + [index for index, field in pairs], [field for index, field in pairs]))
+        self._execute_per_host(commands)
+
+        self._invalidate(values.keys() + latest.keys())
+
+    @instrumented
+    def get_markers_many(self, markers):
+        """
+        Gets markers of many indexes belonging to many objects. Markers are grouped into one ``HMGET`` per
+        markers hash and sent in pipelines grouped by host.
+
+        :type markers: iterable
+        :param markers: an iterable of ``(obj, index_name, marker_name)`` tuples. ``marker_name`` can be
+        ``None`` to get the default marker
+
+        :return a list with the value of every marker, in the same order as ``markers``. Markers that are
+        not set are ``None``
+        """
+        fields = collections.OrderedDict()
+        positions = []
+        for obj, index_name, marker_name in markers:
+            markers_name = self._get_obj_markers_name(obj)
+            field = self._get_index_marker_name(index_name, marker_name=marker_name)
+            markers_fields = fields.setdefault(markers_name, [])
+            positions.append((markers_name, len(markers_fields)))
+            markers_fields.append(field)
+
+        commands = collections.defaultdict(list)
+        hashes = collections.defaultdict(list)
+        for markers_name, markers_fields in fields.items():
+            host = self._get_host(markers_name)
+            commands[host].append(('hmget', (markers_name, markers_fields)))
+            hashes[host].append(markers_name)
+        results = self._execute_per_host(commands)
+
+        values = {}
+        for host, host_results in results.items():
+            values.update(zip(hashes[host], host_results))
+
+        parsed_results = []
+        for markers_name, position in positions:
+            value = values[markers_name][position]
+            parsed_results.append(None if value is None else long(value))
+        return parsed_results
+
+    @instrumented
     def get_markers(self, obj, index_name, marker, **kwargs):
         """
         Gets custom markers for a ``index`` belonging to an ``obj``
@@ -409,13 +1152,24 @@ class RedisWithMarker(Redis):
         markers = self._listify(marker)
 
         marker_names = map(lambda marker: self._get_index_marker_name(index_name, marker_name=marker), markers)
-        results = self._backend.hmget(self._get_obj_markers_name(obj), marker_names)
+        markers_name = self._get_obj_markers_name(obj)
+
+        parsed_results = None
+        if self._cache is not None:
+            parsed_results = self._cache.get(markers_name, tuple(marker_names))
+
+        if parsed_results is None:
+            results = self._backend.hmget(markers_name, marker_names)
+            parsed_results = [(None if result is None else long(result)) for result in results]
+            if self._cache is not None:
+                self._cache.set(markers_name, tuple(marker_names), parsed_results)
 
-        parsed_results = [(None if result is None else long(result)) for result in results]
+        parsed_results = list(parsed_results)
         if len(parsed_results) == 1:
             return parsed_results[0]
         return parsed_results
 
+    @instrumented
     def get_default_marker(self, obj, index_name, **kwargs):
         """
         Gets the default marker for the ``index`` belonging to an ``obj``
@@ -425,10 +1179,52 @@ class RedisWithMarker(Redis):
         :type index_name: string
         :param index_name: the name of the index you want to update the markers for
         """
-        marker_name = self._get_index_marker_name(index_name)
-        result = self._backend.hget(self._get_obj_markers_name(obj), marker_name)
+        return self.get_markers(obj, index_name, self._default_marker_name)
 
-        return None if result is None else long(result)
+    @instrumented
+    def get_counts_since_markers(self, objs, index_name, marker_name=None):
+        """
+        Gets the number of items added to the ``index`` of many objects since their marker, like calling
+        ``get_count(obj, index_name, marker, after=True)`` with every object's marker. Markers are read and
+        items are counted with pipelines grouped by host, so any number of objects takes two round trips.
+
+        :type objs: list
+        :param objs: string representations of the objects for who the indexes belong to
+        :type index_name: string
+        :param index_name: the name of the index
+        :type marker_name: string
+        :param marker_name: the name of the marker. Defaults to the default marker
+
+        :return a dictionary where keys are the objects and values are the number of items with a score
+        greater than or equal to the object's marker. Objects without the marker count every item
+        """
+        objs = list(objs)
+        marker_field = self._get_index_marker_name(index_name, marker_name=marker_name)
+
+        commands = collections.defaultdict(list)
+        for obj in objs:
+            markers_name = self._get_obj_markers_name(obj)
+            commands[self._get_host(markers_name)].append(('hget', (markers_name, marker_field)))
+        results = self._execute_per_host(commands)
+
+        positions = collections.defaultdict(int)
+        commands = collections.defaultdict(list)
+        for obj in objs:
+            host = self._get_host(self._get_obj_markers_name(obj))
+            marker = results[host][positions[host]]
+            positions[host] += 1
+
+            index = self._get_index_name(obj, index_name)
+            commands[self._get_host(index)].append(('zcount', (index, "-inf" if marker is None else marker, "+inf")))
+        results = self._execute_per_host(commands)
+
+        counts = {}
+        positions = collections.defaultdict(int)
+        for obj in objs:
+            host = self._get_host(self._get_index_name(obj, index_name))
+            counts[obj] = results[host][positions[host]]
+            positions[host] += 1
+        return counts
 
     def _post_delete_index(self, obj, indexes):
         """
@@ -440,9 +1236,10 @@ class RedisWithMarker(Redis):
         :param indexes: a list of ``indexes`` to which the ``activity`` has been added
         """
         super(RedisWithMarker, self)._post_delete_index(obj, indexes)
-        with self._backend.map() as conn:
+        with self._map() as conn:
             for index in indexes:
                 conn.hdel(self._get_obj_markers_name(obj), self._get_index_marker_name(index))
+        self._invalidate([self._get_obj_markers_name(obj)])
 
     def _get_obj_markers_name(self, obj):
         """
@@ -451,7 +1248,7 @@ class RedisWithMarker(Redis):
         :type obj: string
         :param obj: a unique string identifing the object
         """
-        return "%(prefix)sobj:%(obj)s:markers" % {'prefix': self._prefix, 'obj': obj}
+        return self._schema.obj_markers_name(obj)
 
     def _get_index_marker_name(self, index, marker_name=None):
         """
@@ -464,11 +1261,15 @@ class RedisWithMarker(Redis):
         :param marker_name: the name of the marker for this index. The default name is ``default``
         """
         marker_name = marker_name if marker_name is not None else self._default_marker_name
-        return "index:%(index)s:name:%(name)s" % {'index': index, 'name': marker_name}
+        return self._schema.index_marker_name(index, marker_name)
 
 
 class RedisWithBubbling(RedisWithMarker):
+    def __init__(self, *args, **kwargs):
+        super(RedisWithBubbling, self).__init__(*args, **kwargs)
+        self._scripts.register('bubble', scripts.BUBBLE)
 
+    @instrumented
     def bubble_values(self, obj, index_name, values_dict):
         """
         Moves values up and down the sorted set based on score (in most cases, a timestamp)
@@ -483,16 +1284,62 @@ class RedisWithBubbling(RedisWithMarker):
         score for the activity. You can pass ``None`` as the score for any activity and it will assign the score
         to the current utc timestamp.
         """
-        for key, value in values_dict.items():
-            #we we did not provide a custom score, then just set it the the current timestamp
-            if value is None:
-                score = self._get_timestamp(datetime.datetime.utcnow())
-            else:
-                #Try to parse the score as a long. If it doesn't work, try to parse a date.
-                try:
-                    score = long(value)
-                except (ValueError, TypeError):
-                    score = self._get_timestamp(self._parse_date(date=value))
-            values_dict[key] = score
-
-        self._backend.zadd(self._get_index_name(obj, index_name), **values_dict)
+        scores = self._get_bubble_scores(values_dict)
+
+        index = self._get_index_name(obj, index_name)
+        args = []
+        for member, score in zip(self._codec.encode_many(scores.keys()), scores.values()):
+            args.extend((score, member))
+        self._backend.zadd(index, *args)
+        self._invalidate([index])
+
+        if self._reverse_index:
+            self._update_locations('sadd', [(obj, [index], value) for value in scores])
+
+    @instrumented
+    def bubble_values_many(self, targets, values_dict, only_if_present=False, only_if_greater=False):
+        """
+        Moves values up and down the indexes of many objects, for example to bubble an activity that was
+        just commented on in the feeds of every follower. Indexes are updated by a script per index, sent
+        in pipelines grouped by host.
+
+        :type targets: iterable
+        :param targets: an iterable of ``(obj, index_name)`` tuples
+        :type values_dict: dict
+        :param values_dict: a dictionary where keys are the keys for the activity and values are the new
+        score for the activity, like ``bubble_values``. ``values_dict`` is not modified
+        :type only_if_present: boolean
+        :param only_if_present: if ``True``, values that are not in an index are not added to it. Use this so
+        values removed while bubbling stay removed
+        :type only_if_greater: boolean
+        :param only_if_greater: if ``True``, values are only moved up
+
+        :return the number of values whose score changed, added values included
+        """
+        scores = self._get_bubble_scores(values_dict)
+        if not scores:
+            return 0
+
+        args = ["1" if only_if_present else "0", "1" if only_if_greater else "0"]
+        for member, score in zip(self._codec.encode_many(scores.keys(), create=not only_if_present), scores.values()):
+            #values that were never encoded can't be in any index
+            if member is not None:
+                args.extend((score, member))
+        if len(args) == 2:
+            return 0
+
+        commands = collections.defaultdict(list)
+        indexes = []
+        for obj, index_name in targets:
+            index = self._get_index_name(obj, index_name)
+            indexes.append((obj, index))
+            commands[self._get_host(index)].append(self._scripts.get_command('bubble', [index], args))
+
+        results = self._execute_per_host(commands)
+        self._invalidate([index for obj, index in indexes])
+
+        #values that are only moved already have their locations
+        if self._reverse_index and not only_if_present:
+            self._update_locations('sadd', [(obj, [index], value) for obj, index in indexes for value in scores])
+        return sum(sum(host_results) for host_results in results.values())
+
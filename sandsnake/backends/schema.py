@@ -0,0 +1,185 @@
+"""
+Copyright 2012 Numan Sachwani <numan@7Geese.com>
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+
+class KeySchema(object):
+    """
+    Builds the names of the keys (and marker hash fields) sandsnake stores in redis. This is the layout
+    sandsnake has always used::
+
+        <prefix>obj:<obj>:index:<index>     sorted set of the activities in an index
+        <prefix><obj>:indexes               set of the names of an object's indexes
+        <prefix>obj:<obj>:markers           hash of an object's markers, with fields named
+                                            index:<index>:name:<marker name>
+        <prefix>members:<shard>             hash of the ids of activities, for ``InternedCodec``
+        <prefix>activity:<activity>:locations   set of the indexes an activity was added to, for
+                                                the ``reverse_index`` setting
+    """
+    def __init__(self, prefix="ssnake:"):
+        """
+        :type prefix: string
+        :param prefix: the string every key starts with
+        """
+        self.prefix = prefix
+        self._obj_prefix = prefix + "obj:"
+
+    def index_name(self, obj, index):
+        return self._obj_prefix + obj + ":index:" + index
+
+    def index_from_index_name(self, obj, key):
+        return key[len(self._obj_prefix + obj + ":index:"):]
+
+    def index_collection_name(self, obj):
+        return self.prefix + obj + ":indexes"
+
+    def index_collection_pattern(self):
+        return self.prefix + "*:indexes"
+
+    def obj_from_index_collection_name(self, key):
+        return key[len(self.prefix):-len(":indexes")]
+
+    def obj_markers_name(self, obj):
+        return self._obj_prefix + obj + ":markers"
+
+    def obj_markers_pattern(self):
+        return self._obj_prefix + "*:markers"
+
+    def obj_from_obj_markers_name(self, key):
+        return key[len(self._obj_prefix):-len(":markers")]
+
+    def member_dictionary_shard_name(self, shard):
+        return self.prefix + "members:" + str(shard)
+
+    def activity_locations_name(self, activity):
+        return self.prefix + "activity:" + activity + ":locations"
+
+    def activity_locations_pattern(self):
+        return self.prefix + "activity:*:locations"
+
+    def activity_from_activity_locations_name(self, key):
+        return key[len(self.prefix + "activity:"):-len(":locations")]
+
+    def index_marker_name(self, index, marker_name):
+        return "index:" + index + ":name:" + marker_name
+
+    def parse_index_marker_name(self, field):
+        """
+        Splits a marker hash field into an ``(index, marker_name)`` tuple
+        """
+        index, marker_name = field[len("index:"):].rsplit(":name:", 1)
+        return index, marker_name
+
+
+class CompactKeySchema(KeySchema):
+    """
+    A key layout that uses as little memory as possible::
+
+        <prefix>i<separator><obj><separator><index code>     sorted set of the activities in an index
+        <prefix>c<separator><obj>                            set of the names of an object's indexes
+        <prefix>m<separator><obj>                            hash of an object's markers, with fields
+                                                             named <index code><separator><marker name>
+        <prefix>d<separator><shard>                          hash of the ids of activities, for ``InternedCodec``
+        <prefix>r<separator><activity>                       set of the indexes an activity was added to,
+                                                             for the ``reverse_index`` setting
+
+    ``index_codes`` maps index names to short codes (``{"homefeed": "h"}``). Indexes without a code use
+    their name as is.
+
+    >>> schema = CompactKeySchema(prefix="ss:", index_codes={"homefeed": "h"})
+    >>> schema.index_name("user:1", "homefeed")
+    'ss:i:user:1:h'
+    """
+    def __init__(self, prefix="ss:", separator=":", index_codes=None):
+        """
+        :type prefix: string
+        :param prefix: the string every key starts with
+        :type separator: string
+        :param separator: the string between the parts of a key
+        :type index_codes: dict
+        :param index_codes: a dictionary of index names to the short codes used in keys instead
+        """
+        super(CompactKeySchema, self).__init__(prefix=prefix)
+        self.separator = separator
+        self._index_codes = dict(index_codes or {})
+        self._index_names = dict((code, index) for index, code in self._index_codes.items())
+
+        if len(self._index_names) != len(self._index_codes):
+            raise ValueError("Index codes must be unique")
+        for code in self._index_names:
+            if separator in code or code in self._index_codes:
+                raise ValueError("Invalid index code: %r" % (code,))
+
+        self._index_prefix = prefix + "i" + separator
+        self._collection_prefix = prefix + "c" + separator
+        self._markers_prefix = prefix + "m" + separator
+        self._locations_prefix = prefix + "r" + separator
+        #the part of an index key that comes after the object, for indexes with a code
+        self._index_suffixes = dict((index, separator + code) for index, code in self._index_codes.items())
+
+    def get_index_code(self, index):
+        return self._index_codes.get(index, index)
+
+    def get_index(self, code):
+        return self._index_names.get(code, code)
+
+    def index_name(self, obj, index):
+        suffix = self._index_suffixes.get(index)
+        if suffix is None:
+            return self._index_prefix + obj + self.separator + index
+        return self._index_prefix + obj + suffix
+
+    def index_from_index_name(self, obj, key):
+        return self.get_index(key[len(self._index_prefix + obj + self.separator):])
+
+    def index_collection_name(self, obj):
+        return self._collection_prefix + obj
+
+    def index_collection_pattern(self):
+        return self._collection_prefix + "*"
+
+    def obj_from_index_collection_name(self, key):
+        return key[len(self._collection_prefix):]
+
+    def obj_markers_name(self, obj):
+        return self._markers_prefix + obj
+
+    def obj_markers_pattern(self):
+        return self._markers_prefix + "*"
+
+    def obj_from_obj_markers_name(self, key):
+        return key[len(self._markers_prefix):]
+
+    def member_dictionary_shard_name(self, shard):
+        return self.prefix + "d" + self.separator + str(shard)
+
+    def activity_locations_name(self, activity):
+        return self._locations_prefix + activity
+
+    def activity_locations_pattern(self):
+        return self._locations_prefix + "*"
+
+    def activity_from_activity_locations_name(self, key):
+        return key[len(self._locations_prefix):]
+
+    def index_marker_name(self, index, marker_name):
+        return self.get_index_code(index) + self.separator + marker_name
+
+    def parse_index_marker_name(self, field):
+        #index names often contain the separator (``team:42``), marker names are assumed not to
+        code, marker_name = field.rsplit(self.separator, 1)
+        return self.get_index(code), marker_name
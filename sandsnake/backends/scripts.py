@@ -0,0 +1,226 @@
+"""
+Copyright 2012 Numan Sachwani <numan@7Geese.com>
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+from __future__ import absolute_import
+
+from redis.exceptions import NoScriptError
+
+import hashlib
+import threading
+
+
+#Adds a value to an index and trims the index down to ARGV[3] items, returning the values trimmed.
+#KEYS: the index. ARGV: the score, the value and the maximum length of the index
+ADD_TRIM = """
+redis.call('ZADD', KEYS[1], ARGV[1], ARGV[2])
+local stop = -(tonumber(ARGV[3]) + 1)
+local trimmed = redis.call('ZRANGE', KEYS[1], 0, stop)
+if #trimmed > 0 then
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, stop)
+end
+return trimmed
+"""
+
+#Deletes indexes and removes them from their object's index collection, deleting the collection once it is empty.
+#KEYS: the index collection followed by the indexes that live on the same host. ARGV: the names of the indexes
+#Names are removed in chunks, since ``unpack`` can only pass a few thousand arguments.
+DELETE_INDEXES = """
+for i = 2, #KEYS do
+    redis.call('DEL', KEYS[i])
+end
+for i = 1, #ARGV, 1000 do
+    redis.call('SREM', KEYS[1], unpack(ARGV, i, math.min(i + 999, #ARGV)))
+end
+if redis.call('SCARD', KEYS[1]) == 0 then
+    redis.call('DEL', KEYS[1])
+end
+return #KEYS - 1
+"""
+
+#Deletes indexes, returning the values that were in each of them.
+#KEYS: the indexes
+POP_INDEXES = """
+local values = {}
+for i = 1, #KEYS do
+    values[i] = redis.call('ZRANGE', KEYS[i], 0, -1)
+    redis.call('DEL', KEYS[i])
+end
+return values
+"""
+
+#Removes the values scored up to ARGV[1] from an index, returning the values removed.
+#KEYS: the index. ARGV: the highest score to remove, in ``ZRANGEBYSCORE`` syntax
+REMOVE_EXPIRED = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if #expired > 0 then
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+end
+return expired
+"""
+
+#Gets the members of a set and deletes it.
+#KEYS: the set
+POP_MEMBERS = """
+local members = redis.call('SMEMBERS', KEYS[1])
+redis.call('DEL', KEYS[1])
+return members
+"""
+
+#Gets the page of an index that comes right after a value, by rank so values that share its score aren't read.
+#Returns false if the value is not in the index with that score anymore.
+#KEYS: the index. ARGV: the score and the value of the cursor, the size of the page, 1 for ascending order
+PAGE_AFTER = """
+local score = redis.call('ZSCORE', KEYS[1], ARGV[2])
+if not score or tonumber(score) ~= tonumber(ARGV[1]) then
+    return false
+end
+local limit = tonumber(ARGV[3])
+if ARGV[4] == '1' then
+    local rank = redis.call('ZRANK', KEYS[1], ARGV[2])
+    return redis.call('ZRANGE', KEYS[1], rank + 1, rank + limit, 'WITHSCORES')
+end
+local rank = redis.call('ZREVRANK', KEYS[1], ARGV[2])
+return redis.call('ZREVRANGE', KEYS[1], rank + 1, rank + limit, 'WITHSCORES')
+"""
+
+#Sets markers to the score of the newest item of their index. Markers of empty indexes are left alone.
+#KEYS: the markers hash followed by the indexes. ARGV: the marker fields, one per index
+SET_LATEST_MARKERS = """
+for i = 1, #ARGV do
+    local newest = redis.call('ZREVRANGE', KEYS[i + 1], 0, 0, 'WITHSCORES')
+    if #newest > 0 then
+        redis.call('HSET', KEYS[1], ARGV[i], newest[2])
+    end
+end
+return #ARGV
+"""
+
+#Sets the scores of values in an index, returning the number of values whose score changed.
+#KEYS: the index. ARGV: 1 to only update values already in the index, 1 to only increase scores,
+#followed by score, value pairs
+BUBBLE = """
+local only_if_present = ARGV[1] == '1'
+local only_if_greater = ARGV[2] == '1'
+local moved = 0
+for i = 3, #ARGV, 2 do
+    local score = tonumber(ARGV[i])
+    local current = redis.call('ZSCORE', KEYS[1], ARGV[i + 1])
+    if current then
+        current = tonumber(current)
+    end
+    if (current or not only_if_present) and current ~= score and (not current or not only_if_greater or score > current) then
+        redis.call('ZADD', KEYS[1], ARGV[i], ARGV[i + 1])
+        moved = moved + 1
+    end
+end
+return moved
+"""
+
+#Gets the ids of values in a shard of a member dictionary, assigning the next id of the shard to values
+#that don't have one yet. Ids are ``sequence * shards + shard`` so the shard can be found from an id.
+#KEYS: the shard of the member dictionary. ARGV: the number of shards, the shard, then the values
+INTERN = """
+local shards = tonumber(ARGV[1])
+local shard = tonumber(ARGV[2])
+local ids = {}
+for i = 3, #ARGV do
+    local id = redis.call('HGET', KEYS[1], 'v:' .. ARGV[i])
+    if not id then
+        id = tostring(redis.call('HINCRBY', KEYS[1], 'seq', 1) * shards + shard)
+        redis.call('HSET', KEYS[1], 'v:' .. ARGV[i], id)
+        redis.call('HSET', KEYS[1], 'i:' .. id, ARGV[i])
+    end
+    ids[i - 2] = id
+end
+return ids
+"""
+
+class ScriptRegistry(object):
+    """
+    Keeps track of the lua scripts used by a backend. Scripts are called with ``EVALSHA`` so their
+    source is only sent to a host once. If a host does not know a script yet (``NOSCRIPT``), it is
+    loaded and the call is retried.
+
+    All the keys a script touches must live on the same host. Scripts are routed to the host of their
+    first key.
+    """
+    def __init__(self, cluster):
+        """
+        :type cluster: nydus.db.base.BaseCluster
+        :param cluster: the nydus cluster the scripts run on
+        """
+        self._cluster = cluster
+        self._scripts = {}
+        self._shas = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, source):
+        """
+        Registers a lua script under ``name``
+
+        :type name: string
+        :param name: the name of the script
+        :type source: string
+        :param source: the lua source of the script
+        """
+        sha = hashlib.sha1(source).hexdigest()
+        with self._lock:
+            self._scripts[name] = (sha, source)
+            self._shas[sha] = source
+
+    def get_command(self, name, keys, args):
+        """
+        Gets the ``(command, args)`` tuple that calls a script in a pipeline
+
+        :type name: string
+        :param name: the name of the script
+        :type keys: list
+        :param keys: the keys the script touches
+        :type args: list
+        :param args: the arguments of the script
+        """
+        sha = self._scripts[name][0]
+        return ('evalsha', (sha, len(keys)) + tuple(keys) + tuple(args))
+
+    def call(self, name, keys, args):
+        """
+        Calls a script on the host of its first key, falling back to ``EVAL`` if the host does not know it yet.
+
+        :type name: string
+        :param name: the name of the script
+        :type keys: list
+        :param keys: the keys the script touches
+        :type args: list
+        :param args: the arguments of the script
+        """
+        sha, source = self._scripts[name]
+        connection = self._cluster.get_conn(keys[0]).connection
+        try:
+            return connection.evalsha(sha, len(keys), *(tuple(keys) + tuple(args)))
+        except NoScriptError:
+            return connection.eval(source, len(keys), *(tuple(keys) + tuple(args)))
+
+    def load(self, connection, sha):
+        """
+        Loads the script with the given ``sha`` on a host
+
+        :type connection: redis.StrictRedis
+        :param connection: the connection to the host
+        :type sha: string
+        :param sha: the sha of the script
+        """
+        connection.script_load(self._shas[sha])
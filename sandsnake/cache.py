@@ -0,0 +1,126 @@
+"""
+Copyright 2012 Numan Sachwani <numan@7Geese.com>
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+import collections
+import threading
+import time
+
+
+class LRUCache(object):
+    """
+    A thread safe, size bounded, least recently used cache whose entries expire after ``ttl`` seconds.
+
+    Every entry belongs to a ``tag`` (for sandsnake, the name of the redis key it was read from) so all
+    the entries read from a key can be invalidated at once when that key changes.
+
+    >>> cache = LRUCache(max_size=1000, ttl=2)
+    >>> cache.set("ssnake:obj:user:1:index:homefeed", ("bucket", 30), [("abc", 1325419200000L)])
+    >>> cache.get("ssnake:obj:user:1:index:homefeed", ("bucket", 30))
+    [('abc', 1325419200000L)]
+    >>> cache.invalidate("ssnake:obj:user:1:index:homefeed")
+    """
+    def __init__(self, max_size=10000, ttl=1):
+        """
+        :type max_size: int
+        :param max_size: the maximum number of entries in the cache
+        :type ttl: int or float
+        :param ttl: the number of seconds an entry is valid for
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = collections.OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, tag, key, default=None):
+        """
+        Gets the value cached for ``key`` in ``tag``, or ``default`` if there is no such value or it has expired.
+
+        :type tag: string
+        :param tag: the tag the entry belongs to
+        :type key: hashable
+        :param key: the key of the entry within the tag
+        """
+        with self._lock:
+            entry = self._entries.pop((tag, key), None)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    self._discard_tag(tag, key)
+                self.misses += 1
+                return default
+
+            #re-insert the entry so it becomes the most recently used
+            self._entries[(tag, key)] = entry
+            self.hits += 1
+            return entry[1]
+
+    def set(self, tag, key, value):
+        """
+        Caches ``value`` for ``key`` in ``tag``, evicting the least recently used entry if the cache is full.
+
+        :type tag: string
+        :param tag: the tag the entry belongs to
+        :type key: hashable
+        :param key: the key of the entry within the tag
+        :param value: the value to cache
+        """
+        with self._lock:
+            self._entries.pop((tag, key), None)
+            self._entries[(tag, key)] = (time.time() + self.ttl, value)
+            self._tags.setdefault(tag, set()).add(key)
+
+            while len(self._entries) > self.max_size:
+                (evicted_tag, evicted_key), entry = self._entries.popitem(last=False)
+                self._discard_tag(evicted_tag, evicted_key)
+
+    def invalidate(self, tag):
+        """
+        Removes every entry that belongs to ``tag``
+
+        :type tag: string
+        :param tag: the tag to invalidate
+        """
+        with self._lock:
+            for key in self._tags.pop(tag, ()):
+                self._entries.pop((tag, key), None)
+
+    def clear(self):
+        """
+        Removes every entry from the cache
+        """
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def stats(self):
+        """
+        Returns a dictionary with the number of ``hits``, ``misses`` and entries (``size``) of the cache
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+    def _discard_tag(self, tag, key):
+        keys = self._tags.get(tag)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._tags[tag]
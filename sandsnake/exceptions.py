@@ -6,3 +6,7 @@ class SandsnakeBaseException(Exception):
 
 class SandsnakeValidationException(SandsnakeBaseException):
     pass
+
+
+class SandsnakeTimeoutException(SandsnakeBaseException):
+    pass
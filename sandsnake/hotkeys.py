@@ -0,0 +1,448 @@
+"""
+Copyright 2012 Numan Sachwani <numan@7Geese.com>
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+from sandsnake import create_sandsnake_backend
+from sandsnake.utils import run_batches
+
+import collections
+import heapq
+import json
+import optparse
+import random
+import threading
+
+
+class SpaceSaving(object):
+    """
+    A space-saving heavy hitters sketch. It counts at most ``capacity`` items; when it is full, a new item
+    replaces the item with the smallest count and starts from that count, which is kept as the item's
+    ``error``. The count of an item is never lower than its true count and overestimates it by at most
+    ``error``, and any item seen more than ``1 / capacity`` of the time is in the sketch.
+
+    Items are kept in buckets of items with the same count so every update takes constant time.
+
+    >>> sketch = SpaceSaving(2)
+    >>> for item in "aabac":
+    ...     sketch.add(item)
+    >>> sketch.top(1)
+    [('a', 3, 0)]
+    """
+    def __init__(self, capacity):
+        """
+        :type capacity: int
+        :param capacity: the maximum number of items counted
+        """
+        self.capacity = capacity
+        self._counts = {}
+        self._errors = {}
+        #count to the set of items with that count
+        self._buckets = {}
+        self._min = 0
+
+    def __len__(self):
+        return len(self._counts)
+
+    def add(self, item):
+        count = self._counts.get(item)
+        if count is None:
+            if len(self._counts) < self.capacity:
+                count = 0
+            else:
+                count = self._min
+                evicted = self._take(count)
+                del self._counts[evicted]
+                del self._errors[evicted]
+            self._errors[item] = count
+        else:
+            self._buckets[count].discard(item)
+            if not self._buckets[count]:
+                del self._buckets[count]
+
+        count += 1
+        self._counts[item] = count
+        self._buckets.setdefault(count, set()).add(item)
+        if count < self._min or self._min not in self._buckets:
+            self._min = count
+
+    def _take(self, count):
+        bucket = self._buckets[count]
+        item = bucket.pop()
+        if not bucket:
+            del self._buckets[count]
+        return item
+
+    def top(self, n=None):
+        """
+        Gets the items with the highest counts as ``(item, count, error)`` tuples, highest count first
+
+        :type n: int
+        :param n: the maximum number of items to return. ``None`` returns every item
+        """
+        items = self._counts.iteritems()
+        if n is None:
+            items = sorted(items, key=lambda item: item[1], reverse=True)
+        else:
+            items = heapq.nlargest(n, items, key=lambda item: item[1])
+        return [(item, count, self._errors[item]) for item, count in items]
+
+    def clear(self):
+        self._counts.clear()
+        self._errors.clear()
+        self._buckets.clear()
+        self._min = 0
+
+
+class HotKeyTracker(object):
+    """
+    Finds the most frequently accessed ``(obj, index)`` pairs of a backend. A sample of the calls to
+    ``get``, ``add`` and ``get_count`` is counted in a ``SpaceSaving`` sketch per operation, so memory use
+    stays bounded no matter how many indexes there are. Counts are scaled by ``sample_rate`` to estimate
+    the number of calls.
+
+    Backends create a tracker from the ``hot_keys`` setting:
+
+    >>> backend = Redis({"hosts": [{"db": 3}], "hot_keys": {"capacity": 1000, "sample_rate": 0.01}})
+    >>> backend.get_hot_keys().top(10)
+    [('user:1', 'homefeed', 5300, 100), ...]
+    """
+    operations = ('get', 'add', 'get_count')
+
+    def __init__(self, capacity=1000, sample_rate=0.01):
+        """
+        :type capacity: int
+        :param capacity: the maximum number of ``(obj, index)`` pairs counted per operation
+        :type sample_rate: float
+        :param sample_rate: the fraction of calls that are counted
+        """
+        self.capacity = capacity
+        self.sample_rate = sample_rate
+        self._sketches = dict((operation, SpaceSaving(capacity)) for operation in self.operations)
+        self._sampled = dict.fromkeys(self.operations, 0)
+        self._lock = threading.Lock()
+
+    def sample(self, operation, obj, index):
+        """
+        Counts a call, if it is sampled
+
+        :type operation: string
+        :param operation: the name of the backend method that was called
+        :type obj: string
+        :param obj: string representation of the object for who the index belongs to
+        :type index: string or list of strings
+        :param index: the name of the index(s) the call accessed
+        """
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+
+        indexes = [index] if isinstance(index, basestring) else index
+        with self._lock:
+            sketch = self._sketches[operation]
+            for index in indexes:
+                sketch.add((obj, index))
+                self._sampled[operation] += 1
+
+    def top(self, n=20, operation=None):
+        """
+        Gets the most frequently accessed ``(obj, index)`` pairs as ``(obj, index, calls, error)`` tuples,
+        most accessed first. ``calls`` is the estimated number of calls, which overestimates the true number by
+        at most ``error``.
+
+        :type n: int
+        :param n: the maximum number of pairs to return
+        :type operation: string
+        :param operation: only count calls to this operation. ``None`` adds up the calls to every operation
+        """
+        operations = self.operations if operation is None else [operation]
+        counts = collections.defaultdict(lambda: [0, 0])
+        with self._lock:
+            for operation in operations:
+                for item, count, error in self._sketches[operation].top():
+                    counts[item][0] += count
+                    counts[item][1] += error
+
+        top = heapq.nlargest(n, counts.iteritems(), key=lambda item: item[1][0])
+        return [(obj, index, self._scale(count), self._scale(error)) for (obj, index), (count, error) in top]
+
+    def total(self, operation=None):
+        """
+        Gets the estimated number of index accesses seen
+
+        :type operation: string
+        :param operation: only count calls to this operation. ``None`` adds up the calls to every operation
+        """
+        operations = self.operations if operation is None else [operation]
+        with self._lock:
+            return self._scale(sum(self._sampled[operation] for operation in operations))
+
+    def snapshot(self):
+        """
+        Gets a JSON serializable copy of the tracker's estimates, which ``main`` can merge with the snapshots of
+        other processes
+        """
+        return {
+            "totals": dict((operation, self.total(operation)) for operation in self.operations),
+            "top": dict((operation, [list(item) for item in self.top(self.capacity, operation)]) \
+                for operation in self.operations),
+        }
+
+    def clear(self):
+        with self._lock:
+            for operation in self.operations:
+                self._sketches[operation].clear()
+                self._sampled[operation] = 0
+
+    def _scale(self, count):
+        return int(round(count / float(self.sample_rate)))
+
+
+class BigIndexScan(object):
+    """
+    Finds the largest indexes on every host of a ``Redis`` sandsnake backend. Objects are walked host by host
+    with ``SCAN`` over the index collection sets, and the size of each of their indexes is read with ``ZCARD``
+    in pipelines. Indexes are reported under the host they live on, which is not always the host of their
+    object's index collection.
+
+    >>> scan = BigIndexScan(backend, top=20, objects_per_second=1000)
+    >>> scan.run()
+    >>> scan.largest()
+    {0: [('user:1', 'homefeed', 120000), ...], 1: [...], 2: [...]}
+    """
+    def __init__(self, backend, top=20, batch_size=100, objects_per_second=None):
+        """
+        :type backend: sandsnake.backends.redis.Redis
+        :param backend: the backend to scan
+        :type top: int
+        :param top: the number of indexes to report per host
+        :type batch_size: int
+        :param batch_size: a hint for the number of keys to scan per batch
+        :type objects_per_second: int
+        :param objects_per_second: the maximum rate at which objects are scanned. ``None`` means no limit
+        """
+        self._backend = backend
+        self._top = top
+        self._batch_size = batch_size
+        self._objects_per_second = objects_per_second
+        self._cursors = {}
+        #host to a heap of ``(size, obj, index)`` tuples of the largest indexes found so far
+        self._largest = collections.defaultdict(list)
+        self._totals = collections.defaultdict(lambda: {"indexes": 0, "items": 0})
+        self.scanned = 0
+
+    def is_complete(self):
+        """
+        Returns ``True`` once every host has been scanned
+        """
+        return all(self._cursors.get(host) == 0 for host in self._backend.get_backend())
+
+    def scan_batch(self):
+        """
+        Scans a single batch of objects from the next host that has not been completely scanned.
+
+        :return the number of objects scanned, or ``None`` if the scan is complete
+        """
+        for host in sorted(self._backend.get_backend()):
+            cursor = self._cursors.get(host)
+            if cursor == 0:
+                continue
+
+            cursor, objs = self._backend._scan_index_collections(host, cursor=cursor or 0, count=self._batch_size)
+            if objs:
+                self._measure(objs)
+            self._cursors[host] = cursor
+            self.scanned += len(objs)
+            return len(objs)
+
+        return None
+
+    def run(self, max_batches=None):
+        """
+        Scans batches until the scan is complete or ``max_batches`` batches have been scanned, sleeping
+        between batches to respect ``objects_per_second``.
+
+        :type max_batches: int
+        :param max_batches: the maximum number of batches to scan. ``None`` means no limit
+        :return the largest indexes found so far, like ``largest``
+        """
+        run_batches(self.scan_batch, self._objects_per_second, max_batches)
+        return self.largest()
+
+    def largest(self):
+        """
+        Gets a dictionary where keys are host numbers and values are lists of ``(obj, index, size)`` tuples
+        of the largest indexes on that host, largest first
+        """
+        return dict((host, [(obj, index, size) for size, obj, index in sorted(heap, reverse=True)]) \
+            for host, heap in self._largest.items())
+
+    def totals(self):
+        """
+        Gets a dictionary where keys are host numbers and values are dictionaries with the number of indexes
+        (``indexes``) and items (``items``) scanned on that host
+        """
+        return dict((host, dict(totals)) for host, totals in self._totals.items())
+
+    def _measure(self, objs):
+        """
+        Reads the size of every index of ``objs``
+        """
+        backend = self._backend
+
+        commands = collections.defaultdict(list)
+        for obj in objs:
+            key = backend._get_index_collection_name(obj)
+            commands[backend._get_host(key)].append(('smembers', (key,)))
+        results = backend._execute_per_host(commands, raise_on_error=False)
+
+        indexes = []
+        for host, host_commands in commands.items():
+            for (command, (key,)), index_names in zip(host_commands, results[host]):
+                #keys that only look like index collections (an index named "indexes") aren't sets
+                if isinstance(index_names, Exception):
+                    continue
+                obj = backend._schema.obj_from_index_collection_name(key)
+                indexes.extend((obj, index) for index in index_names)
+
+        commands = collections.defaultdict(list)
+        located = collections.defaultdict(list)
+        for obj, index in indexes:
+            key = backend._get_index_name(obj, index)
+            host = backend._get_host(key)
+            commands[host].append(('zcard', (key,)))
+            located[host].append((obj, index))
+        results = backend._execute_per_host(commands, raise_on_error=False)
+
+        for host, sizes in results.items():
+            heap, totals = self._largest[host], self._totals[host]
+            for (obj, index), size in zip(located[host], sizes):
+                if isinstance(size, Exception):
+                    continue
+                totals["indexes"] += 1
+                totals["items"] += size
+                if len(heap) < self._top:
+                    heapq.heappush(heap, (size, obj, index))
+                elif size > heap[0][0]:
+                    heapq.heapreplace(heap, (size, obj, index))
+
+
+def format_largest(largest, totals=None, identifiers=None):
+    """
+    Formats the result of ``BigIndexScan.largest`` as a plain text report
+
+    :type largest: dict
+    :param largest: host numbers to lists of ``(obj, index, size)`` tuples
+    :type totals: dict
+    :param totals: the result of ``BigIndexScan.totals``
+    :type identifiers: dict
+    :param identifiers: host numbers to names to show for the hosts
+    """
+    lines = []
+    for host in sorted(largest):
+        title = "largest indexes on host %s" % (identifiers or {}).get(host, host)
+        if totals and host in totals:
+            title += " (%(indexes)d indexes, %(items)d items)" % totals[host]
+        lines.append(title)
+        for obj, index, size in largest[host]:
+            lines.append("  %10d  %s  %s" % (size, obj, index))
+    return "\n".join(lines)
+
+
+def format_hot_keys(top, total):
+    """
+    Formats the result of ``HotKeyTracker.top`` as a plain text report
+
+    :type top: list
+    :param top: a list of ``(obj, index, calls, error)`` tuples
+    :type total: int
+    :param total: the estimated number of index accesses, to show each pair's share of them
+    """
+    lines = ["hottest indexes of %d estimated accesses" % total]
+    for obj, index, calls, error in top:
+        share = 100.0 * calls / total if total else 0
+        lines.append("  %10d  +-%-8d %5.1f%%  %s  %s" % (calls, error, share, obj, index))
+    return "\n".join(lines)
+
+
+def merge_snapshots(snapshots, n=20, operation=None):
+    """
+    Adds up the ``HotKeyTracker.snapshot`` of many processes
+
+    :type snapshots: list
+    :param snapshots: the snapshots to merge
+    :type n: int
+    :param n: the maximum number of pairs to return
+    :type operation: string
+    :param operation: only count calls to this operation. ``None`` adds up the calls to every operation
+    :return a tuple of a list of ``(obj, index, calls, error)`` tuples, most accessed first, and the estimated
+    number of index accesses
+    """
+    counts = collections.defaultdict(lambda: [0, 0])
+    total = 0
+    for snapshot in snapshots:
+        for name in snapshot["top"]:
+            if operation is not None and name != operation:
+                continue
+            total += snapshot["totals"][name]
+            for obj, index, calls, error in snapshot["top"][name]:
+                counts[(obj, index)][0] += calls
+                counts[(obj, index)][1] += error
+
+    top = heapq.nlargest(n, counts.iteritems(), key=lambda item: item[1][0])
+    return [(obj, index, calls, error) for (obj, index), (calls, error) in top], total
+
+
+def main(argv=None):
+    """
+    Command line report of the largest indexes on every host and of the hottest indexes::
+
+        python -m sandsnake.hotkeys --settings sandsnake.json --top 20 --hot-keys web1.json --hot-keys web2.json
+
+    ``--settings`` is a JSON file with the arguments to ``create_sandsnake_backend``. ``--hot-keys`` files hold
+    the ``HotKeyTracker.snapshot`` of running processes, dumped as JSON.
+    """
+    parser = optparse.OptionParser(usage="%prog [--settings FILE] [--hot-keys FILE ...] [options]")
+    parser.add_option("--settings", help="JSON file with the arguments to create_sandsnake_backend")
+    parser.add_option("--hot-keys", action="append", default=[], help="JSON file with a HotKeyTracker snapshot")
+    parser.add_option("--operation", default=None, help="only report hot indexes for this operation")
+    parser.add_option("--top", type="int", default=20, help="number of indexes to report")
+    parser.add_option("--batch-size", type="int", default=100, help="number of keys to scan per batch")
+    parser.add_option("--objects-per-second", type="int", default=None, help="maximum scan rate")
+    options, args = parser.parse_args(argv)
+
+    if not options.settings and not options.hot_keys:
+        parser.error("--settings or --hot-keys is required")
+
+    if options.settings:
+        with open(options.settings) as settings_file:
+            backend = create_sandsnake_backend(json.load(settings_file))
+        scan = BigIndexScan(backend, top=options.top, batch_size=options.batch_size, \
+            objects_per_second=options.objects_per_second)
+        scan.run()
+
+        cluster = backend.get_backend()
+        identifiers = dict((host, cluster[host].identifier) for host in cluster)
+        print format_largest(scan.largest(), scan.totals(), identifiers)
+
+    if options.hot_keys:
+        snapshots = []
+        for path in options.hot_keys:
+            with open(path) as snapshot_file:
+                snapshots.append(json.load(snapshot_file))
+        print format_hot_keys(*merge_snapshots(snapshots, n=options.top, operation=options.operation))
+
+
+if __name__ == "__main__":
+    main()
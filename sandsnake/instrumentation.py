@@ -0,0 +1,610 @@
+"""
+Copyright 2012 Numan Sachwani <numan@7Geese.com>
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+from __future__ import absolute_import
+
+from sandsnake.utils import import_string
+
+import bisect
+import collections
+import functools
+import inspect
+import logging
+import random
+import re
+import socket
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+#the span of the operation running on the current thread, if it is instrumented
+_local = threading.local()
+
+#commands whose arguments aren't keys
+_KEYLESS_COMMANDS = frozenset(['AUTH', 'CLIENT', 'CONFIG', 'DBSIZE', 'FLUSHALL', 'FLUSHDB', 'INFO', 'KEYS',
+    'PING', 'SCAN', 'SCRIPT', 'SELECT'])
+#commands whose arguments are all keys
+_MULTI_KEY_COMMANDS = frozenset(['DEL', 'EXISTS', 'MGET', 'SDIFF', 'SINTER', 'SUNION', 'UNLINK', 'WATCH'])
+
+
+def current_span():
+    """
+    Gets the span of the instrumented operation running on the current thread, or ``None``
+    """
+    return getattr(_local, 'span', None)
+
+
+def bind(func):
+    """
+    Makes ``func`` record into the span of the current thread, wherever it is called. Used to follow an
+    operation onto the threads it hands work to. Returns ``func`` itself if there is no span.
+
+    :type func: callable
+    :param func: the function that will run on another thread
+    """
+    span = current_span()
+    if span is None:
+        return func
+
+    @functools.wraps(func)
+    def bound(*args, **kwargs):
+        previous, _local.span = current_span(), span
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.span = previous
+    return bound
+
+
+def instrumented(func):
+    """
+    Decorates a public backend method so every call is recorded in a ``Span`` and handed to the sinks of
+    the backend's ``_instrumentation``. Calls made while another instrumented call is running on the same
+    thread are part of the outer call's span. When the backend has no sinks, the method is called directly.
+    """
+    operation = func.__name__
+    arguments = inspect.getargspec(func).args
+    index_argument = position = None
+    for name in ('index_name', 'index'):
+        if name in arguments:
+            index_argument, position = name, arguments.index(name)
+            break
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        instrumentation = self._instrumentation
+        if instrumentation is None or not instrumentation.sinks or current_span() is not None:
+            return func(self, *args, **kwargs)
+
+        index = None
+        if position is not None:
+            index = args[position - 1] if len(args) >= position else kwargs.get(index_argument)
+            if not isinstance(index, basestring):
+                index = None
+
+        span = _local.span = Span(operation, index)
+        try:
+            return func(self, *args, **kwargs)
+        except Exception, e:
+            span.error = e.__class__.__name__
+            raise
+        finally:
+            _local.span = None
+            span.finish()
+            instrumentation.emit(span)
+    return wrapper
+
+
+def command_keys(args):
+    """
+    Gets the keys a redis command touches
+
+    :type args: tuple
+    :param args: the name of the command followed by its arguments
+    """
+    name = args[0].split(' ', 1)[0].upper()
+    if name in ('EVAL', 'EVALSHA'):
+        return args[3:3 + int(args[2])]
+    if name in _MULTI_KEY_COMMANDS:
+        return args[1:]
+    if name in _KEYLESS_COMMANDS:
+        return ()
+    return args[1:2]
+
+
+def response_size(value):
+    """
+    Gets the approximate number of bytes a redis reply took on the wire, not counting the protocol framing
+    """
+    if value is None:
+        return 0
+    if isinstance(value, basestring):
+        return len(value)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sum(response_size(item) for item in value)
+    if isinstance(value, dict):
+        return sum(response_size(key) + response_size(item) for key, item in value.iteritems())
+    return len(str(value))
+
+
+class Span(object):
+    """
+    Everything one call to a backend method did. ``network_time`` is the time spent sending commands and
+    waiting for replies; it is summed over hosts, so it can be larger than ``duration`` when hosts are
+    queried in parallel.
+
+    Once a span is finished, it ignores what is recorded into it. Threads still talking to a host after
+    ``host_timeout`` fired can't change a span the sinks already have.
+    """
+    __slots__ = ('operation', 'index', 'start', 'duration', 'network_time', 'commands', 'command_counts',
+        'pipelines', 'keys', 'bytes', 'error', 'finished', '_lock')
+
+    def __init__(self, operation, index=None):
+        """
+        :type operation: string
+        :param operation: the name of the backend method
+        :type index: string
+        :param index: the name of the index the method was called for, if there was only one
+        """
+        self.operation = operation
+        self.index = index
+        self.start = time.time()
+        self.duration = None
+        self.network_time = 0.0
+        self.commands = 0
+        self.command_counts = collections.defaultdict(int)
+        #the number of commands sent in every round trip
+        self.pipelines = []
+        self.keys = set()
+        self.bytes = 0
+        self.error = None
+        self.finished = False
+        self._lock = threading.Lock()
+
+    @property
+    def python_time(self):
+        return max(self.duration - self.network_time, 0.0)
+
+    @property
+    def round_trips(self):
+        return len(self.pipelines)
+
+    def finish(self):
+        with self._lock:
+            self.duration = time.time() - self.start
+            self.finished = True
+
+    def record_command(self, args):
+        """
+        Records a command that is about to be sent
+
+        :type args: tuple
+        :param args: the name of the command followed by its arguments
+        """
+        keys = command_keys(args)
+        with self._lock:
+            if self.finished:
+                return
+            self.commands += 1
+            self.command_counts[args[0].lower()] += 1
+            self.keys.update(keys)
+
+    def record_round_trips(self, sizes, elapsed):
+        """
+        Records round trips to redis
+
+        :type sizes: list
+        :param sizes: the number of commands sent in every round trip
+        :type elapsed: float
+        :param elapsed: the number of seconds spent on the network
+        """
+        with self._lock:
+            if self.finished:
+                return
+            self.pipelines.extend(sizes)
+            self.network_time += elapsed
+
+    def record_response(self, value, elapsed=0.0):
+        """
+        Records a reply from redis
+
+        :param value: the reply
+        :type elapsed: float
+        :param elapsed: the number of seconds spent waiting for the reply
+        """
+        size = response_size(value)
+        with self._lock:
+            if self.finished:
+                return
+            self.bytes += size
+            self.network_time += elapsed
+
+    def __repr__(self):
+        return "<Span %s index=%s duration=%.6f network=%.6f commands=%d round_trips=%d keys=%d bytes=%d error=%s>" % \
+            (self.operation, self.index, self.duration or 0, self.network_time, self.commands, self.round_trips, \
+            len(self.keys), self.bytes, self.error)
+
+
+class InstrumentedConnection(object):
+    """
+    Mixin for redis-py connection classes that records the commands sent, the round trips and the replies
+    of the current thread's span. Commands sent while connecting (``AUTH`` and ``SELECT``) are not recorded.
+    """
+    _pending = 0
+    _connecting = False
+
+    def connect(self):
+        self._connecting = True
+        try:
+            return super(InstrumentedConnection, self).connect()
+        finally:
+            self._connecting = False
+
+    def pack_command(self, *args):
+        if not self._connecting:
+            span = current_span()
+            if span is not None:
+                span.record_command(args)
+                self._pending += 1
+        return super(InstrumentedConnection, self).pack_command(*args)
+
+    def send_packed_command(self, command):
+        pending, self._pending = self._pending, 0
+        span = current_span() if pending and not self._connecting else None
+        if span is None:
+            return super(InstrumentedConnection, self).send_packed_command(command)
+
+        start = time.time()
+        try:
+            return super(InstrumentedConnection, self).send_packed_command(command)
+        finally:
+            span.record_round_trips([pending], time.time() - start)
+
+    def read_response(self):
+        span = None if self._connecting else current_span()
+        if span is None:
+            return super(InstrumentedConnection, self).read_response()
+
+        start = time.time()
+        response = None
+        try:
+            response = super(InstrumentedConnection, self).read_response()
+            return response
+        finally:
+            span.record_response(response, time.time() - start)
+
+
+_connection_classes = {}
+
+
+def instrument_connection_class(cls):
+    """
+    Gets a subclass of the redis-py connection class ``cls`` that records into spans
+    """
+    if issubclass(cls, InstrumentedConnection):
+        return cls
+    if cls not in _connection_classes:
+        _connection_classes[cls] = type("Instrumented" + cls.__name__, (InstrumentedConnection, cls), {})
+    return _connection_classes[cls]
+
+
+class RecordingMap(object):
+    """
+    A replacement for ``cluster.map()`` that records the commands it sends into the current thread's span.
+    nydus sends the commands of a ``map()`` from threads of its own, which the connections can't attribute
+    to an operation, so they are recorded here instead: one round trip per host, with the time spent
+    waiting for every host as the network time.
+    """
+    def __init__(self, cluster, get_host):
+        """
+        :type cluster: nydus.db.base.BaseCluster
+        :param cluster: the nydus cluster
+        :type get_host: callable
+        :param get_host: gets the number of the host a key is routed to
+        """
+        self._cluster = cluster
+        self._get_host = get_host
+        self._manager = None
+        self._span = None
+        self._calls = []
+
+    def __enter__(self):
+        self._span = current_span()
+        self._manager = self._cluster.map()
+        connection = self._manager.__enter__()
+        if self._span is None:
+            return connection
+        return _RecordingConnection(connection, self._span, self._calls)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._span is None:
+            return self._manager.__exit__(exc_type, exc_value, traceback)
+
+        start = time.time()
+        try:
+            return self._manager.__exit__(exc_type, exc_value, traceback)
+        finally:
+            elapsed = time.time() - start
+            hosts = collections.defaultdict(int)
+            for args, command in self._calls:
+                hosts[self._get_host(args[0])] += 1
+                self._span.record_response(getattr(command, '_EventualCommand__wrapped', None))
+            self._span.record_round_trips(hosts.values(), elapsed)
+
+
+class _RecordingConnection(object):
+    def __init__(self, connection, span, calls):
+        self._connection = connection
+        self._span = span
+        self._calls = calls
+
+    def __getattr__(self, name):
+        method = getattr(self._connection, name)
+
+        def call(*args, **kwargs):
+            self._span.record_command((name,) + args)
+            command = method(*args, **kwargs)
+            self._calls.append((args, command))
+            return command
+        return call
+
+
+class Instrumentation(object):
+    """
+    Hands the spans of a backend's operations to its sinks. A sink is any object with a ``record(span)``
+    method. Errors raised by sinks are logged and never reach the caller of the backend.
+    """
+    def __init__(self, sinks=()):
+        """
+        :type sinks: list
+        :param sinks: sinks, or dotted paths to sink classes that are instantiated without arguments
+        """
+        self.sinks = [import_string(sink)() if isinstance(sink, basestring) else sink for sink in sinks]
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def remove_sink(self, sink):
+        self.sinks.remove(sink)
+
+    def install(self, cluster):
+        """
+        Makes the connections of every host of a nydus cluster record into spans. Must be called before the
+        connections are opened.
+
+        :type cluster: nydus.db.base.BaseCluster
+        :param cluster: the nydus cluster
+        """
+        for host in cluster:
+            pool = cluster[host].connection.connection_pool
+            pool.connection_class = instrument_connection_class(pool.connection_class)
+
+    def emit(self, span):
+        for sink in list(self.sinks):
+            try:
+                sink.record(span)
+            except Exception:
+                logger.exception("Sink %r failed to record %r", sink, span)
+
+
+class Histogram(object):
+    """
+    A histogram with fixed bucket bounds. Percentiles are estimated by the upper bound of the bucket they
+    fall in, capped by the largest value seen.
+
+    >>> histogram = Histogram()
+    >>> for value in (0.001, 0.002, 0.05):
+    ...     histogram.add(value)
+    >>> histogram.count, histogram.max
+    (3, 0.05)
+    """
+    #100 microseconds to about 52 seconds, doubling every bucket
+    latency_bounds = tuple(0.0001 * 2 ** i for i in xrange(20))
+    #1 to 4096 commands, doubling every bucket
+    size_bounds = tuple(2 ** i for i in xrange(13))
+
+    def __init__(self, bounds=latency_bounds):
+        """
+        :type bounds: tuple
+        :param bounds: the sorted upper bounds of the buckets. Larger values go into an extra, unbounded bucket.
+        """
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        return self.total / float(self.count) if self.count else None
+
+    def percentile(self, percent):
+        """
+        Estimates the value below which ``percent`` percent of the values fall
+
+        :type percent: int or float
+        :param percent: a number between 0 and 100
+        """
+        if not self.count:
+            return None
+        rank = max(self.count * percent / 100.0, 1)
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return self.max if i == len(self.bounds) else min(self.bounds[i], self.max)
+        return self.max
+
+
+class OperationStats(object):
+    """
+    The aggregated spans of one operation on one index
+    """
+    def __init__(self):
+        self.calls = 0
+        self.errors = collections.defaultdict(int)
+        self.latency = Histogram()
+        self.network_time = Histogram()
+        self.pipeline_sizes = Histogram(Histogram.size_bounds)
+        self.commands = 0
+        self.keys = 0
+        self.bytes = 0
+
+    def add(self, span):
+        self.calls += 1
+        if span.error is not None:
+            self.errors[span.error] += 1
+        self.latency.add(span.duration)
+        self.network_time.add(span.network_time)
+        for size in span.pipelines:
+            self.pipeline_sizes.add(size)
+        self.commands += span.commands
+        self.keys += len(span.keys)
+        self.bytes += span.bytes
+
+
+class MemorySink(object):
+    """
+    Aggregates spans in memory by operation and index name.
+
+    >>> sink = MemorySink()
+    >>> backend = Redis({"hosts": [{"db": 3}], "instrumentation": [sink]})
+    >>> backend.get("user:1", "homefeed")
+    >>> sink.get("get", "homefeed").latency.percentile(99)
+    """
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, span):
+        with self._lock:
+            stats = self._stats.get((span.operation, span.index))
+            if stats is None:
+                stats = self._stats[(span.operation, span.index)] = OperationStats()
+            stats.add(span)
+
+    def get(self, operation, index=None):
+        """
+        Gets the ``OperationStats`` of an operation on an index, or ``None`` if there were no calls
+
+        :type operation: string
+        :param operation: the name of the backend method
+        :type index: string
+        :param index: the name of the index, ``None`` for operations that span many indexes
+        """
+        return self._stats.get((operation, index))
+
+    def stats(self):
+        """
+        Gets a dictionary where keys are ``(operation, index)`` tuples and values are ``OperationStats``
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+class LoggingSink(object):
+    """
+    Logs one line per span
+    """
+    def __init__(self, logger=logger, level=logging.DEBUG):
+        """
+        :type logger: logging.Logger
+        :param logger: the logger to log to
+        :type level: int
+        :param level: the level to log at
+        """
+        self.logger = logger
+        self.level = level
+
+    def record(self, span):
+        if not self.logger.isEnabledFor(self.level):
+            return
+        self.logger.log(self.level, "%s index=%s duration=%.3fms network=%.3fms commands=%d round_trips=%d "
+            "keys=%d bytes=%d error=%s", span.operation, span.index, span.duration * 1000, span.network_time * 1000,
+            span.commands, span.round_trips, len(span.keys), span.bytes, span.error)
+
+
+class StatsdSink(object):
+    """
+    Sends the metrics of every span to a statsd server over UDP, as one packet per span. Metrics are named
+    ``<prefix>.<operation>.<index>.<metric>``, leaving out the index for operations that span many indexes.
+    The prefix is used as is, so it can be dotted; characters statsd can't take are replaced in the
+    operation and index. Errors sending packets are ignored.
+    """
+    def __init__(self, host="localhost", port=8125, prefix="sandsnake", sample_rate=1):
+        """
+        :type host: string
+        :param host: the host of the statsd server
+        :type port: int
+        :param port: the port of the statsd server
+        :type prefix: string
+        :param prefix: the prefix of the metric names
+        :type sample_rate: float
+        :param sample_rate: the fraction of spans to send
+        """
+        self.address = (host, port)
+        self.prefix = prefix
+        self.sample_rate = sample_rate
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def record(self, span):
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+        try:
+            self._socket.sendto(self.format(span), self.address)
+        except socket.error:
+            pass
+
+    def format(self, span):
+        """
+        Gets the statsd packet for a span
+        """
+        parts = [_statsd_name(part) for part in (span.operation, span.index) if part]
+        name = ".".join([self.prefix] + parts if self.prefix else parts)
+        rate = "" if self.sample_rate >= 1 else "|@%s" % self.sample_rate
+        metrics = [
+            ("calls", 1, "c"),
+            ("latency", "%.3f" % (span.duration * 1000), "ms"),
+            ("network", "%.3f" % (span.network_time * 1000), "ms"),
+            ("commands", span.commands, "c"),
+            ("round_trips", span.round_trips, "c"),
+            ("keys", len(span.keys), "c"),
+            ("bytes", span.bytes, "c"),
+        ]
+        if span.error is not None:
+            metrics.append(("errors", 1, "c"))
+        return "\n".join("%s.%s:%s|%s%s" % (name, metric, value, kind, rate) for metric, value, kind in metrics)
+
+
+def _statsd_name(name):
+    return re.sub(r"[^A-Za-z0-9_\-]", "_", name)
@@ -0,0 +1,128 @@
+"""
+Copyright 2012 Numan Sachwani <numan@7Geese.com>
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+from __future__ import absolute_import
+
+from redis.exceptions import RedisError
+
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class KeyspaceInvalidator(object):
+    """
+    Keeps the in-process read cache of a ``Redis`` sandsnake backend consistent with writes made by other
+    processes. One thread per host subscribes to the keyspace notifications for keys under the backend's
+    prefix and invalidates the cache entries read from every key that changes. Whenever a subscription is
+    lost, the whole cache is flushed since notifications may have been missed.
+
+    Redis only sends keyspace notifications if ``notify-keyspace-events`` includes ``K`` and the classes of the
+    commands sandsnake uses (``g``, ``z``, ``h`` and ``x``). Pass ``configure=True`` to set them.
+
+    >>> invalidator = KeyspaceInvalidator(backend, configure=True)
+    >>> invalidator.start()
+    """
+    notify_keyspace_events = "Kgzhx"
+
+    def __init__(self, backend, configure=False, poll_interval=1, retry_interval=1):
+        """
+        :type backend: sandsnake.backends.redis.Redis
+        :param backend: the backend whose cache should be invalidated
+        :type configure: boolean
+        :param configure: if ``True``, turns on the keyspace notifications we need on every host
+        :type poll_interval: int or float
+        :param poll_interval: the number of seconds to wait for a notification before checking if we should stop
+        :type retry_interval: int or float
+        :param retry_interval: the number of seconds to wait before subscribing again after losing a connection
+        """
+        if backend.get_cache() is None:
+            raise ValueError("The backend does not have a cache to invalidate")
+
+        self._backend = backend
+        self._configure = configure
+        self._poll_interval = poll_interval
+        self._retry_interval = retry_interval
+        self._stopped = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """
+        Starts listening for notifications on every host
+        """
+        self._stopped.clear()
+        for host in self._backend.get_backend():
+            thread = threading.Thread(target=self._listen, args=(host,))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """
+        Stops listening for notifications and waits for the listening threads to finish
+        """
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _listen(self, host):
+        """
+        Listens for notifications on a single host until ``stop`` is called
+        """
+        cache = self._backend.get_cache()
+        connection = self._backend.get_backend()[host]
+        channel_prefix = "__keyspace@%d__:" % connection.db
+
+        while not self._stopped.is_set():
+            pubsub = None
+            try:
+                if self._configure:
+                    self._configure_host(connection.connection)
+
+                pubsub = connection.connection.pubsub()
+                pubsub.psubscribe(channel_prefix + self._backend._prefix + "*")
+                #anything could have changed while we weren't subscribed
+                cache.clear()
+
+                while not self._stopped.is_set():
+                    message = pubsub.get_message(timeout=self._poll_interval)
+                    if message is not None and message['type'] == 'pmessage':
+                        cache.invalidate(message['channel'][len(channel_prefix):])
+            except RedisError, e:
+                logger.warning("Lost keyspace notifications for host %s: %s", host, e)
+                cache.clear()
+                self._stopped.wait(self._retry_interval)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except RedisError:
+                        pass
+
+    def _configure_host(self, client):
+        """
+        Adds the keyspace notification classes we need to the ones already configured on a host
+        """
+        current = client.config_get("notify-keyspace-events").get("notify-keyspace-events", "")
+        #``A`` is an alias for every class of commands
+        needed = "K" if "A" in current else self.notify_keyspace_events
+        missing = "".join(flag for flag in needed if flag not in current)
+        if missing:
+            client.config_set("notify-keyspace-events", current + missing)
@@ -0,0 +1,312 @@
+"""
+Copyright 2012 Numan Sachwani <numan@7Geese.com>
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+from sandsnake import create_sandsnake_backend
+from sandsnake.backends.codecs import InternedCodec
+from sandsnake.utils import import_string, run_batches
+
+from redis.exceptions import ResponseError
+
+import collections
+import json
+import optparse
+import os
+
+
+class KeySchemaMigration(object):
+    """
+    Incrementally rewrites the keys and marker hash fields written with ``old_schema`` into the key schema
+    of a ``Redis`` sandsnake backend. Data is merged into any keys that already exist in the new schema.
+
+    The migration must run while writes are stopped. Reads and writes through the new schema don't see the
+    old keys, so until the migration reaches an object its data is missing, and the merge brings back
+    anything removed through the new schema in the meantime: removed activities and deleted indexes are
+    copied in again, and bubbled scores and markers are overwritten with their old values.
+
+    Index collections are walked first, moving every index of an object along with the collection, then
+    marker hashes, then the locations sets of the ``reverse_index`` setting. All are walked host by host with
+    ``SCAN``. Indexes and locations sets are copied ``batch_size`` items at a time, and the old key is only
+    deleted once it has been copied completely. The position of the walk is kept
+    in ``checkpoint``, a dictionary of ``<phase>:<host>`` strings to ``SCAN`` cursors, which can be saved
+    and passed back in to resume an interrupted migration.
+
+    The member dictionary of ``InternedCodec`` is not migrated. New ids are assigned as soon as the backend
+    runs with the new schema, so the old and new dictionaries can't be merged; backends using
+    ``InternedCodec`` must keep its name and a ``ValueError`` is raised if it changes.
+
+    >>> migration = KeySchemaMigration(backend, KeySchema(prefix="ssnake:"), batch_size=200)
+    >>> migration.run()
+    """
+    phases = ('collections', 'markers', 'locations')
+
+    def __init__(self, backend, old_schema, batch_size=100, objects_per_second=None, checkpoint=None):
+        """
+        :type backend: sandsnake.backends.redis.Redis
+        :param backend: the backend configured with the new key schema
+        :type old_schema: sandsnake.backends.schema.KeySchema
+        :param old_schema: the key schema the data was written with
+        :type batch_size: int
+        :param batch_size: a hint for the number of keys to scan per batch
+        :type objects_per_second: int
+        :param objects_per_second: the maximum rate at which objects are migrated. ``None`` means no limit
+        :type checkpoint: dict
+        :param checkpoint: the ``checkpoint`` of a previous migration to resume from
+        """
+        if isinstance(backend._codec, InternedCodec) and \
+                old_schema.member_dictionary_shard_name(0) != backend._schema.member_dictionary_shard_name(0):
+            raise ValueError("The member dictionary of InternedCodec can't be migrated")
+
+        self._backend = backend
+        self._old_schema = old_schema
+        self._new_schema = backend._schema
+        self._batch_size = batch_size
+        self._objects_per_second = objects_per_second
+        self.checkpoint = dict(checkpoint or {})
+        self.migrated = 0
+
+    def is_complete(self):
+        """
+        Returns ``True`` once every phase has been completed on every host
+        """
+        return self._next_step() is None
+
+    def migrate_batch(self):
+        """
+        Migrates a single batch of objects from the next host that has not been completely migrated.
+
+        :return the number of objects migrated, or ``None`` if the migration is complete
+        """
+        step = self._next_step()
+        if step is None:
+            return None
+        phase, host = step
+        checkpoint_key = "%s:%s" % (phase, host)
+
+        if phase == 'collections':
+            pattern = self._old_schema.index_collection_pattern()
+        elif phase == 'markers':
+            pattern = self._old_schema.obj_markers_pattern()
+        else:
+            pattern = self._old_schema.activity_locations_pattern()
+        cursor, keys = self._backend.get_backend()[host].connection.scan(self.checkpoint.get(checkpoint_key) or 0, \
+            match=pattern, count=self._batch_size)
+
+        if keys:
+            if phase == 'collections':
+                self._migrate_collections(host, keys)
+            elif phase == 'markers':
+                self._migrate_markers(host, keys)
+            else:
+                self._migrate_locations(host, keys)
+            self.migrated += len(keys)
+
+        self.checkpoint[checkpoint_key] = cursor
+        return len(keys)
+
+    def run(self, max_batches=None):
+        """
+        Migrates batches until the migration is complete or ``max_batches`` batches have been migrated,
+        sleeping between batches to respect ``objects_per_second``.
+
+        :type max_batches: int
+        :param max_batches: the maximum number of batches to migrate. ``None`` means no limit
+        :return the number of objects migrated so far
+        """
+        run_batches(self.migrate_batch, self._objects_per_second, max_batches)
+        return self.migrated
+
+    def _next_step(self):
+        for phase in self.phases:
+            for host in sorted(self._backend.get_backend()):
+                if self.checkpoint.get("%s:%s" % (phase, host)) != 0:
+                    return phase, host
+        return None
+
+    def _migrate_collections(self, host, keys):
+        """
+        Moves the index collections in ``keys``, and the indexes in them, to the new schema
+        """
+        backend = self._backend
+        results = backend._execute_on_host(host, [('smembers', (key,)) for key in keys], raise_on_error=False)
+
+        #keys that only look like index collections aren't sets
+        collections_found = []
+        for key, indexes in zip(keys, results):
+            if not isinstance(indexes, Exception):
+                collections_found.append((key, self._old_schema.obj_from_index_collection_name(key), indexes))
+
+        moves = []
+        for key, obj, indexes in collections_found:
+            for index in indexes:
+                old_key, new_key = self._old_schema.index_name(obj, index), backend._get_index_name(obj, index)
+                if old_key != new_key:
+                    moves.append((old_key, new_key))
+        self._copy_indexes(moves)
+
+        writes = collections.defaultdict(list)
+        deletes = collections.defaultdict(list)
+        for old_key, new_key in moves:
+            deletes[backend._get_host(old_key)].append(('delete', (old_key,)))
+
+        for key, obj, indexes in collections_found:
+            new_key = backend._get_index_collection_name(obj)
+            if key == new_key:
+                continue
+            if indexes:
+                writes[backend._get_host(new_key)].append(('sadd', (new_key,) + tuple(indexes)))
+            deletes[host].append(('delete', (key,)))
+
+        backend._execute_per_host(writes)
+        backend._execute_per_host(deletes)
+
+    def _copy_indexes(self, moves):
+        """
+        Copies indexes ``batch_size`` items at a time. Every window of every index is read in pipelines
+        grouped by host, then written, until every index has been copied.
+
+        :type moves: list
+        :param moves: a list of ``(old key, new key)`` tuples
+        """
+        backend = self._backend
+        start = 0
+        while moves:
+            reads = collections.defaultdict(list)
+            for old_key, new_key in moves:
+                reads[backend._get_host(old_key)].append(\
+                    ('zrange', (old_key, start, start + self._batch_size - 1, False, True)))
+            read_results = dict((host, iter(results)) for host, results in backend._execute_per_host(reads).items())
+
+            writes = collections.defaultdict(list)
+            remaining = []
+            for old_key, new_key in moves:
+                values = read_results[backend._get_host(old_key)].next()
+                if values:
+                    args = []
+                    for value, score in values:
+                        args.extend((score, value))
+                    writes[backend._get_host(new_key)].append(('zadd', (new_key,) + tuple(args)))
+                if len(values) == self._batch_size:
+                    remaining.append((old_key, new_key))
+            backend._execute_per_host(writes)
+
+            moves = remaining
+            start += self._batch_size
+
+    def _migrate_locations(self, host, keys):
+        """
+        Moves the locations sets of the reverse index in ``keys`` to the new schema. Locations hold index
+        names rather than keys, so they are copied as they are.
+        """
+        backend = self._backend
+        connection = backend.get_backend()[host].connection
+        for key in keys:
+            new_key = backend._get_activity_locations_name(self._old_schema.activity_from_activity_locations_name(key))
+            if new_key == key:
+                continue
+
+            new_connection = backend.get_backend()[backend._get_host(new_key)].connection
+            cursor = 0
+            try:
+                while True:
+                    cursor, members = connection.sscan(key, cursor, count=self._batch_size)
+                    if members:
+                        new_connection.sadd(new_key, *members)
+                    if not long(cursor):
+                        break
+            except ResponseError:
+                #keys that only look like locations sets aren't sets
+                continue
+            connection.delete(key)
+
+    def _migrate_markers(self, host, keys):
+        """
+        Moves the marker hashes in ``keys`` to the new schema, renaming their fields
+        """
+        backend = self._backend
+        results = backend._execute_on_host(host, [('hgetall', (key,)) for key in keys], raise_on_error=False)
+
+        writes = collections.defaultdict(list)
+        deletes = collections.defaultdict(list)
+        for key, markers in zip(keys, results):
+            if isinstance(markers, Exception) or not markers:
+                continue
+
+            new_key = backend._get_obj_markers_name(self._old_schema.obj_from_obj_markers_name(key))
+            new_markers = {}
+            for field, value in markers.items():
+                index, marker_name = self._old_schema.parse_index_marker_name(field)
+                new_markers[self._new_schema.index_marker_name(index, marker_name)] = value
+
+            if key == new_key and new_markers == markers:
+                continue
+            writes[backend._get_host(new_key)].append(('hmset', (new_key, new_markers)))
+            if key != new_key:
+                deletes[host].append(('delete', (key,)))
+            else:
+                stale = [field for field in markers if field not in new_markers]
+                if stale:
+                    deletes[host].append(('hdel', (key,) + tuple(stale)))
+
+        backend._execute_per_host(writes)
+        backend._execute_per_host(deletes)
+
+
+def main(argv=None):
+    """
+    Command line interface to ``KeySchemaMigration``::
+
+        python -m sandsnake.migrate --settings sandsnake.json --old-schema sandsnake.backends.schema.KeySchema
+
+    ``--settings`` is a JSON file with the arguments to ``create_sandsnake_backend``. Its settings should
+    set ``key_schema`` and ``key_schema_options`` to the new schema. Writes must be stopped while it runs.
+    """
+    parser = optparse.OptionParser(usage="%prog --settings FILE [options]")
+    parser.add_option("--settings", help="JSON file with the arguments to create_sandsnake_backend")
+    parser.add_option("--old-schema", default="sandsnake.backends.schema.KeySchema",
+        help="dotted path to the key schema the data was written with")
+    parser.add_option("--old-schema-options", default="{}", help="JSON arguments for the old key schema")
+    parser.add_option("--checkpoint", help="file to resume from and to save progress to")
+    parser.add_option("--batch-size", type="int", default=100, help="number of keys to scan per batch")
+    parser.add_option("--objects-per-second", type="int", default=None, help="maximum migration rate")
+    options, args = parser.parse_args(argv)
+
+    if not options.settings:
+        parser.error("--settings is required")
+
+    with open(options.settings) as settings_file:
+        backend = create_sandsnake_backend(json.load(settings_file))
+    old_schema = import_string(options.old_schema)(**json.loads(options.old_schema_options))
+
+    checkpoint = None
+    if options.checkpoint and os.path.exists(options.checkpoint):
+        with open(options.checkpoint) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+
+    migration = KeySchemaMigration(backend, old_schema, batch_size=options.batch_size, \
+        objects_per_second=options.objects_per_second, checkpoint=checkpoint)
+    while not migration.is_complete():
+        migration.run(max_batches=10)
+        if options.checkpoint:
+            with open(options.checkpoint, "w") as checkpoint_file:
+                json.dump(migration.checkpoint, checkpoint_file)
+        print "migrated %d keys" % migration.migrated
+
+    print "migration complete, migrated %d keys" % migration.migrated
+
+
+if __name__ == "__main__":
+    main()
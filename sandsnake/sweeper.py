@@ -0,0 +1,90 @@
+"""
+Copyright 2012 Numan Sachwani <numan@7Geese.com>
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+from sandsnake.utils import run_batches
+
+
+class RetentionSweeper(object):
+    """
+    Incrementally removes expired items from every index of a ``Redis`` sandsnake backend.
+
+    Objects are walked host by host with ``SCAN`` so no single call blocks redis for long. The
+    position of the walk is kept in ``checkpoint``, a dictionary of host numbers (as strings, so it
+    survives a JSON round trip) to ``SCAN`` cursors, which can be saved and passed back in to resume an
+    interrupted sweep.
+
+    >>> sweeper = RetentionSweeper(backend, batch_size=200, objects_per_second=1000)
+    >>> sweeper.run()
+    """
+    def __init__(self, backend, batch_size=100, objects_per_second=None, checkpoint=None):
+        """
+        :type backend: sandsnake.backends.redis.Redis
+        :param backend: the backend to sweep. Retention windows are taken from its settings
+        :type batch_size: int
+        :param batch_size: a hint for the number of keys to scan per batch
+        :type objects_per_second: int
+        :param objects_per_second: the maximum rate at which objects are swept. ``None`` means no limit
+        :type checkpoint: dict
+        :param checkpoint: the ``checkpoint`` of a previous sweep to resume from
+        """
+        self._backend = backend
+        self._batch_size = batch_size
+        self._objects_per_second = objects_per_second
+        self.checkpoint = dict((str(host), cursor) for host, cursor in (checkpoint or {}).items())
+        self.removed = 0
+
+    def is_complete(self):
+        """
+        Returns ``True`` once every host has been swept
+        """
+        hosts = self._backend.get_backend()
+        return all(self.checkpoint.get(str(host)) == 0 for host in hosts)
+
+    def sweep_batch(self, now=None):
+        """
+        Sweeps a single batch of objects from the next host that has not been completely swept.
+
+        :type now: datetime
+        :param now: the time the retention window is relative to. Defaults to the current utc time
+        :return the number of objects swept, or ``None`` if the sweep is complete
+        """
+        for host in sorted(self._backend.get_backend()):
+            cursor = self.checkpoint.get(str(host))
+            if cursor == 0:
+                continue
+
+            cursor, objs = self._backend._scan_index_collections(host, cursor=cursor or 0, count=self._batch_size)
+            if objs:
+                self.removed += self._backend.trim_expired(objs, now=now)
+            self.checkpoint[str(host)] = cursor
+            return len(objs)
+
+        return None
+
+    def run(self, now=None, max_batches=None):
+        """
+        Sweeps batches until the sweep is complete or ``max_batches`` batches have been swept, sleeping
+        between batches to respect ``objects_per_second``.
+
+        :type now: datetime
+        :param now: the time the retention window is relative to. Defaults to the current utc time
+        :type max_batches: int
+        :param max_batches: the maximum number of batches to sweep. ``None`` means no limit
+        :return the number of items removed so far
+        """
+        run_batches(lambda: self.sweep_batch(now=now), self._objects_per_second, max_batches)
+        return self.removed
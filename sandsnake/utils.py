@@ -17,6 +17,15 @@ under the License.
 """
 
 import collections
+import datetime
+import functools
+import itertools
+import Queue
+import re
+import threading
+import time
+
+from sandsnake.exceptions import SandsnakeTimeoutException
 
 
 # import_string comes form Werkzeug
@@ -45,6 +54,322 @@ def import_string(import_name, silent=False):
         if not silent:
             raise
 
+
+def chunks(iterable, size):
+    """
+    Splits ``iterable`` into lists of at most ``size`` items without loading
+    all of ``iterable`` into memory.
+
+    :type iterable: iterable
+    :param iterable: the items to split up
+    :type size: int
+    :param size: the maximum number of items per chunk
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def prefetched(iterable, size=1):
+    """
+    Iterates over ``iterable`` in a background thread, staying up to ``size`` items ahead of the
+    consumer. Useful when producing the next item means waiting on the network.
+
+    :type iterable: iterable
+    :param iterable: the items to prefetch
+    :type size: int
+    :param size: the maximum number of items fetched ahead of time
+    """
+    queue = Queue.Queue(size)
+    stopped = threading.Event()
+    done = object()
+
+    def put(item, error=None):
+        #give up as soon as the consumer goes away so the thread doesn't hang around
+        while not stopped.is_set():
+            try:
+                queue.put((item, error), timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(done)
+        except Exception, e:
+            put(done, e)
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        while True:
+            item, error = queue.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stopped.set()
+
+
+def run_batches(step, per_second=None, max_batches=None):
+    """
+    Calls ``step`` until it returns ``None`` or ``max_batches`` batches have run, sleeping between batches
+    so that no more than ``per_second`` objects are processed per second.
+
+    :type step: callable
+    :param step: processes one batch and returns the number of objects processed, or ``None`` when there
+    is nothing left
+    :type per_second: int
+    :param per_second: the maximum number of objects processed per second. ``None`` means no limit
+    :type max_batches: int
+    :param max_batches: the maximum number of batches. ``None`` means no limit
+    :return the number of batches run
+    """
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        started = time.time()
+        processed = step()
+        if processed is None:
+            break
+        batches += 1
+
+        if per_second:
+            delay = float(processed) / per_second - (time.time() - started)
+            if delay > 0:
+                time.sleep(delay)
+
+    return batches
+
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+ISO8601_RE = re.compile(r"^(\d{4})-(\d{2})-(\d{2})"
+    r"(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6})\d*)?)?)?"
+    r"(?:(Z)|([+-])(\d{2}):?(\d{2}))?$")
+
+
+class FixedOffset(datetime.tzinfo):
+    """
+    A timezone with a fixed offset from UTC
+    """
+    def __init__(self, minutes):
+        self._offset = datetime.timedelta(minutes=minutes)
+
+    def utcoffset(self, dt):
+        return self._offset
+
+    def dst(self, dt):
+        return datetime.timedelta(0)
+
+    def tzname(self, dt):
+        return None
+
+    def __repr__(self):
+        return "FixedOffset(%d)" % (self._offset.days * 1440 + self._offset.seconds / 60)
+
+UTC = FixedOffset(0)
+
+
+def lru_memoize(max_size):
+    """
+    Decorator that remembers the results of the last ``max_size`` distinct calls of a function
+    of one hashable argument.
+
+    :type max_size: int
+    :param max_size: the maximum number of results to remember
+    """
+    def decorator(func):
+        results = collections.OrderedDict()
+        lock = threading.Lock()
+
+        @functools.wraps(func)
+        def wrapped(arg):
+            with lock:
+                if arg in results:
+                    result = results.pop(arg)
+                    results[arg] = result
+                    return result
+            result = func(arg)
+            with lock:
+                results[arg] = result
+                if len(results) > max_size:
+                    results.popitem(last=False)
+            return result
+        wrapped.cache = results
+        return wrapped
+    return decorator
+
+
+@lru_memoize(4096)
+def parse_iso8601(value):
+    """
+    Strictly parses an ISO 8601 date and time such as ``2012-01-01T12:00:00.000Z``. Much faster than
+    ``dateutil``, and results are cached since the same markers tend to be parsed over and over.
+
+    :type value: string
+    :param value: the string to parse
+    :return a ``datetime``, which is timezone aware if ``value`` has a timezone, or ``None`` if ``value``
+    is not in ISO 8601 format
+    """
+    match = ISO8601_RE.match(value)
+    if match is None:
+        return None
+
+    year, month, day, hour, minute, second, fraction, utc, sign, offset_hours, offset_minutes = match.groups()
+    tzinfo = None
+    if utc:
+        tzinfo = UTC
+    elif sign:
+        offset = int(offset_hours) * 60 + int(offset_minutes)
+        tzinfo = FixedOffset(-offset if sign == "-" else offset)
+
+    try:
+        return datetime.datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0),
+            int(second or 0), int((fraction or "0").ljust(6, "0")), tzinfo)
+    except ValueError:
+        return None
+
+
+def datetime_to_timestamp(dt):
+    """
+    Converts a ``datetime`` into the number of milliseconds since the epoch. Naive datetimes are assumed
+    to be in UTC.
+
+    :type dt: datetime
+    :param dt: the datetime to convert
+    """
+    offset = dt.utcoffset()
+    if offset is not None:
+        dt = dt.replace(tzinfo=None) - offset
+    delta = dt - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000L + delta.microseconds / 1000
+
+
+def datetimes_to_timestamps(dts):
+    """
+    Converts many datetimes into milliseconds since the epoch. When every datetime is naive, or every
+    one shares the same ``FixedOffset``, the epoch is shifted once for the whole batch and each value
+    costs a single subtraction. Mixed batches fall back to ``datetime_to_timestamp``.
+
+    :type dts: list
+    :param dts: the datetimes to convert
+    :return a list of timestamps
+    """
+    tzinfo = dts[0].tzinfo if dts else None
+    for dt in dts:
+        if dt.tzinfo is not tzinfo:
+            return [datetime_to_timestamp(dt) for dt in dts]
+
+    if tzinfo is None:
+        epoch = EPOCH
+    elif isinstance(tzinfo, FixedOffset):
+        #aware datetimes sharing a tzinfo subtract without looking up their offsets
+        epoch = (EPOCH + tzinfo.utcoffset(None)).replace(tzinfo=tzinfo)
+    else:
+        #other timezones can change their offset from one datetime to the next
+        return [datetime_to_timestamp(dt) for dt in dts]
+
+    timestamps = []
+    append = timestamps.append
+    for dt in dts:
+        delta = dt - epoch
+        append((delta.days * 86400 + delta.seconds) * 1000L + delta.microseconds / 1000)
+    return timestamps
+
+
+class Future(object):
+    """
+    The eventual result of a call submitted to a ``WorkerPool``
+    """
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def set_result(self, result=None, error=None):
+        self._result = result
+        self._error = error
+        self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Waits for the call to finish and returns its result, raising its exception if it failed.
+
+        :type timeout: int or float
+        :param timeout: the maximum number of seconds to wait. ``None`` waits forever
+        :raises SandsnakeTimeoutException: if the call did not finish in time
+        """
+        self._done.wait(timeout)
+        if not self._done.is_set():
+            raise SandsnakeTimeoutException("Timed out after %s seconds" % (timeout,))
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class WorkerPool(object):
+    """
+    A bounded pool of daemon threads that are started on demand and reused between calls.
+
+    >>> pool = WorkerPool(4)
+    >>> futures = [pool.submit(pow, 2, i) for i in xrange(10)]
+    >>> [future.result(timeout=1) for future in futures]
+    [1, 2, 4, 8, 16, 32, 64, 128, 256, 512]
+    """
+    def __init__(self, workers):
+        """
+        :type workers: int
+        :param workers: the maximum number of threads in the pool
+        """
+        self.workers = workers
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._idle = 0
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Calls ``func`` with ``args`` and ``kwargs`` on a thread of the pool
+
+        :return a ``Future`` for the result of the call
+        """
+        future = Future()
+        with self._lock:
+            self._queue.put((future, func, args, kwargs))
+            if self._idle <= 0 and len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+            else:
+                self._idle -= 1
+        return future
+
+    def _work(self):
+        while True:
+            future, func, args, kwargs = self._queue.get()
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception, e:
+                future.set_result(error=e)
+            with self._lock:
+                self._idle += 1
+
+
 """
 An OrderedSet is a custom MutableSet that remembers its order, so that every
 entry has an index that can be looked up.
@@ -60,36 +385,77 @@ Rob Speer's changes are as follows:
     - index() just returns the index of an item
     - added a __getstate__ and __setstate__ so it can be pickled
     - added __getitem__
+
+Sandsnake's changes are as follows:
+
+    - deletes leave a tombstone in the list instead of rebuilding it, so they are
+      O(1). The list is compacted once half of it is tombstones, and before
+      looking items up by index
+    - instances use __slots__
+    - update() and |= add many items without going through add()
 """
 
 SLICE_ALL = slice(None)
 
+#takes the place of deleted items in ``OrderedSet._items`` until the list is compacted
+_DELETED = object()
 
-class OrderedSet(collections.MutableSet):
+
+class OrderedSet(object):
     """
     An OrderedSet is a custom MutableSet that remembers its order, so that
     every entry has an index that can be looked up.
     """
+    #``collections.MutableSet`` has no __slots__, so it is registered instead of subclassed
+    __slots__ = ('_items', '_map', '_deleted', '_head')
+    __hash__ = None
+
     def __init__(self, iterable=None):
-        self.items = []
-        self.map = {}
+        self._items = []
+        #items to their position in ``_items``
+        self._map = {}
+        #the number of tombstones in ``_items``
+        self._deleted = 0
+        #no item before this position in ``_items`` is alive
+        self._head = 0
         if iterable is not None:
-            self |= iterable
+            self.update(iterable)
+
+    @classmethod
+    def _from_iterable(cls, iterable):
+        return cls(iterable)
+
+    @property
+    def items(self):
+        """
+        The list of the items, in order
+        """
+        self._compact()
+        return self._items
+
+    @property
+    def map(self):
+        """
+        The dictionary of the items to their index
+        """
+        self._compact()
+        return self._map
 
     def __len__(self):
-        return len(self.items)
+        return len(self._items) - self._deleted
 
     def __getitem__(self, index):
         if index == SLICE_ALL:
             return self
-        elif hasattr(index, '__index__') or isinstance(index, slice):
-            result = self.items[index]
+        self._compact()
+        if hasattr(index, '__index__') or isinstance(index, slice):
+            result = self._items[index]
             if isinstance(result, list):
                 return OrderedSet(result)
             else:
                 return result
         elif hasattr(index, '__iter__'):
-            return OrderedSet([self.items[i] for i in index])
+            return OrderedSet([self._items[i] for i in index])
         else:
             raise TypeError("Don't know how to index an OrderedSet by %r" %
                     index)
@@ -104,38 +470,89 @@ class OrderedSet(collections.MutableSet):
         self.__init__(state)
 
     def __contains__(self, key):
-        return key in self.map
+        return key in self._map
 
     def add(self, key):
-        if key not in self.map:
-            self.map[key] = len(self.items)
-            self.items.append(key)
-        return self.map[key]
+        if key not in self._map:
+            self._map[key] = len(self._items)
+            self._items.append(key)
+            return len(self) - 1
+        return self.index(key)
+
+    def update(self, iterable):
+        """
+        Adds every item of ``iterable`` that is not in the set yet, in order
+        """
+        items, positions = self._items, self._map
+        for key in iterable:
+            if key not in positions:
+                positions[key] = len(items)
+                items.append(key)
+
+    def __ior__(self, iterable):
+        self.update(iterable)
+        return self
 
     def index(self, key):
         """
         Get the index of a given key, raising an IndexError if it's not
         present.
+
+        Indexes shift when items are discarded, so the first call after a
+        ``discard`` compacts the set, which takes O(n). Later calls take O(1)
+        until the next ``discard``.
         """
         if hasattr(key, '__iter__'):
             return [self.index(subkey) for subkey in key]
-        return self.map[key]
+        self._compact()
+        return self._map[key]
 
     def discard(self, key):
-        if key in self.map:
-            loc = self.map.pop(key)
-            self.items = self.items[:loc] + self.items[loc + 1:]
+        if key in self._map:
+            self._items[self._map.pop(key)] = _DELETED
+            self._deleted += 1
+
+            #tombstones at the end of the list can go right away
+            items = self._items
+            while items and items[-1] is _DELETED:
+                items.pop()
+                self._deleted -= 1
+            self._head = min(self._head, len(items))
+            if self._deleted > len(items) / 2:
+                self._compact()
+
+    def clear(self):
+        self.__init__()
+
+    def _compact(self):
+        """
+        Removes the tombstones from the list and updates the positions of the items that moved
+        """
+        if self._deleted:
+            self._items = [key for key in self._items if key is not _DELETED]
+            self._map = dict((key, position) for position, key in enumerate(self._items))
+            self._deleted = 0
+            self._head = 0
 
     def __iter__(self):
-        return iter(self.items)
+        if not self._deleted:
+            return iter(self._items)
+        return (key for key in self._items if key is not _DELETED)
 
     def __reversed__(self):
-        return reversed(self.items)
+        if not self._deleted:
+            return reversed(self._items)
+        return (key for key in reversed(self._items) if key is not _DELETED)
 
     def pop(self, last=True):
         if not self:
             raise KeyError('set is empty')
-        key = next(reversed(self)) if last else next(iter(self))
+        if last:
+            key = self._items[-1]
+        else:
+            while self._items[self._head] is _DELETED:
+                self._head += 1
+            key = self._items[self._head]
         self.discard(key)
         return key
 
@@ -146,5 +563,45 @@ class OrderedSet(collections.MutableSet):
 
     def __eq__(self, other):
         if isinstance(other, OrderedSet):
-            return len(self) == len(other) and self.items == other.items
+            return len(self) == len(other) and list(self) == list(other)
         return set(self) == set(other)
+
+    #the rest of the ``MutableSet`` mixin methods
+    __ne__ = collections.Set.__ne__.im_func
+    __le__ = collections.Set.__le__.im_func
+    __lt__ = collections.Set.__lt__.im_func
+    __ge__ = collections.Set.__ge__.im_func
+    __gt__ = collections.Set.__gt__.im_func
+    __and__ = collections.Set.__and__.im_func
+    __or__ = collections.Set.__or__.im_func
+    __sub__ = collections.Set.__sub__.im_func
+    __xor__ = collections.Set.__xor__.im_func
+    isdisjoint = collections.Set.isdisjoint.im_func
+    remove = collections.MutableSet.remove.im_func
+    __iand__ = collections.MutableSet.__iand__.im_func
+    __isub__ = collections.MutableSet.__isub__.im_func
+    __ixor__ = collections.MutableSet.__ixor__.im_func
+
+    #python 2 sets have no reflected operators, so ``[1, 2] | ordered`` needs these
+    def __rand__(self, other):
+        if not isinstance(other, collections.Iterable):
+            return NotImplemented
+        return self._from_iterable(value for value in other if value in self)
+
+    def __ror__(self, other):
+        if not isinstance(other, collections.Iterable):
+            return NotImplemented
+        return self._from_iterable(itertools.chain(other, self))
+
+    def __rsub__(self, other):
+        if not isinstance(other, collections.Iterable):
+            return NotImplemented
+        return self._from_iterable(value for value in other if value not in self)
+
+    def __rxor__(self, other):
+        if not isinstance(other, collections.Iterable):
+            return NotImplemented
+        other = self._from_iterable(other)
+        return (other - self) | (self - other)
+
+collections.MutableSet.register(OrderedSet)
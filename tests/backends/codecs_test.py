@@ -0,0 +1,134 @@
+from __future__ import absolute_import
+
+from nose.tools import ok_, eq_, raises
+
+from sandsnake import create_sandsnake_backend
+from sandsnake.backends.codecs import IntegerCodec, UUIDCodec
+from sandsnake.exceptions import SandsnakeValidationException
+
+import uuid
+
+
+class TestCodecs(object):
+    def test_integer_round_trip(self):
+        codec = IntegerCodec()
+        for value in ["0", "255", "256", "18446744073709551616"]:
+            eq_(codec.decode(codec.encode(value)), value)
+        eq_(codec.encode(256), "\x01\x00")
+        eq_(codec.decode_many(codec.encode_many([1, "2"])), ["1", "2"])
+
+    @raises(SandsnakeValidationException)
+    def test_integer_not_canonical(self):
+        IntegerCodec().encode("007")
+
+    @raises(SandsnakeValidationException)
+    def test_integer_negative(self):
+        IntegerCodec().encode(-1)
+
+    def test_uuid_round_trip(self):
+        codec = UUIDCodec()
+        value = uuid.uuid4()
+        eq_(len(codec.encode(str(value))), 16)
+        eq_(codec.decode(codec.encode(value.hex)), str(value))
+
+    @raises(SandsnakeValidationException)
+    def test_uuid_invalid(self):
+        UUIDCodec().encode("not a uuid")
+
+
+class TestBackendWithCodec(object):
+    def _create_backend(self, codec, **settings):
+        settings.update({
+            "hosts": [{"db": 3}, {"db": 4}, {"db": 5}],
+            "member_codec": codec,
+        })
+        return create_sandsnake_backend({
+            "backend": "sandsnake.backends.redis.RedisWithBubbling",
+            "settings": settings,
+        })
+
+    def setUp(self):
+        self._redis_backend = self._create_backend("sandsnake.backends.codecs.IdentityCodec").get_backend()
+
+        #clear the redis database so we are in a consistent state
+        self._redis_backend.flushdb()
+
+    def tearDown(self):
+        self._redis_backend.flushdb()
+
+    def _check_codec(self, backend, values):
+        backend.add("user:1", ["homefeed", "profile"], values[0], published=1000)
+        backend.add_many("user:1", [("homefeed", value, 1000 + i) for i, value in enumerate(values[1:], 1)])
+        eq_(backend.get("user:1", "homefeed", marker=5000, limit=40), values[::-1])
+        eq_(backend.get("user:1", ["homefeed", "profile"], marker=5000, withscores=True)[1], [(values[0], 1000)])
+
+        page, cursor = backend.get_page("user:1", "homefeed", limit=2, after=True)
+        eq_(page, values[:2])
+        eq_(backend.get_page("user:1", "homefeed", cursor=cursor, limit=2, after=True)[0], values[2:4])
+
+        backend.remove("user:1", "homefeed", values[0])
+        backend.remove_values("user:1", "homefeed", [values[1]])
+        backend.bubble_values("user:1", "homefeed", {values[2]: 9000})
+        eq_(backend.get("user:1", "homefeed", marker=10000), [values[2]] + values[3:][::-1])
+
+    def test_integer_codec(self):
+        backend = self._create_backend("sandsnake.backends.codecs.IntegerCodec")
+        self._check_codec(backend, ["1", "2", "300", "4000000000", "5"])
+        eq_(self._redis_backend.zrange(backend._get_index_name("user:1", "profile"), 0, -1), ["\x01"])
+
+    def test_uuid_codec(self):
+        backend = self._create_backend("sandsnake.backends.codecs.UUIDCodec")
+        self._check_codec(backend, [str(uuid.uuid4()) for i in xrange(5)])
+
+    def test_interned_codec(self):
+        backend = self._create_backend("sandsnake.backends.codecs.InternedCodec")
+        values = ["urn:activity:%d" % i for i in xrange(5)]
+        self._check_codec(backend, values)
+        member = self._redis_backend.zrange(backend._get_index_name("user:1", "profile"), 0, -1)[0]
+        eq_(len(member), 1)
+
+        #ids are shared by every process
+        other = self._create_backend("sandsnake.backends.codecs.InternedCodec")
+        eq_(other.get("user:1", "profile", marker=5000), [values[0]])
+        other.add("user:2", "homefeed", values[0], published=1000)
+        eq_(self._redis_backend.zrange(backend._get_index_name("user:2", "homefeed"), 0, -1), [member])
+
+    def test_interned_shards(self):
+        backend = self._create_backend("sandsnake.backends.codecs.InternedCodec", \
+            member_codec_options={"shards": 4})
+        values = ["urn:activity:%d" % i for i in xrange(40)]
+        backend.add_many("user:1", [("homefeed", value, 1000 + i) for i, value in enumerate(values)])
+        eq_(backend.get("user:1", "homefeed", marker=5000, limit=40), values[::-1])
+
+        sizes = [self._redis_backend.hlen(backend._schema.member_dictionary_shard_name(shard)) for shard in xrange(4)]
+        ok_(all(sizes))
+        #a sequence, then an id and a value field per activity in every shard
+        eq_(sum(sizes), 4 + 2 * len(values))
+        eq_(self._redis_backend.hlen(backend._schema.member_dictionary_shard_name(4)), 0)
+
+    def test_interned_unknown_ids_are_left_out(self):
+        backend = self._create_backend("sandsnake.backends.codecs.InternedCodec")
+        backend.add_many("user:1", [("homefeed", "urn:activity:%d" % i, 1000 + i) for i in xrange(3)])
+        self._redis_backend.zadd(backend._get_index_name("user:1", "homefeed"), 1500, "\xff\xff")
+
+        other = self._create_backend("sandsnake.backends.codecs.InternedCodec")
+        eq_(other.get("user:1", "homefeed", marker=5000), ["urn:activity:2", "urn:activity:1", "urn:activity:0"])
+        eq_(other.get("user:1", "homefeed", marker=5000, withscores=True)[0], ("urn:activity:2", 1002))
+        eq_(other._codec.decode_many(["\xff\xff"]), [])
+        eq_(other._codec.decode("\xff\xff"), None)
+
+    def test_interned_remove_unknown(self):
+        backend = self._create_backend("sandsnake.backends.codecs.InternedCodec")
+        backend.remove_values("user:1", "homefeed", ["never added"])
+        backend.remove("user:1", "homefeed", "never added")
+        eq_(sum(self._redis_backend.hlen(name) for name in backend._codec._dictionaries), 0)
+
+    def test_trimmed_values_are_decoded(self):
+        backend = self._create_backend("sandsnake.backends.codecs.IntegerCodec", max_length=2)
+        removed = []
+        backend._post_remove = lambda obj, indexes, activity: removed.append(activity)
+
+        for i in xrange(3):
+            backend.add("user:1", "homefeed", str(i), published=1000 + i)
+        eq_(removed, ["0"])
+        eq_(backend.get("user:1", "homefeed", marker=5000), ["2", "1"])
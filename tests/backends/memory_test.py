@@ -0,0 +1,232 @@
+from __future__ import absolute_import
+
+from nose.tools import ok_, eq_, raises
+
+from sandsnake import create_sandsnake_backend
+from sandsnake.backends.base import LATEST
+from sandsnake.backends.memory import SortedIndex
+from sandsnake.exceptions import SandsnakeValidationException
+
+import datetime
+import random
+
+
+class TestSortedIndex(object):
+    def setUp(self):
+        self._index = SortedIndex()
+        for value, score in [("b", 2), ("a", 2), ("c", 1), ("d", 3)]:
+            self._index.add(value, score)
+
+    def test_order(self):
+        eq_(self._index.range_by_score(), [("c", 1), ("a", 2), ("b", 2), ("d", 3)])
+        eq_(self._index.range_by_score(reverse=True), [("d", 3), ("b", 2), ("a", 2), ("c", 1)])
+
+    def test_move_and_remove(self):
+        ok_(not self._index.add("a", 2))
+        ok_(self._index.add("a", 4))
+        ok_(self._index.remove("b"))
+        ok_(not self._index.remove("b"))
+        eq_(self._index.range_by_score(), [("c", 1), ("d", 3), ("a", 4)])
+        eq_(len(self._index), 3)
+        eq_(self._index.newest(), ("a", 4))
+
+    def test_ranges(self):
+        eq_(self._index.count(2, 2), 2)
+        eq_(self._index.count(low=2), 3)
+        eq_(self._index.range_by_score(low=2, limit=2), [("a", 2), ("b", 2)])
+        eq_(self._index.range_by_score(high=2, limit=2, reverse=True), [("b", 2), ("a", 2)])
+        eq_(self._index.range_after(2, "a", 5), [("b", 2), ("d", 3)])
+        eq_(self._index.range_after(2, "b", 5, reverse=True), [("a", 2), ("c", 1)])
+
+    def test_trim(self):
+        eq_(self._index.trim(2), ["c", "a"])
+        eq_(self._index.remove_below(3), ["b"])
+        eq_(self._index.range_by_score(), [("d", 3)])
+
+
+class TestMemoryBackend(object):
+    def setUp(self):
+        self._backend = create_sandsnake_backend({
+            "backend": "sandsnake.backends.memory.MemoryWithBubbling",
+            "settings": {
+                "max_lengths": {"capped": 2},
+                "retentions": {"notifications": 60},
+                "reverse_index": True,
+            },
+        })
+
+    def test_add_and_get(self):
+        published = datetime.datetime.utcnow()
+        for i in xrange(5):
+            self._backend.add("user:1", ["homefeed", "profile"], "activity_" + str(i), \
+                published=published + datetime.timedelta(seconds=i))
+
+        eq_(self._backend.get("user:1", "homefeed", marker=published + datetime.timedelta(seconds=3), limit=2), \
+            ["activity_3", "activity_2"])
+        eq_(self._backend.get("user:1", ["homefeed", "profile"], marker=published, after=True, limit=1), \
+            [["activity_0"], ["activity_0"]])
+        eq_(self._backend.get_count("user:1", "homefeed", published + datetime.timedelta(seconds=1)), 2)
+        eq_(self._backend.get_count("user:1", "homefeed", published + datetime.timedelta(seconds=1), after=True), 4)
+
+    @raises(SandsnakeValidationException)
+    def test_get_requires_marker(self):
+        self._backend.get("user:1", "homefeed")
+
+    def test_remove_and_delete(self):
+        self._backend.add_many("user:1", [("homefeed", "a", 1000), ("homefeed", "b", 2000), ("profile", "a", 1000)])
+        self._backend.remove("user:1", ["homefeed", "profile"], "a")
+        eq_(self._backend.get("user:1", "homefeed", marker=5000), ["b"])
+        self._backend.remove_values("user:1", "homefeed", ["b", "missing"])
+        eq_(self._backend.get("user:1", "homefeed", marker=5000), [])
+
+        self._backend.add("user:1", "homefeed", "c", published=1000)
+        self._backend.set_markers("user:1", "homefeed", {"_ssdefault": 1000})
+        self._backend.delete_index("user:1", ["homefeed", "profile"])
+        eq_(self._backend.get("user:1", "homefeed", marker=5000), [])
+        eq_(self._backend.get_default_marker("user:1", "homefeed"), None)
+
+    def test_capped_and_trim_expired(self):
+        now = datetime.datetime.utcnow()
+        for i in xrange(3):
+            self._backend.add("user:1", "capped", str(i), published=1000 + i)
+        eq_(self._backend.get("user:1", "capped", marker=5000), ["2", "1"])
+
+        self._backend.add("user:1", "notifications", "old", published=now - datetime.timedelta(seconds=61))
+        self._backend.add("user:1", "notifications", "new", published=now)
+        eq_(self._backend.trim_expired(["user:1", "user:2"], now=now), 1)
+        eq_(self._backend.get("user:1", "notifications", marker=now), ["new"])
+
+    def test_retract(self):
+        counts = self._backend.fanout_add(["user:%d" % i for i in xrange(5)], "homefeed", "activity", published=1000)
+        eq_(counts, {0: {'success': 10, 'failure': 0}})
+        self._backend.remove("user:1", "homefeed", "activity")
+
+        eq_(self._backend.retract("activity"), 4)
+        eq_(self._backend.retract("activity"), 0)
+        eq_(self._backend.get("user:0", "homefeed", marker=5000), [])
+
+    def test_locations_follow_deletes_and_bubbling(self):
+        self._backend.add("user:1", ["homefeed", "profile"], "activity", published=1000)
+        self._backend.bubble_values("user:2", "homefeed", {"activity": 2000})
+        self._backend.delete_index("user:1", "homefeed")
+        eq_(self._backend._locations["activity"], set([("user:1", "profile"), ("user:2", "homefeed")]))
+
+        now = datetime.datetime.utcnow()
+        self._backend.add("user:3", "notifications", "old", published=now - datetime.timedelta(days=1))
+        eq_(self._backend.trim_expired(["user:3"], now=now), 1)
+        ok_("old" not in self._backend._locations)
+
+    def test_pages(self):
+        for i in xrange(10):
+            self._backend.add("user:1", "homefeed", "activity_" + str(i), published=1000 + i / 3)
+
+        page, cursor = self._backend.get_page("user:1", "homefeed", limit=4)
+        eq_(page, ["activity_9", "activity_8", "activity_7", "activity_6"])
+        eq_(self._backend.get_page("user:1", "homefeed", cursor=cursor, limit=4)[0], \
+            ["activity_5", "activity_4", "activity_3", "activity_2"])
+        eq_(list(self._backend.iter_index("user:1", "homefeed", batch_size=3)), ["activity_" + str(i) for i in xrange(10)])
+        eq_(self._backend.get_merged("user:1", ["homefeed", "missing"], marker=1001, limit=2), ["activity_5", "activity_4"])
+
+    def test_markers(self):
+        self._backend.add("user:1", "homefeed", "a", published=1000)
+        self._backend.add("user:1", "homefeed", "b", published=2000)
+        self._backend.set_markers_many([("user:1", "homefeed", None, LATEST), ("user:1", "empty", None, LATEST), \
+            ("user:2", "homefeed", "read", 1500)])
+
+        eq_(self._backend.get_markers_many([("user:1", "homefeed", None), ("user:1", "empty", None), \
+            ("user:2", "homefeed", "read")]), [2000, None, 1500])
+        eq_(self._backend.get_counts_since_markers(["user:1", "user:3"], "homefeed"), {"user:1": 1, "user:3": 0})
+
+    def test_bubbling(self):
+        values_dict = {"a": 3000}
+        self._backend.add("user:1", "homefeed", "a", published=1000)
+        self._backend.add("user:1", "homefeed", "b", published=2000)
+
+        self._backend.bubble_values("user:1", "homefeed", values_dict)
+        eq_(values_dict, {"a": 3000})
+        eq_(self._backend.get("user:1", "homefeed", marker=5000), ["a", "b"])
+
+        eq_(self._backend.bubble_values_many([("user:1", "homefeed"), ("user:2", "homefeed")], {"b": 4000, "c": 1}, \
+            only_if_present=True), 1)
+        eq_(self._backend.bubble_values_many([("user:1", "homefeed")], {"b": 1}, only_if_greater=True), 0)
+
+    def test_clear_all(self):
+        self._backend.add("user:1", "homefeed", "a", published=1000)
+        self._backend.set_markers("user:1", "homefeed", {"read": 1000})
+        ok_(self._backend.clear_all() > 0)
+        eq_(self._backend.get("user:1", "homefeed", marker=5000), [])
+        eq_(self._backend.get_markers("user:1", "homefeed", "read"), None)
+
+
+class TestMemoryBackendMatchesRedis(object):
+    def setUp(self):
+        settings = {
+            "hosts": [{"db": 3}, {"db": 4}, {"db": 5}],
+            "max_lengths": {"capped": 20},
+        }
+        self._redis = create_sandsnake_backend({
+            "backend": "sandsnake.backends.redis.RedisWithBubbling",
+            "settings": settings,
+        })
+        self._memory = create_sandsnake_backend({
+            "backend": "sandsnake.backends.memory.MemoryWithBubbling",
+            "settings": settings,
+        })
+
+        self._redis_backend = self._redis.get_backend()
+        self._redis_backend.flushdb()
+
+    def tearDown(self):
+        self._redis_backend.flushdb()
+
+    def test_random_operations(self):
+        rand = random.Random(42)
+        objs = ["user:%d" % i for i in xrange(3)]
+        indexes = ["homefeed", "capped"]
+        values = ["activity_%d" % i for i in xrange(40)]
+
+        for i in xrange(500):
+            obj, index, value = rand.choice(objs), rand.choice(indexes), rand.choice(values)
+            score = 1000 + rand.randint(0, 50)
+            operation = rand.random()
+            for backend in (self._redis, self._memory):
+                if operation < 0.6:
+                    backend.add(obj, index, value, published=score)
+                elif operation < 0.75:
+                    backend.remove(obj, index, value)
+                elif operation < 0.9:
+                    backend.bubble_values_many([(obj, index)], {value: score}, only_if_present=True)
+                else:
+                    backend.set_markers(obj, index, {"read": score})
+
+        for obj in objs:
+            for index in indexes:
+                for after in (True, False):
+                    marker = 1025
+                    eq_(self._memory.get(obj, index, marker=marker, limit=15, after=after, withscores=True), \
+                        self._redis.get(obj, index, marker=marker, limit=15, after=after, withscores=True))
+                    eq_(list(self._memory.iter_index(obj, index, batch_size=7, reverse=after, withscores=True)), \
+                        list(self._redis.iter_index(obj, index, batch_size=7, reverse=after, withscores=True)))
+                eq_(self._memory.get_count(obj, index, 1025), self._redis.get_count(obj, index, 1025))
+            eq_(self._memory.get_counts_since_markers(objs, "homefeed", "read"), \
+                self._redis.get_counts_since_markers(objs, "homefeed", "read"))
+
+    def test_values_and_markers_are_stored_like_redis(self):
+        for backend in (self._redis, self._memory):
+            backend.add("user:1", "homefeed", 42, published=1000)
+            backend.add("user:1", "homefeed", u"caf\xe9", published=2000)
+            backend.bubble_values("user:1", "homefeed", {1.5: 3000})
+            backend.set_markers("user:1", "homefeed", {"read": "1500", "seen": 1500.0})
+
+        eq_(self._memory.get("user:1", "homefeed", marker=5000), ["1.5", "caf\xc3\xa9", "42"])
+        eq_(self._memory.get("user:1", "homefeed", marker=5000), self._redis.get("user:1", "homefeed", marker=5000))
+        eq_(self._memory.get_markers("user:1", "homefeed", "read"), self._redis.get_markers("user:1", "homefeed", "read"))
+
+        #redis stores the float as "1500.0", which is not a valid marker when it is read back
+        for backend in (self._redis, self._memory):
+            try:
+                backend.get_markers("user:1", "homefeed", "seen")
+            except ValueError:
+                pass
+            else:
+                ok_(False, "%r read a float marker" % (backend,))
@@ -3,10 +3,14 @@ from __future__ import absolute_import
 from nose.tools import ok_, eq_, raises, set_trace
 
 from sandsnake import create_sandsnake_backend
-from sandsnake.exceptions import SandsnakeValidationException
+from sandsnake.backends.redis import LATEST
+from sandsnake.backends.schema import CompactKeySchema
+from sandsnake.exceptions import SandsnakeTimeoutException, SandsnakeValidationException
+from sandsnake.instrumentation import MemorySink
 
 import datetime
 import itertools
+import time
 
 
 class TestRedisBackend(object):
@@ -97,6 +101,172 @@ class TestRedisBackend(object):
         eq_(self._redis_backend.zcard(self._backend._get_index_name(obj, index_names[1])), 1)
         eq_(self._redis_backend.scard(self._backend._get_index_collection_name(obj)), 2)
 
+    def test_add_many(self):
+        obj = "indexes"
+        published = datetime.datetime.utcnow()
+        items = [("profile_index", "activity_" + str(i), published + datetime.timedelta(seconds=i)) for i in xrange(10)]
+        items.append((["profile_index", "group_index"], "activity_both", published))
+
+        self._backend.add_many(obj, items)
+
+        eq_(self._redis_backend.zcard(self._backend._get_index_name(obj, "profile_index")), 11)
+        eq_(self._redis_backend.zcard(self._backend._get_index_name(obj, "group_index")), 1)
+        eq_(self._redis_backend.smembers(self._backend._get_index_collection_name(obj)), set(["profile_index", "group_index"]))
+        eq_(self._redis_backend.zscore(self._backend._get_index_name(obj, "profile_index"), "activity_9"),\
+            self._backend._get_timestamp(items[9][2]))
+
+    def test_add_many_objects_chunked(self):
+        self._backend._pipeline_size = 3
+        published = datetime.datetime.utcnow()
+        items = [("user:" + str(i % 4), "profile_index", "activity_" + str(i), published) for i in xrange(20)]
+
+        added = []
+        self._backend._post_add = lambda obj, indexes, activity, timestamp: added.append((obj, activity))
+        self._backend.add_many_objects(iter(items))
+
+        eq_(len(added), 20)
+        for i in xrange(4):
+            eq_(self._redis_backend.zcard(self._backend._get_index_name("user:" + str(i), "profile_index")), 5)
+            eq_(self._redis_backend.scard(self._backend._get_index_collection_name("user:" + str(i))), 1)
+
+    def test_fanout_add(self):
+        published = datetime.datetime.utcnow()
+        objs = ["user:" + str(i) for i in xrange(50)]
+
+        added = []
+        self._backend._post_add = lambda obj, indexes, activity, timestamp: added.append(obj)
+        counts = self._backend.fanout_add(iter(objs), "homefeed", "activity1234", published=published, chunk_size=7)
+
+        eq_(sum(count['success'] for count in counts.values()), 100)
+        eq_(sum(count['failure'] for count in counts.values()), 0)
+        eq_(sorted(added), sorted(objs))
+        for obj in objs:
+            eq_(self._redis_backend.zrange(self._backend._get_index_name(obj, "homefeed"), 0, -1, withscores=True),\
+                [("activity1234", self._backend._get_timestamp(published))])
+            eq_(self._redis_backend.smembers(self._backend._get_index_collection_name(obj)), set(["homefeed"]))
+
+    def test_fanout_add_counts_failures(self):
+        obj = "user:1"
+        self._redis_backend.set(self._backend._get_index_name(obj, "homefeed"), "not a sorted set")
+
+        counts = self._backend.fanout_add([obj, "user:2"], "homefeed", "activity1234")
+
+        eq_(sum(count['success'] for count in counts.values()), 3)
+        eq_(sum(count['failure'] for count in counts.values()), 1)
+
+    def test_add_max_length(self):
+        obj = "indexes"
+        index_name = "profile_index"
+        published = datetime.datetime.utcnow()
+        self._backend._max_length = 3
+
+        removed = []
+        self._backend._post_remove = lambda obj, indexes, activity: removed.append(activity)
+        for i in xrange(5):
+            self._backend.add(obj, index_name, "activity_" + str(i), published=published + datetime.timedelta(seconds=i))
+
+        eq_(self._redis_backend.zrange(self._backend._get_index_name(obj, index_name), 0, -1), ["activity_2", "activity_3", "activity_4"])
+        eq_(removed, ["activity_0", "activity_1"])
+
+    def test_add_max_length_per_index(self):
+        obj = "indexes"
+        published = datetime.datetime.utcnow()
+        self._backend._max_length = 3
+        self._backend._max_lengths = {"group_index": 1}
+
+        items = [(["profile_index", "group_index"], "activity_" + str(i), published + datetime.timedelta(seconds=i)) for i in xrange(5)]
+        self._backend.add_many(obj, items)
+
+        eq_(self._redis_backend.zrange(self._backend._get_index_name(obj, "profile_index"), 0, -1), ["activity_2", "activity_3", "activity_4"])
+        eq_(self._redis_backend.zrange(self._backend._get_index_name(obj, "group_index"), 0, -1), ["activity_4"])
+
+    def test_fanout_add_max_length(self):
+        published = datetime.datetime.utcnow()
+        self._backend._max_length = 2
+
+        removed = []
+        self._backend._post_remove = lambda obj, indexes, activity: removed.append((obj, activity))
+        for i in xrange(3):
+            self._backend.fanout_add(["user:1", "user:2"], "homefeed", "activity_" + str(i), published=published + datetime.timedelta(seconds=i))
+
+        eq_(self._redis_backend.zrange(self._backend._get_index_name("user:1", "homefeed"), 0, -1), ["activity_1", "activity_2"])
+        eq_(sorted(removed), [("user:1", "activity_0"), ("user:2", "activity_0")])
+
+    def test_clear_all_batches(self):
+        published = datetime.datetime.utcnow()
+        for i in xrange(30):
+            self._backend.add("user:" + str(i), ["profile_index", "group_index"], "activity1234", published=published)
+        self._redis_backend.set("not_sandsnake", "value")
+
+        progress = []
+        deleted = self._backend.clear_all(batch_size=10, progress=lambda host, count: progress.append((host, count)))
+
+        eq_(deleted, 90)
+        ok_(len(progress) > 3)
+        eq_(sum(max(count for host, count in progress if host == h) for h in set(host for host, count in progress)), 90)
+        eq_(list(itertools.chain(*self._redis_backend.keys())), ["not_sandsnake"])
+
+    def test_add_max_length_scripts_flushed(self):
+        obj = "indexes"
+        index_name = "profile_index"
+        published = datetime.datetime.utcnow()
+        self._backend._max_length = 2
+
+        self._backend.add(obj, index_name, "activity_0", published=published)
+        for host in self._redis_backend:
+            self._redis_backend[host].script_flush()
+        self._backend.add(obj, index_name, "activity_1", published=published + datetime.timedelta(seconds=1))
+        self._backend.add(obj, index_name, "activity_2", published=published + datetime.timedelta(seconds=2))
+
+        eq_(self._redis_backend.zrange(self._backend._get_index_name(obj, index_name), 0, -1), ["activity_1", "activity_2"])
+
+    def test_script_registry_call(self):
+        for host in self._redis_backend:
+            self._redis_backend[host].script_flush()
+        key = self._backend._get_index_name("indexes", "profile_index")
+
+        eq_(self._backend._scripts.call('add_trim', [key], [1, "activity_0", 1]), [])
+        eq_(self._backend._scripts.call('add_trim', [key], [2, "activity_1", 1]), ["activity_0"])
+
+    def test_execute_per_host(self):
+        commands = {}
+        for host in self._redis_backend:
+            commands[host] = [('set', ("key:" + str(i), str(host))) for i in xrange(3)] + [('get', ("key:0",))]
+
+        results = self._backend._execute_per_host(commands)
+
+        eq_(sorted(results.keys()), sorted(commands.keys()))
+        for host in self._redis_backend:
+            eq_(results[host], [True, True, True, str(host)])
+
+    @raises(SandsnakeTimeoutException)
+    def test_execute_per_host_timeout(self):
+        self._backend._host_timeout = 0.05
+        hosts = list(self._redis_backend)
+
+        self._backend._execute_per_host({
+            hosts[0]: [('blpop', (["nothing to pop"], 1))],
+            hosts[1]: [('ping', ())],
+        })
+
+    def test_single_host_timeout(self):
+        backend = create_sandsnake_backend({
+            "backend": "sandsnake.backends.redis.Redis",
+            "settings": {"hosts": [{"db": 3}], "host_timeout": 0.05},
+        })
+
+        started = time.time()
+        try:
+            backend._execute_per_host({0: [('blpop', (["nothing to pop"], 1))]})
+        except SandsnakeTimeoutException:
+            pass
+        else:
+            ok_(False, "a single stalled host was waited for")
+        ok_(time.time() - started < 0.5)
+
+        #commands sent outside of pipelines time out on the socket
+        eq_(backend.get_backend()[0].connection.connection_pool.connection_kwargs["socket_timeout"], 0.05)
+
     def test_remove_values(self):
         published = datetime.datetime.now()
         obj = "indexes"
@@ -217,6 +387,21 @@ class TestRedisBackend(object):
         ok_(self._redis_backend.exists(self._backend._get_index_collection_name(obj)))
         eq_(self._redis_backend.scard(self._backend._get_index_collection_name(obj)), 1)
 
+    def test_delete_index_no_indexes(self):
+        self._setup_basic_index()
+        self._backend.delete_index(self.obj, [])
+        eq_(self._redis_backend.scard(self._backend._get_index_collection_name(self.obj)), 1)
+
+    def test_delete_index_many_indexes(self):
+        obj = "indexes"
+        index_names = ["index_%d" % i for i in xrange(9000)]
+        self._backend.add(obj, index_names[:10], "activity1234", published=datetime.datetime.utcnow())
+
+        self._backend.delete_index(obj, index_names)
+
+        ok_(not self._redis_backend.exists(self._backend._get_index_name(obj, index_names[0])))
+        ok_(not self._redis_backend.exists(self._backend._get_index_collection_name(obj)))
+
     def test_delete_index_index_object_doesnt_exist(self):
         #fail silently if the indexes/objects don't exist
         self._backend.delete_index("non existing", "also does not exist")
@@ -279,6 +464,152 @@ class TestRedisBackend(object):
         eq_(len(result), 2)
         eq_(["activity_after_" + str(i) for i in xrange(2)], result)
 
+    def test_get_with_scores(self):
+        published = datetime.datetime.now()
+        timestamp = self._backend._get_timestamp(published)
+        obj = "indexes"
+        index_name = "profile_index"
+
+        for i in xrange(3):
+            self._backend.add(obj, index_name, "activity_" + str(i), published=timestamp + i)
+
+        eq_(["activity_1", "activity_0"], self._backend.get(obj, index_name, marker=timestamp + 1))
+        eq_(2, self._backend.get_count(obj, index_name, timestamp + 1, after=True))
+
+        self._backend.add_many(obj, [(index_name, "activity_many", published)])
+        eq_(timestamp, self._redis_backend.zscore(self._backend._get_index_name(obj, index_name), "activity_many"))
+
+    def test_get_merged(self):
+        published = datetime.datetime.now()
+        obj = "indexes"
+
+        for i in xrange(5):
+            self._backend.add(obj, "profile_index", "profile_" + str(i), published=published - datetime.timedelta(seconds=2 * i))
+            self._backend.add(obj, "group_index", "group_" + str(i), published=published - datetime.timedelta(seconds=2 * i + 1))
+        self._backend.add(obj, ["profile_index", "group_index"], "both", published=published + datetime.timedelta(seconds=10))
+
+        result = self._backend.get_merged(obj, ["profile_index", "group_index"], marker=published, limit=4)
+        eq_(['profile_0', 'group_0', 'profile_1', 'group_1'], result)
+
+        result = self._backend.get_merged(obj, ["profile_index", "group_index"], marker=published - datetime.timedelta(seconds=8), \
+            limit=4, after=True, withscores=True)
+        eq_(['profile_4', 'group_3', 'profile_3', 'group_2'], [value for value, score in result])
+        eq_(self._backend._get_timestamp(published - datetime.timedelta(seconds=8)), result[0][1])
+
+    def test_get_merged_duplicates(self):
+        published = datetime.datetime.now()
+        obj = "indexes"
+
+        for i in xrange(5):
+            self._backend.add(obj, ["profile_index", "group_index"], "activity_" + str(i), published=published - datetime.timedelta(seconds=i))
+
+        result = self._backend.get_merged(obj, ["profile_index", "group_index"], marker=published, limit=4)
+        eq_(["activity_" + str(i) for i in xrange(4)], result)
+
+    def test_get_page(self):
+        published = datetime.datetime.now()
+        obj = "indexes"
+        index_name = "profile_index"
+
+        #every activity shares its score with two others
+        activities = []
+        for i in xrange(9):
+            activity = "activity_" + str(i)
+            self._backend.add(obj, index_name, activity, published=published - datetime.timedelta(seconds=i / 3))
+            activities.append(activity)
+
+        pages, cursor = [], None
+        while True:
+            page, cursor = self._backend.get_page(obj, index_name, cursor=cursor, limit=2)
+            pages.extend(page)
+            if cursor is None:
+                break
+
+        eq_(len(pages), 9)
+        eq_(sorted(pages), activities)
+        eq_(pages, self._redis_backend.zrevrange(self._backend._get_index_name(obj, index_name), 0, -1))
+
+        pages, cursor = [], None
+        while True:
+            page, cursor = self._backend.get_page(obj, index_name, cursor=cursor, limit=4, after=True, withscores=True)
+            pages.extend(page)
+            if cursor is None:
+                break
+
+        eq_(pages, self._redis_backend.zrange(self._backend._get_index_name(obj, index_name), 0, -1, withscores=True, score_cast_func=long))
+
+    @raises(SandsnakeValidationException)
+    def test_get_page_invalid_cursor(self):
+        self._backend.get_page("indexes", "profile_index", cursor="not a cursor")
+
+    @raises(SandsnakeValidationException)
+    def test_get_page_empty_limit(self):
+        self._backend.get_page("indexes", "profile_index", limit=0)
+
+    def test_iter_index(self):
+        published = datetime.datetime.now()
+        obj = "indexes"
+        index_name = "profile_index"
+
+        for i in xrange(25):
+            self._backend.add(obj, index_name, "activity_%02d" % i, published=published + datetime.timedelta(seconds=i / 2))
+
+        eq_(["activity_%02d" % i for i in xrange(25)], list(self._backend.iter_index(obj, index_name, batch_size=4)))
+        eq_(["activity_%02d" % i for i in reversed(xrange(25))], \
+            [value for value, score in self._backend.iter_index(obj, index_name, batch_size=4, reverse=True, withscores=True)])
+
+    def test_iter_index_same_score(self):
+        sink = MemorySink()
+        backend = create_sandsnake_backend({
+            "backend": "sandsnake.backends.redis.Redis",
+            "settings": {"hosts": [{"db": 3}, {"db": 4}, {"db": 5}], "instrumentation": [sink]},
+        })
+        activities = ["activity_%03d" % i for i in xrange(500)]
+        backend.add_many("indexes", [("profile_index", activity, 1325419200000) for activity in activities])
+        sink.reset()
+
+        eq_(list(backend.iter_index("indexes", "profile_index", batch_size=20)), activities)
+
+        #every page reads its own values only, not every value that shares the score of the cursor
+        stats = sink.get("get_page", "profile_index")
+        eq_(stats.calls, 26)
+        ok_(stats.bytes <= len(activities) * len("activity_000" + "1325419200000"))
+
+    def test_get_page_removed_cursor(self):
+        obj = "indexes"
+        index_name = "profile_index"
+        self._backend.add_many(obj, [(index_name, "activity_%d" % i, 1000) for i in xrange(6)])
+
+        page, cursor = self._backend.get_page(obj, index_name, limit=2, after=True)
+        eq_(page, ["activity_0", "activity_1"])
+        self._backend.remove(obj, index_name, "activity_1")
+        eq_(self._backend.get_page(obj, index_name, cursor=cursor, limit=2, after=True)[0], ["activity_2", "activity_3"])
+
+        #a cursor value that moved to another score is gone from its old place too
+        page, cursor = self._backend.get_page(obj, index_name, limit=2)
+        eq_(page, ["activity_5", "activity_4"])
+        self._backend.add(obj, index_name, "activity_4", published=2000)
+        eq_(self._backend.get_page(obj, index_name, cursor=cursor, limit=2)[0], ["activity_3", "activity_2"])
+
+    def test_iter_indexes(self):
+        published = datetime.datetime.now()
+
+        for i in xrange(10):
+            self._backend.add("user:1", "profile_index", "activity_" + str(i), published=published + datetime.timedelta(seconds=i))
+            self._backend.add("user:2", "group_index", "activity_" + str(i), published=published + datetime.timedelta(seconds=i))
+
+        pairs = [("user:1", "profile_index"), ("user:2", "group_index"), ("user:3", "profile_index")]
+        result = list(self._backend.iter_indexes(pairs, batch_size=3))
+
+        eq_(len(result), 20)
+        eq_(result[0], ("user:1", "profile_index", "activity_0"))
+        eq_(result[-1], ("user:2", "group_index", "activity_9"))
+
+        #stopping early doesn't leave anything hanging around
+        values = self._backend.iter_indexes(pairs, batch_size=3)
+        eq_(values.next(), ("user:1", "profile_index", "activity_0"))
+        values.close()
+
     @raises(SandsnakeValidationException)
     def test_get_marker_required(self):
         obj = "indexes"
@@ -295,6 +626,184 @@ class TestRedisBackend(object):
             "obj1", "index1", 123, 20, False, True), [[('act:1', 1,), ('act:2', 2, ), ('act:3', 3)]])
 
 
+class TestRedisBackendWithReverseIndex(object):
+    def setUp(self):
+        self._backend = create_sandsnake_backend({
+            "backend": "sandsnake.backends.redis.RedisWithBubbling",
+            "settings": {
+                "hosts": [{"db": 3}, {"db": 4}, {"db": 5}],
+                "reverse_index": True,
+            },
+        })
+
+        self._redis_backend = self._backend.get_backend()
+
+        #clear the redis database so we are in a consistent state
+        self._redis_backend.flushdb()
+
+    def tearDown(self):
+        self._redis_backend.flushdb()
+
+    def _locations(self, activity):
+        return sorted(map(self._backend._decode_location, \
+            self._redis_backend.smembers(self._backend._get_activity_locations_name(activity))))
+
+    def test_encode_location(self):
+        location = self._backend._encode_location("user:1", "team:42")
+        eq_(self._backend._decode_location(location), ("user:1", "team:42"))
+
+    def test_locations(self):
+        self._backend.add("user:1", ["homefeed", "profile"], "activity", published=1000)
+        self._backend.add_many("user:2", [("homefeed", "activity", 1000), ("homefeed", "other", 1000)])
+        self._backend.fanout_add(["user:3", "user:4"], "homefeed", "activity", published=1000)
+
+        eq_(self._locations("activity"), sorted([("user:1", "homefeed"), ("user:1", "profile")] + \
+            [(obj, "homefeed") for obj in ["user:2", "user:3", "user:4"]]))
+
+        self._backend.remove("user:1", "profile", "activity")
+        self._backend.remove_values("user:2", "homefeed", ["activity", "other"])
+        eq_(self._locations("activity"), [(obj, "homefeed") for obj in ["user:1", "user:3", "user:4"]])
+        eq_(self._locations("other"), [])
+
+    def test_retract(self):
+        objs = ["user:%d" % i for i in xrange(20)]
+        self._backend.fanout_add(objs, "homefeed", "activity", published=1000)
+        self._backend.add("user:1", "profile", "activity", published=1000)
+        self._backend.add("user:1", "profile", "other", published=1000)
+        #locations that went stale are skipped
+        self._redis_backend.zrem(self._backend._get_index_name("user:2", "homefeed"), "activity")
+
+        eq_(self._backend.retract("activity"), 20)
+        for obj in objs:
+            eq_(self._backend.get(obj, "homefeed", marker=2000), [])
+        eq_(self._backend.get("user:1", "profile", marker=2000), ["other"])
+        eq_(self._locations("activity"), [])
+        eq_(self._backend.retract("activity"), 0)
+
+    def test_delete_index_removes_locations(self):
+        removed = []
+        self._backend._post_remove = lambda obj, indexes, activity: removed.append((obj, indexes, activity))
+        self._backend.add("user:1", ["homefeed", "profile", "likes"], "activity", published=1000)
+        self._backend.add("user:1", "homefeed", "other", published=1000)
+
+        self._backend.delete_index("user:1", ["homefeed", "likes"])
+        eq_(self._locations("activity"), [("user:1", "profile")])
+        eq_(self._locations("other"), [])
+        eq_(sorted(removed), sorted([("user:1", [self._backend._get_index_name("user:1", index)], activity) \
+            for index, activity in [("homefeed", "activity"), ("homefeed", "other"), ("likes", "activity")]]))
+        eq_(self._redis_backend.smembers(self._backend._get_index_collection_name("user:1")), set(["profile"]))
+
+    def test_trim_expired_removes_locations(self):
+        self._backend._retentions = {"notifications": 60}
+        now = datetime.datetime.utcnow()
+        self._backend.add("user:1", ["homefeed", "notifications"], "old", published=now - datetime.timedelta(days=1))
+        self._backend.add("user:1", "notifications", "new", published=now)
+
+        eq_(self._backend.trim_expired(["user:1"], now=now), 1)
+        eq_(self._locations("old"), [("user:1", "homefeed")])
+        eq_(self._locations("new"), [("user:1", "notifications")])
+
+    def test_bubbling_adds_locations(self):
+        self._backend.add("user:1", "homefeed", "activity", published=1000)
+        self._backend.bubble_values("user:2", "homefeed", {"activity": 2000})
+        self._backend.bubble_values_many([("user:3", "homefeed")], {"activity": 2000})
+        self._backend.bubble_values_many([("user:4", "homefeed")], {"activity": 2000}, only_if_present=True)
+
+        eq_(self._locations("activity"), [(obj, "homefeed") for obj in ["user:1", "user:2", "user:3"]])
+        eq_(self._backend.retract("activity"), 3)
+
+    def test_locations_with_compact_schema(self):
+        self._backend._schema = CompactKeySchema(prefix="ssnake:", index_codes={"team:42": "t"})
+        self._backend.add("user:1", ["team:42", "team:43"], "activity", published=1000)
+
+        #locations hold index names, not keys, so they stay valid when the key schema changes
+        eq_(self._locations("activity"), [("user:1", "team:42"), ("user:1", "team:43")])
+        eq_(self._backend.retract("activity"), 2)
+        eq_(self._redis_backend.zcard(self._backend._get_index_name("user:1", "team:42")), 0)
+
+    def test_max_length_removes_locations(self):
+        self._backend._max_length = 1
+        self._backend.add("user:1", "homefeed", "activity", published=1000)
+        self._backend.add("user:1", "homefeed", "other", published=2000)
+        eq_(self._locations("activity"), [])
+
+    @raises(SandsnakeValidationException)
+    def test_retract_requires_reverse_index(self):
+        self._backend._reverse_index = False
+        self._backend.retract("activity")
+
+
+class TestRedisBackendWithCache(object):
+    def setUp(self):
+        self._backend = create_sandsnake_backend({
+            "backend": "sandsnake.backends.redis.RedisWithBubbling",
+            "settings": {
+                "hosts": [{"db": 3}, {"db": 4}, {"db": 5}],
+                "cache": {"max_size": 100, "ttl": 60, "marker_bucket": 1000},
+            },
+        })
+
+        self._redis_backend = self._backend.get_backend()
+
+        #clear the redis database so we are in a consistent state
+        self._redis_backend.flushdb()
+
+    def tearDown(self):
+        self._redis_backend.flushdb()
+
+    def test_get_is_cached(self):
+        published = datetime.datetime(2012, 1, 1, 12, 0, 0, 0)
+        obj = "indexes"
+        index_name = "profile_index"
+
+        self._backend.add(obj, index_name, "activity_0", published=published)
+        eq_(self._backend.get(obj, index_name, marker=published), ["activity_0"])
+
+        #another writer changes the index behind our back
+        self._redis_backend.zadd(self._backend._get_index_name(obj, index_name), self._backend._get_timestamp(published), "activity_1")
+
+        #markers in the same bucket are served from the cache
+        eq_(self._backend.get(obj, index_name, marker=published + datetime.timedelta(milliseconds=500)), ["activity_0"])
+        eq_(self._backend.get_cache().stats(), {'hits': 1, 'misses': 1, 'size': 1})
+
+        result = self._backend.get(obj, index_name, marker=published, withscores=True)
+        result.append("not cached")
+        eq_(self._backend.get(obj, index_name, marker=published, withscores=True), [("activity_0", self._backend._get_timestamp(published))])
+
+    def test_bucketed_markers_are_exact(self):
+        obj = "indexes"
+        index_name = "profile_index"
+        for i in xrange(4):
+            self._backend.add(obj, index_name, "activity_%d" % i, published=10000 + 200 * i)
+
+        #the bucket runs to 10999, but nothing past the marker is returned
+        eq_(self._backend.get(obj, index_name, marker=10999, limit=2), ["activity_3", "activity_2"])
+        eq_(self._backend.get(obj, index_name, marker=10300, limit=2), ["activity_1", "activity_0"])
+        eq_(self._backend.get(obj, index_name, marker=10300, limit=5), ["activity_1", "activity_0"])
+        eq_(self._backend.get(obj, index_name, marker=10300, limit=5, after=True), ["activity_2", "activity_3"])
+
+    def test_writes_invalidate_cache(self):
+        published = datetime.datetime.utcnow()
+        obj = "indexes"
+        index_name = "profile_index"
+
+        self._backend.add(obj, index_name, "activity_0", published=published)
+        eq_(self._backend.get(obj, index_name, marker=published), ["activity_0"])
+
+        self._backend.add(obj, index_name, "activity_1", published=published)
+        eq_(self._backend.get(obj, index_name, marker=published), ["activity_1", "activity_0"])
+
+        self._backend.bubble_values(obj, index_name, {"activity_1": published - datetime.timedelta(seconds=10)})
+        eq_(self._backend.get(obj, index_name, marker=published), ["activity_0", "activity_1"])
+
+        self._backend.remove(obj, index_name, "activity_0")
+        eq_(self._backend.get(obj, index_name, marker=published), ["activity_1"])
+
+        self._backend.delete_index(obj, index_name)
+        eq_(self._backend.get(obj, index_name, marker=published), [])
+        eq_(self._backend.get_cache().hits, 0)
+
+
 class TestRedisWithMarkerBackend(object):
     def setUp(self):
         self._backend = create_sandsnake_backend({
@@ -375,6 +884,56 @@ class TestRedisWithMarkerBackend(object):
         eq_(3, self._backend.get_count(obj, index_name, published))
         eq_(5, self._backend.get_count(obj, index_name, published, after=True))
 
+    def test_set_and_get_markers_many(self):
+        objs = ["user:%d" % i for i in xrange(10)]
+        self._backend.set_markers_many([(obj, index, "read", i) for i, obj in enumerate(objs) \
+            for index in ["homefeed", "notifications"]] + [("user:1", "homefeed", None, 50)])
+
+        eq_(self._backend.get_markers_many([(obj, "notifications", "read") for obj in objs]), range(10))
+        eq_(self._backend.get_markers_many([("user:1", "homefeed", None), ("user:1", "homefeed", "read"), \
+            ("user:1", "profile", "read"), ("user:3", "homefeed", "read")]), [50, 1, None, 3])
+        eq_(self._backend.get_markers("user:2", "homefeed", "read"), 2)
+
+    def test_set_markers_many_latest(self):
+        objs = ["user:%d" % i for i in xrange(20)]
+        for i, obj in enumerate(objs):
+            for index in ["homefeed", "notifications"]:
+                self._backend.add(obj, index, "old", published=1000)
+                self._backend.add(obj, index, "new", published=1325419200000 + i)
+        #indexes live on every host, so both the script and the read then write paths are used
+        hosts = set(self._backend._get_host(self._backend._get_index_name(obj, "homefeed")) \
+            == self._backend._get_host(self._backend._get_obj_markers_name(obj)) for obj in objs)
+        eq_(hosts, set([True, False]))
+
+        self._backend.set_markers_many([(obj, index, None, LATEST) for obj in objs \
+            for index in ["homefeed", "notifications", "empty"]])
+        for i, obj in enumerate(objs):
+            eq_(self._backend.get_markers_many([(obj, "homefeed", None), (obj, "notifications", None), \
+                (obj, "empty", None)]), [1325419200000 + i, 1325419200000 + i, None])
+            eq_(self._backend.get_counts_since_markers([obj], "homefeed")[obj], 1)
+
+    def test_get_counts_since_markers(self):
+        published = datetime.datetime.utcnow()
+        timestamp = self._backend._get_timestamp(published)
+        objs = ["user:%d" % i for i in xrange(10)]
+
+        for i, obj in enumerate(objs):
+            for j in xrange(i):
+                self._backend.add(obj, "notifications", "activity_" + str(j), published=timestamp + j)
+            self._backend.add(obj, "notifications", "old", published=timestamp - 1)
+            self._backend.set_markers(obj, "notifications", {"_ssdefault": timestamp, "read": timestamp + 1})
+        self._backend.add("no marker", "notifications", "activity", published=timestamp)
+
+        counts = self._backend.get_counts_since_markers(objs + ["no marker", "empty"], "notifications")
+        for i, obj in enumerate(objs):
+            eq_(counts[obj], self._backend.get_count(obj, "notifications", timestamp, after=True))
+            eq_(counts[obj], i)
+        eq_(counts["no marker"], 1)
+        eq_(counts["empty"], 0)
+
+        counts = self._backend.get_counts_since_markers(objs, "notifications", marker_name="read")
+        eq_([counts[obj] for obj in objs], [0, 0] + range(1, 9))
+
     def test_get_before_marker_doesnt_updates_marker(self):
         published = datetime.datetime.now()
         obj = "indexes"
@@ -497,6 +1056,44 @@ class TestRedisWithBubblingBackend(object):
 
         ok_(len(list(itertools.chain(*redis_client.keys()))) == 0)
 
+    def test_bubble_values_doesnt_modify_values_dict(self):
+        values_dict = {"activity": "2012-01-01T12:00:00"}
+        self._backend.bubble_values("indexes", "profile_index", values_dict)
+        eq_(values_dict, {"activity": "2012-01-01T12:00:00"})
+        eq_(self._redis_backend.zscore(self._backend._get_index_name("indexes", "profile_index"), "activity"), 1325419200000)
+
+    def test_bubble_values_many(self):
+        objs = ["user:%d" % i for i in xrange(20)]
+        for obj in objs:
+            self._backend.add(obj, "homefeed", "activity", published=2000)
+            self._backend.add(obj, "homefeed", "other", published=1500)
+        targets = [(obj, "homefeed") for obj in objs] + [("user:0", "profile")]
+
+        eq_(self._backend.bubble_values_many(targets, {"activity": 3000}), 21)
+        eq_(self._backend.get("user:5", "homefeed", marker=5000, withscores=True), [("activity", 3000), ("other", 1500)])
+        eq_(self._backend.get("user:0", "profile", marker=5000), ["activity"])
+
+        #values already at their score don't move
+        eq_(self._backend.bubble_values_many(targets, {"activity": 3000}), 0)
+
+    def test_bubble_values_many_only_if_present(self):
+        self._backend.add("user:1", "homefeed", "activity", published=2000)
+        targets = [("user:1", "homefeed"), ("user:2", "homefeed")]
+
+        eq_(self._backend.bubble_values_many(targets, {"activity": 3000, "missing": 3000}, only_if_present=True), 1)
+        eq_(self._backend.get("user:1", "homefeed", marker=5000), ["activity"])
+        eq_(self._redis_backend.zcard(self._backend._get_index_name("user:2", "homefeed")), 0)
+
+    def test_bubble_values_many_only_if_greater(self):
+        self._backend.add("user:1", "homefeed", "activity", published=2000)
+        self._backend.add("user:2", "homefeed", "activity", published=4000)
+        targets = [("user:1", "homefeed"), ("user:2", "homefeed"), ("user:3", "homefeed")]
+
+        eq_(self._backend.bubble_values_many(targets, {"activity": 3000}, only_if_greater=True), 2)
+        eq_(self._backend.get("user:1", "homefeed", marker=5000, withscores=True), [("activity", 3000)])
+        eq_(self._backend.get("user:2", "homefeed", marker=5000, withscores=True), [("activity", 4000)])
+        eq_(self._backend.get("user:3", "homefeed", marker=5000, withscores=True), [("activity", 3000)])
+
     def test_bubble_values(self):
         published = datetime.datetime.utcnow()
         obj = "indexes"
@@ -0,0 +1,73 @@
+from __future__ import absolute_import
+
+from nose.tools import eq_, raises
+
+from sandsnake import create_sandsnake_backend
+from sandsnake.backends.schema import CompactKeySchema, KeySchema
+
+
+class TestKeySchema(object):
+    def test_legacy_layout(self):
+        schema = KeySchema()
+        eq_(schema.index_name("user:1", "homefeed"), "ssnake:obj:user:1:index:homefeed")
+        eq_(schema.index_collection_name("user:1"), "ssnake:user:1:indexes")
+        eq_(schema.obj_markers_name("user:1"), "ssnake:obj:user:1:markers")
+        eq_(schema.index_marker_name("homefeed", "read"), "index:homefeed:name:read")
+
+    def test_round_trip(self):
+        schema = KeySchema(prefix="test:")
+        eq_(schema.obj_from_index_collection_name(schema.index_collection_name("user:1")), "user:1")
+        eq_(schema.obj_from_obj_markers_name(schema.obj_markers_name("user:1")), "user:1")
+        eq_(schema.parse_index_marker_name(schema.index_marker_name("a:name:b", "read")), ("a:name:b", "read"))
+
+
+class TestCompactKeySchema(object):
+    def setUp(self):
+        self._schema = CompactKeySchema(index_codes={"homefeed": "h", "notifications": "n"})
+
+    def test_layout(self):
+        eq_(self._schema.index_name("user:1", "homefeed"), "ss:i:user:1:h")
+        eq_(self._schema.index_name("user:1", "profile"), "ss:i:user:1:profile")
+        eq_(self._schema.index_collection_name("user:1"), "ss:c:user:1")
+        eq_(self._schema.obj_markers_name("user:1"), "ss:m:user:1")
+        eq_(self._schema.index_marker_name("notifications", "read"), "n:read")
+
+    def test_round_trip(self):
+        eq_(self._schema.obj_from_index_collection_name(self._schema.index_collection_name("user:1")), "user:1")
+        eq_(self._schema.obj_from_obj_markers_name(self._schema.obj_markers_name("user:1")), "user:1")
+        eq_(self._schema.parse_index_marker_name(self._schema.index_marker_name("homefeed", "read")), ("homefeed", "read"))
+        eq_(self._schema.parse_index_marker_name(self._schema.index_marker_name("profile", "read")), ("profile", "read"))
+
+    @raises(ValueError)
+    def test_duplicate_codes(self):
+        CompactKeySchema(index_codes={"homefeed": "h", "history": "h"})
+
+    @raises(ValueError)
+    def test_code_with_separator(self):
+        CompactKeySchema(index_codes={"homefeed": "h:f"})
+
+    @raises(ValueError)
+    def test_code_collides_with_index(self):
+        CompactKeySchema(index_codes={"homefeed": "notifications", "notifications": "n"})
+
+    def test_backend(self):
+        backend = create_sandsnake_backend({
+            "backend": "sandsnake.backends.redis.Redis",
+            "settings": {
+                "hosts": [{"db": 3}, {"db": 4}, {"db": 5}],
+                "key_schema": "sandsnake.backends.schema.CompactKeySchema",
+                "key_schema_options": {"prefix": "test:", "index_codes": {"homefeed": "h"}},
+            },
+        })
+        redis_backend = backend.get_backend()
+        redis_backend.flushdb()
+        try:
+            backend.add("user:1", ["homefeed", "profile"], "activity", published=1000)
+            eq_(backend.get("user:1", "homefeed", marker=2000), ["activity"])
+            eq_(redis_backend.zrange("test:i:user:1:h", 0, -1), ["activity"])
+            eq_(set(redis_backend.smembers("test:c:user:1")), set(["homefeed", "profile"]))
+
+            backend.delete_index("user:1", "homefeed")
+            eq_(redis_backend.exists("test:i:user:1:h"), False)
+        finally:
+            redis_backend.flushdb()
@@ -0,0 +1,55 @@
+from __future__ import absolute_import
+
+from nose.tools import ok_, eq_
+
+from sandsnake.cache import LRUCache
+
+import time
+
+
+class TestLRUCache(object):
+    def test_get_set(self):
+        cache = LRUCache(max_size=10, ttl=10)
+
+        eq_(cache.get("key:1", "a"), None)
+        cache.set("key:1", "a", [1, 2])
+        eq_(cache.get("key:1", "a"), [1, 2])
+        eq_(cache.get("key:1", "b", default="default"), "default")
+        eq_(cache.stats(), {'hits': 1, 'misses': 2, 'size': 1})
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_size=2, ttl=10)
+
+        cache.set("key:1", "a", 1)
+        cache.set("key:2", "a", 2)
+        cache.get("key:1", "a")
+        cache.set("key:3", "a", 3)
+
+        eq_(len(cache), 2)
+        eq_(cache.get("key:1", "a"), 1)
+        eq_(cache.get("key:2", "a"), None)
+        eq_(cache.get("key:3", "a"), 3)
+        ok_("key:2" not in cache._tags)
+
+    def test_expires(self):
+        cache = LRUCache(max_size=2, ttl=0.01)
+
+        cache.set("key:1", "a", 1)
+        time.sleep(0.02)
+        eq_(cache.get("key:1", "a"), None)
+        eq_(len(cache), 0)
+
+    def test_invalidate(self):
+        cache = LRUCache(max_size=10, ttl=10)
+
+        cache.set("key:1", "a", 1)
+        cache.set("key:1", "b", 2)
+        cache.set("key:2", "a", 3)
+        cache.invalidate("key:1")
+
+        eq_(cache.get("key:1", "a"), None)
+        eq_(cache.get("key:1", "b"), None)
+        eq_(cache.get("key:2", "a"), 3)
+
+        cache.clear()
+        eq_(len(cache), 0)
@@ -0,0 +1,191 @@
+from __future__ import absolute_import
+
+from nose.tools import ok_, eq_
+
+from sandsnake import create_sandsnake_backend
+from sandsnake.hotkeys import BigIndexScan, format_hot_keys, format_largest, HotKeyTracker, main, \
+    merge_snapshots, SpaceSaving
+
+import datetime
+import json
+import os
+import random
+import sys
+import tempfile
+import StringIO
+
+
+class TestSpaceSaving(object):
+    def test_counts(self):
+        sketch = SpaceSaving(10)
+        for item in "aaabbc":
+            sketch.add(item)
+        eq_(sketch.top(), [("a", 3, 0), ("b", 2, 0), ("c", 1, 0)])
+        eq_(sketch.top(1), [("a", 3, 0)])
+
+    def test_bounded(self):
+        random.seed(1)
+        sketch = SpaceSaving(20)
+        stream = ["hot:%d" % (i % 3) for i in xrange(3000)] + ["cold:%d" % i for i in xrange(3000)]
+        random.shuffle(stream)
+        for item in stream:
+            sketch.add(item)
+
+        eq_(len(sketch), 20)
+        top = sketch.top(3)
+        eq_(sorted(item for item, count, error in top), ["hot:0", "hot:1", "hot:2"])
+        for item, count, error in top:
+            ok_(count - error <= 1000 <= count)
+
+        sketch.clear()
+        eq_(sketch.top(), [])
+
+
+class TestHotKeyTracker(object):
+    def setUp(self):
+        self._backend = create_sandsnake_backend({
+            "backend": "sandsnake.backends.redis.Redis",
+            "settings": {
+                "hosts": [{"db": 3}, {"db": 4}, {"db": 5}],
+                "hot_keys": {"capacity": 10, "sample_rate": 1},
+            },
+        })
+        self._redis_backend = self._backend.get_backend()
+        self._redis_backend.flushdb()
+
+    def tearDown(self):
+        self._redis_backend.flushdb()
+
+    def test_tracks_calls(self):
+        published = datetime.datetime.utcnow()
+        self._backend.add("user:1", ["homefeed", "likes"], "a", published=published)
+        for i in xrange(3):
+            self._backend.get("user:1", "homefeed", marker=published)
+        self._backend.get_count("user:2", "homefeed", published)
+
+        tracker = self._backend.get_hot_keys()
+        top = tracker.top()
+        eq_(top[0], ("user:1", "homefeed", 4, 0))
+        eq_(sorted(top[1:]), [("user:1", "likes", 1, 0), ("user:2", "homefeed", 1, 0)])
+        eq_(sorted(tracker.top(operation="add")), [("user:1", "homefeed", 1, 0), ("user:1", "likes", 1, 0)])
+        eq_(tracker.total(), 6)
+        eq_(tracker.total("get"), 3)
+
+        snapshot = json.loads(json.dumps(tracker.snapshot()))
+        top, total = merge_snapshots([snapshot, snapshot], n=1)
+        eq_(top, [("user:1", "homefeed", 8, 0)])
+        eq_(total, 12)
+        eq_(merge_snapshots([snapshot], operation="get_count"), ([("user:2", "homefeed", 1, 0)], 1))
+
+        tracker.clear()
+        eq_(tracker.top(), [])
+
+    def test_tracks_bulk_adds(self):
+        published = datetime.datetime.utcnow()
+        for backend_path in ("sandsnake.backends.redis.Redis", "sandsnake.backends.memory.Memory"):
+            backend = create_sandsnake_backend({
+                "backend": backend_path,
+                "settings": {
+                    "hosts": [{"db": 3}, {"db": 4}, {"db": 5}],
+                    "hot_keys": {"capacity": 10, "sample_rate": 1},
+                },
+            })
+            backend.add("user:1", "homefeed", "a", published=published)
+            backend.add_many("user:1", [("homefeed", "b", published), ("likes", "b", published)])
+            backend.add_many_objects([("user:2", ["homefeed", "likes"], "c", published)])
+            backend.fanout_add(["user:1", "user:3"], "homefeed", "d", published=published)
+
+            tracker = backend.get_hot_keys()
+            eq_(tracker.top(1, operation="add"), [("user:1", "homefeed", 3, 0)])
+            eq_(tracker.total("add"), 7)
+
+    def test_disabled_by_default(self):
+        backend = create_sandsnake_backend({
+            "backend": "sandsnake.backends.memory.Memory",
+            "settings": {},
+        })
+        eq_(backend.get_hot_keys(), None)
+
+    def test_sample_rate(self):
+        random.seed(1)
+        tracker = HotKeyTracker(capacity=10, sample_rate=0.1)
+        for i in xrange(10000):
+            tracker.sample("get", "user:1", "homefeed")
+
+        obj, index, calls, error = tracker.top(1)[0]
+        eq_((obj, index, error), ("user:1", "homefeed", 0))
+        ok_(9000 < calls < 11000)
+        eq_(calls, tracker.total())
+
+
+class TestBigIndexScan(object):
+    def setUp(self):
+        self._backend = create_sandsnake_backend({
+            "backend": "sandsnake.backends.redis.Redis",
+            "settings": {
+                "hosts": [{"db": 3}, {"db": 4}, {"db": 5}],
+            },
+        })
+        self._redis_backend = self._backend.get_backend()
+        self._redis_backend.flushdb()
+
+        for i in xrange(20):
+            self._backend.add_many("user:%d" % i, [("homefeed", "activity:%d" % j, None) for j in xrange(i + 1)] + \
+                [("likes", "activity:1", None)])
+
+    def tearDown(self):
+        self._redis_backend.flushdb()
+
+    def test_index_named_like_a_collection(self):
+        self._backend.add("user:1", "indexes", "activity:1", published=None)
+
+        scan = BigIndexScan(self._backend, top=50, batch_size=5)
+        largest = scan.run()
+        ok_(scan.is_complete())
+        ok_(("user:1", "indexes", 1) in [index for host in largest for index in largest[host]])
+
+    def test_scan(self):
+        scan = BigIndexScan(self._backend, top=2, batch_size=5)
+        largest = scan.run()
+        ok_(scan.is_complete())
+        eq_(scan.scanned, 20)
+
+        found = sorted((size, obj, index) for host in largest for obj, index, size in largest[host])
+        eq_(found[-1], (20, "user:19", "homefeed"))
+        for host, indexes in largest.items():
+            ok_(len(indexes) <= 2)
+            eq_(indexes, sorted(indexes, key=lambda index: index[2], reverse=True))
+            for obj, index, size in indexes:
+                eq_(self._backend._get_host(self._backend._get_index_name(obj, index)), host)
+
+        totals = scan.totals()
+        eq_(sum(host["indexes"] for host in totals.values()), 40)
+        eq_(sum(host["items"] for host in totals.values()), sum(xrange(1, 21)) + 20)
+
+        report = format_largest(largest, totals)
+        ok_("user:19  homefeed" in report)
+
+    def test_main(self):
+        snapshot = HotKeyTracker(capacity=10, sample_rate=1)
+        snapshot.sample("get", "user:1", "homefeed")
+
+        settings_file = tempfile.NamedTemporaryFile(suffix=".json", delete=False)
+        json.dump({"backend": "sandsnake.backends.redis.Redis", "settings": {"hosts": [{"db": 3}, {"db": 4}, {"db": 5}]}}, \
+            settings_file)
+        settings_file.close()
+        snapshot_file = tempfile.NamedTemporaryFile(suffix=".json", delete=False)
+        json.dump(snapshot.snapshot(), snapshot_file)
+        snapshot_file.close()
+
+        stdout, sys.stdout = sys.stdout, StringIO.StringIO()
+        try:
+            main(["--settings", settings_file.name, "--hot-keys", snapshot_file.name, "--top", "1"])
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+            os.unlink(settings_file.name)
+            os.unlink(snapshot_file.name)
+
+        ok_("largest indexes on host redis://localhost:6379/" in output)
+        ok_("        20  user:19  homefeed" in output)
+        ok_(format_hot_keys([("user:1", "homefeed", 1, 0)], 1) in output)
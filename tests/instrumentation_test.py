@@ -0,0 +1,209 @@
+from __future__ import absolute_import
+
+from nose.tools import ok_, eq_
+
+from sandsnake import create_sandsnake_backend
+from sandsnake.exceptions import SandsnakeValidationException
+from sandsnake.instrumentation import command_keys, Histogram, LoggingSink, MemorySink, Span, StatsdSink
+
+import datetime
+import logging
+import socket
+
+
+class BrokenSink(object):
+    def record(self, span):
+        raise ValueError("broken")
+
+
+class TestInstrumentation(object):
+    def setUp(self):
+        self._sink = MemorySink()
+        self._spans = []
+        self._backend = create_sandsnake_backend({
+            "backend": "sandsnake.backends.redis.RedisWithMarker",
+            "settings": {
+                "hosts": [{"db": 3}, {"db": 4}, {"db": 5}],
+                "instrumentation": [self._sink, BrokenSink()],
+            },
+        })
+        self._backend.get_instrumentation().add_sink(self)
+
+        self._redis_backend = self._backend.get_backend()
+        self._redis_backend.flushdb()
+
+    def tearDown(self):
+        self._redis_backend.flushdb()
+
+    def record(self, span):
+        self._spans.append(span)
+
+    def test_disabled_by_default(self):
+        backend = create_sandsnake_backend({
+            "backend": "sandsnake.backends.redis.Redis",
+            "settings": {"hosts": [{"db": 3}]},
+        })
+        eq_(backend.get_instrumentation(), None)
+
+    def test_records_commands(self):
+        published = datetime.datetime.utcnow()
+        self._backend.add("user:1", "profile", "a", published=published)
+        self._backend.add("user:1", "profile", "b", published=published)
+        eq_(self._backend.get_count("user:1", "profile", published, after=False), 2)
+
+        span = self._spans[-1]
+        eq_(span.operation, "get_count")
+        eq_(span.index, "profile")
+        eq_(span.commands, 1)
+        eq_(dict(span.command_counts), {"zcount": 1})
+        eq_(span.keys, set([self._backend._get_index_name("user:1", "profile")]))
+        eq_(span.pipelines, [1])
+        eq_(span.bytes, 1)
+        ok_(span.error is None)
+        ok_(0 < span.network_time <= span.duration)
+
+        stats = self._sink.get("add", "profile")
+        eq_(stats.calls, 2)
+        eq_(stats.commands, 4)
+        eq_(stats.latency.count, 2)
+        eq_(self._sink.get("get_count", "profile").calls, 1)
+
+    def test_records_map(self):
+        self._backend.add("user:1", "profile", "a")
+        self._backend.add("user:1", "likes", "b")
+        self._spans = []
+
+        marker = datetime.datetime.utcnow() - datetime.timedelta(days=1)
+        eq_(self._backend.get_merged("user:1", ["profile", "likes"], marker=marker, after=True), ["a", "b"])
+        eq_(len(self._spans), 1)
+        span = self._spans[0]
+        eq_(span.operation, "get_merged")
+        eq_(span.index, None)
+        eq_(span.commands, 2)
+        eq_(len(span.keys), 2)
+        eq_(sum(span.pipelines), 2)
+        ok_(span.bytes > 0)
+
+    def test_records_worker_threads(self):
+        published = datetime.datetime.utcnow()
+        self._backend.add_many_objects(("user:%d" % i, "profile", "a", published) for i in xrange(20))
+
+        #``add_many_objects`` runs within ``add_many`` but only the outer call is recorded
+        eq_(self._backend.add_many("user:1", [("profile", "b", published)]), None)
+        eq_(self._spans[-1].operation, "add_many")
+        eq_(self._spans[-1].index, None)
+        eq_(self._sink.get("add_many_objects").calls, 1)
+        eq_(self._sink.get("add_many_objects").keys, 40)
+        eq_(self._sink.get("add_many_objects").commands, 40)
+
+    def test_records_errors(self):
+        try:
+            self._backend.get("user:1", "profile")
+        except SandsnakeValidationException:
+            pass
+        eq_(dict(self._sink.get("get", "profile").errors), {"SandsnakeValidationException": 1})
+
+    def test_remove_sink(self):
+        self._backend.get_instrumentation().remove_sink(self)
+        self._backend.get_count("user:1", "profile", datetime.datetime.utcnow())
+        eq_(self._spans, [])
+
+
+class TestMemoryInstrumentation(object):
+    def test_records_calls(self):
+        sink = MemorySink()
+        backend = create_sandsnake_backend({
+            "backend": "sandsnake.backends.memory.Memory",
+            "settings": {"instrumentation": ["sandsnake.instrumentation.MemorySink", sink]},
+        })
+        backend.add("user:1", "profile", "a")
+        eq_(backend.get("user:1", "profile", marker="+inf"), ["a"])
+
+        eq_(sink.get("get", "profile").calls, 1)
+        eq_(sink.get("get", "profile").commands, 0)
+        eq_(backend.get_instrumentation().sinks[0].get("add", "profile").calls, 1)
+
+
+class TestSinks(object):
+    def _span(self, error=None):
+        span = Span("get", "profile")
+        span.record_command(("ZREVRANGEBYSCORE", "ssnake:index", "+inf", "-inf"))
+        span.record_round_trips([1], 0.001)
+        span.record_response(["abc", "de"])
+        span.error = error
+        span.finish()
+        return span
+
+    def test_command_keys(self):
+        eq_(command_keys(("ZADD", "a", 1, "b")), ("a",))
+        eq_(command_keys(("DEL", "a", "b")), ("a", "b"))
+        eq_(command_keys(("EVALSHA", "sha", 2, "a", "b", "arg")), ("a", "b"))
+        eq_(command_keys(("SCAN", 0)), ())
+
+    def test_histogram(self):
+        histogram = Histogram()
+        eq_(histogram.percentile(50), None)
+        for i in xrange(99):
+            histogram.add(0.0005)
+        histogram.add(2.5)
+
+        eq_(histogram.count, 100)
+        eq_(histogram.percentile(50), 0.0008)
+        eq_(histogram.percentile(100), 2.5)
+        eq_(histogram.min, 0.0005)
+
+    def test_statsd(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(("127.0.0.1", 0))
+        server.settimeout(1)
+
+        sink = StatsdSink(host="127.0.0.1", port=server.getsockname()[1], prefix="app.ssnake")
+        sink.record(self._span(error="ResponseError"))
+        lines = server.recv(4096).split("\n")
+        server.close()
+
+        ok_("app.ssnake.get.profile.calls:1|c" in lines)
+        ok_("app.ssnake.get.profile.commands:1|c" in lines)
+        ok_("app.ssnake.get.profile.bytes:5|c" in lines)
+        ok_("app.ssnake.get.profile.errors:1|c" in lines)
+        ok_("app.ssnake.get.profile.network:1.000|ms" in lines)
+
+    def test_statsd_names(self):
+        span = Span("get", "team:42")
+        span.finish()
+        ok_(StatsdSink(prefix="app.ssnake").format(span).startswith("app.ssnake.get.team_42.calls:1|c"))
+        ok_(StatsdSink(prefix="").format(span).startswith("get.team_42.calls:1|c"))
+
+    def test_finished_span_ignores_records(self):
+        span = self._span()
+        span.record_command(("ZADD", "ssnake:late", 1, "a"))
+        span.record_round_trips([1], 5.0)
+        span.record_response(["late"])
+
+        eq_(span.commands, 1)
+        eq_(span.round_trips, 1)
+        eq_(span.keys, set(["ssnake:index"]))
+        eq_(span.bytes, 5)
+        eq_(span.network_time, 0.001)
+
+    def test_statsd_sample_rate(self):
+        sink = StatsdSink(sample_rate=0.5)
+        ok_(sink.format(self._span()).endswith("bytes:5|c|@0.5"))
+
+    def test_logging(self):
+        records = []
+
+        class Handler(logging.Handler):
+            def emit(self, record):
+                records.append(record.getMessage())
+
+        logger = logging.getLogger("sandsnake.tests.instrumentation")
+        logger.addHandler(Handler())
+        logger.setLevel(logging.INFO)
+
+        LoggingSink(logger=logger).record(self._span())
+        eq_(records, [])
+        LoggingSink(logger=logger, level=logging.INFO).record(self._span())
+        eq_(len(records), 1)
+        ok_(records[0].startswith("get index=profile duration="))
+        ok_("commands=1 round_trips=1 keys=1 bytes=5" in records[0])
@@ -0,0 +1,73 @@
+from __future__ import absolute_import
+
+from nose.tools import ok_, eq_, raises
+
+from sandsnake import create_sandsnake_backend
+from sandsnake.invalidation import KeyspaceInvalidator
+
+import datetime
+import time
+
+
+class TestKeyspaceInvalidator(object):
+    def setUp(self):
+        settings = {
+            "hosts": [{"db": 3}, {"db": 4}, {"db": 5}],
+            "cache": {"max_size": 100, "ttl": 60},
+        }
+        self._backend = create_sandsnake_backend({
+            "backend": "sandsnake.backends.redis.RedisWithMarker",
+            "settings": settings,
+        })
+        #stands in for another worker process
+        self._other_backend = create_sandsnake_backend({
+            "backend": "sandsnake.backends.redis.RedisWithMarker",
+            "settings": settings,
+        })
+
+        self._redis_backend = self._backend.get_backend()
+
+        #clear the redis database so we are in a consistent state
+        self._redis_backend.flushdb()
+
+        self._invalidator = KeyspaceInvalidator(self._backend, configure=True, poll_interval=0.05)
+        self._invalidator.start()
+
+    def tearDown(self):
+        self._invalidator.stop()
+        self._redis_backend.flushdb()
+
+    def _wait_for(self, func):
+        for i in xrange(100):
+            if func():
+                return True
+            time.sleep(0.02)
+        return False
+
+    def test_remote_writes_invalidate_cache(self):
+        published = datetime.datetime.utcnow()
+        obj = "indexes"
+        index_name = "profile_index"
+
+        self._backend.add(obj, index_name, "activity_0", published=published)
+        eq_(self._backend.get(obj, index_name, marker=published), ["activity_0"])
+        self._backend.set_markers(obj, index_name, {"read": 25L})
+        eq_(self._backend.get_markers(obj, index_name, "read"), 25L)
+
+        #wait for the notifications of our own writes to arrive before caching again
+        ok_(self._wait_for(lambda: self._backend.get(obj, index_name, marker=published) == ["activity_0"] and \
+            self._backend.get_cache().stats()['hits'] > 0))
+
+        self._other_backend.add(obj, index_name, "activity_1", published=published)
+        self._other_backend.set_markers(obj, index_name, {"read": 50L})
+
+        ok_(self._wait_for(lambda: self._backend.get(obj, index_name, marker=published) == ["activity_1", "activity_0"]))
+        ok_(self._wait_for(lambda: self._backend.get_markers(obj, index_name, "read") == 50L))
+
+    @raises(ValueError)
+    def test_requires_cache(self):
+        backend = create_sandsnake_backend({
+            "backend": "sandsnake.backends.redis.Redis",
+            "settings": {"hosts": [{"db": 3}]},
+        })
+        KeyspaceInvalidator(backend)
@@ -0,0 +1,135 @@
+from __future__ import absolute_import
+
+from nose.tools import ok_, eq_
+
+from sandsnake import create_sandsnake_backend
+from sandsnake.backends.schema import KeySchema
+from sandsnake.migrate import KeySchemaMigration
+
+import datetime
+
+
+class TestKeySchemaMigration(object):
+    def setUp(self):
+        settings = {
+            "hosts": [{"db": 3}, {"db": 4}, {"db": 5}],
+        }
+        self._old_backend = create_sandsnake_backend({
+            "backend": "sandsnake.backends.redis.RedisWithMarker",
+            "settings": settings,
+        })
+        self._backend = create_sandsnake_backend({
+            "backend": "sandsnake.backends.redis.RedisWithMarker",
+            "settings": dict(settings, **{
+                "key_schema": "sandsnake.backends.schema.CompactKeySchema",
+                "key_schema_options": {"index_codes": {"homefeed": "h", "notifications": "n"}},
+            }),
+        })
+
+        self._redis_backend = self._backend.get_backend()
+
+        #clear the redis database so we are in a consistent state
+        self._redis_backend.flushdb()
+
+    def tearDown(self):
+        self._redis_backend.flushdb()
+
+    def _setup_indexes(self, now):
+        for i in xrange(20):
+            obj = "user:" + str(i)
+            self._old_backend.add(obj, ["homefeed", "notifications"], "old", published=now - datetime.timedelta(days=1))
+            self._old_backend.add(obj, ["homefeed", "notifications", "profile"], "new", published=now)
+            self._old_backend.set_markers(obj, "homefeed", {"read": 1000 + i})
+
+    def _old_keys(self):
+        keys = []
+        for host in self._redis_backend:
+            keys.extend(self._redis_backend[host].connection.keys("ssnake:*"))
+        return keys
+
+    def test_run(self):
+        now = datetime.datetime.utcnow()
+        self._setup_indexes(now)
+
+        migration = KeySchemaMigration(self._backend, KeySchema(), batch_size=5)
+        eq_(migration.run(), 40)
+        ok_(migration.is_complete())
+        eq_(self._old_keys(), [])
+
+        for i in xrange(20):
+            obj = "user:" + str(i)
+            eq_(self._redis_backend.zrevrange(self._backend._get_index_name(obj, "homefeed"), 0, -1), ["new", "old"])
+            eq_(self._redis_backend.zrevrange(self._backend._get_index_name(obj, "profile"), 0, -1), ["new"])
+            eq_(set(self._redis_backend.smembers(self._backend._get_index_collection_name(obj))), \
+                set(["homefeed", "notifications", "profile"]))
+            eq_(self._backend.get_markers(obj, "homefeed", "read"), 1000 + i)
+
+    def test_merges_into_new_keys(self):
+        now = datetime.datetime.utcnow()
+        self._setup_indexes(now)
+        self._backend.add("user:1", ["homefeed"], "newest", published=now + datetime.timedelta(days=1))
+
+        KeySchemaMigration(self._backend, KeySchema()).run()
+        eq_(self._redis_backend.zrevrange(self._backend._get_index_name("user:1", "homefeed"), 0, -1), ["newest", "new", "old"])
+
+    def test_resume_from_checkpoint(self):
+        now = datetime.datetime.utcnow()
+        self._setup_indexes(now)
+
+        migration = KeySchemaMigration(self._backend, KeySchema(), batch_size=5)
+        migration.run(max_batches=2)
+        ok_(not migration.is_complete())
+
+        resumed = KeySchemaMigration(self._backend, KeySchema(), batch_size=5, checkpoint=migration.checkpoint)
+        resumed.run()
+        ok_(resumed.is_complete())
+        eq_(self._old_keys(), [])
+        eq_(self._redis_backend.zrevrange(self._backend._get_index_name("user:19", "notifications"), 0, -1), ["new", "old"])
+
+    def test_index_names_with_separator(self):
+        now = datetime.datetime.utcnow()
+        self._old_backend.add("user:1", ["team:42"], "joined", published=now)
+        self._old_backend.set_markers("user:1", "team:42", {"read": 1000})
+
+        KeySchemaMigration(self._backend, KeySchema()).run()
+        eq_(self._old_keys(), [])
+        eq_(self._redis_backend.zrevrange(self._backend._get_index_name("user:1", "team:42"), 0, -1), ["joined"])
+        eq_(self._backend.get_markers("user:1", "team:42", "read"), 1000)
+
+    def test_copies_large_indexes_in_windows(self):
+        now = datetime.datetime.utcnow()
+        for i in xrange(23):
+            self._old_backend.add("user:1", ["homefeed"], "activity:" + str(i), published=now + datetime.timedelta(seconds=i))
+
+        migration = KeySchemaMigration(self._backend, KeySchema(), batch_size=5)
+        migration.run()
+        eq_(self._old_keys(), [])
+        eq_(self._redis_backend.zrevrange(self._backend._get_index_name("user:1", "homefeed"), 0, -1), \
+            ["activity:" + str(i) for i in reversed(xrange(23))])
+
+    def test_migrates_locations(self):
+        settings = {
+            "hosts": [{"db": 3}, {"db": 4}, {"db": 5}],
+            "reverse_index": True,
+        }
+        old_backend = create_sandsnake_backend({
+            "backend": "sandsnake.backends.redis.RedisWithMarker",
+            "settings": settings,
+        })
+        backend = create_sandsnake_backend({
+            "backend": "sandsnake.backends.redis.RedisWithMarker",
+            "settings": dict(settings, **{
+                "key_schema": "sandsnake.backends.schema.CompactKeySchema",
+                "key_schema_options": {"index_codes": {"homefeed": "h", "notifications": "n"}},
+            }),
+        })
+        for i in xrange(12):
+            old_backend.add("user:" + str(i), ["homefeed", "team:42"], "activity", published=datetime.datetime.utcnow())
+
+        KeySchemaMigration(backend, KeySchema(), batch_size=5).run()
+        eq_(self._old_keys(), [])
+
+        backend.retract("activity")
+        for i in xrange(12):
+            eq_(self._redis_backend.zcard(backend._get_index_name("user:" + str(i), "homefeed")), 0)
+            eq_(self._redis_backend.zcard(backend._get_index_name("user:" + str(i), "team:42")), 0)
@@ -0,0 +1,73 @@
+from __future__ import absolute_import
+
+from nose.tools import ok_, eq_
+
+from sandsnake import create_sandsnake_backend
+from sandsnake.sweeper import RetentionSweeper
+
+import datetime
+import json
+
+
+class TestRetentionSweeper(object):
+    def setUp(self):
+        self._backend = create_sandsnake_backend({
+            "backend": "sandsnake.backends.redis.Redis",
+            "settings": {
+                "hosts": [{"db": 3}, {"db": 4}, {"db": 5}],
+                "retention": datetime.timedelta(days=90),
+                "retentions": {"notifications": 60},
+            },
+        })
+
+        self._redis_backend = self._backend.get_backend()
+
+        #clear the redis database so we are in a consistent state
+        self._redis_backend.flushdb()
+
+    def tearDown(self):
+        self._redis_backend.flushdb()
+
+    def _setup_indexes(self, now):
+        for i in xrange(20):
+            obj = "user:" + str(i)
+            self._backend.add(obj, ["homefeed", "notifications"], "old", published=now - datetime.timedelta(days=91))
+            self._backend.add(obj, ["homefeed", "notifications"], "recent", published=now - datetime.timedelta(days=1))
+            self._backend.add(obj, ["homefeed", "notifications"], "new", published=now)
+
+    def test_trim_expired(self):
+        now = datetime.datetime.utcnow()
+        self._setup_indexes(now)
+
+        eq_(self._backend.trim_expired(["user:1", "user:2", "doesn't exist"], now=now), 6)
+        eq_(self._redis_backend.zrange(self._backend._get_index_name("user:1", "homefeed"), 0, -1), ["recent", "new"])
+        eq_(self._redis_backend.zrange(self._backend._get_index_name("user:1", "notifications"), 0, -1), ["new"])
+        eq_(self._redis_backend.zcard(self._backend._get_index_name("user:3", "homefeed")), 3)
+
+    def test_run(self):
+        now = datetime.datetime.utcnow()
+        self._setup_indexes(now)
+
+        sweeper = RetentionSweeper(self._backend, batch_size=5)
+        eq_(sweeper.run(now=now), 60)
+        ok_(sweeper.is_complete())
+
+        for i in xrange(20):
+            eq_(self._redis_backend.zrange(self._backend._get_index_name("user:" + str(i), "homefeed"), 0, -1), ["recent", "new"])
+
+    def test_resume_from_checkpoint(self):
+        now = datetime.datetime.utcnow()
+        self._setup_indexes(now)
+
+        sweeper = RetentionSweeper(self._backend, batch_size=2)
+        sweeper.run(now=now, max_batches=1)
+        ok_(not sweeper.is_complete())
+
+        #checkpoints are saved as json, which turns keys into strings
+        checkpoint = json.loads(json.dumps(sweeper.checkpoint))
+        eq_(checkpoint, sweeper.checkpoint)
+
+        resumed = RetentionSweeper(self._backend, batch_size=2, checkpoint=checkpoint)
+        resumed.run(now=now)
+        ok_(resumed.is_complete())
+        eq_(sweeper.removed + resumed.removed, 60)
@@ -0,0 +1,216 @@
+from __future__ import absolute_import
+
+from nose.tools import ok_, eq_, raises
+
+from sandsnake.exceptions import SandsnakeTimeoutException
+from sandsnake.utils import chunks, datetime_to_timestamp, datetimes_to_timestamps, FixedOffset, OrderedSet, \
+    parse_iso8601, prefetched, run_batches, UTC, WorkerPool
+
+from dateutil.parser import parse
+
+import calendar
+import collections
+import datetime
+import pickle
+import random
+import threading
+import time
+
+
+class TestChunks(object):
+    def test_chunks(self):
+        eq_([[0, 1, 2], [3, 4, 5], [6]], list(chunks(iter(xrange(7)), 3)))
+        eq_([], list(chunks([], 3)))
+
+
+class TestTimestamps(object):
+    def _slow_timestamp(self, dt):
+        return long((calendar.timegm(dt.utctimetuple()) * 1000)) + (dt.microsecond / 1000)
+
+    def test_parse_iso8601(self):
+        eq_(datetime.datetime(2012, 1, 1, 12, 0, 0, 0), parse_iso8601("2012-01-01T12:00:00"))
+        eq_(datetime.datetime(2012, 1, 1, 12, 30, 0, 0), parse_iso8601("2012-01-01 12:30"))
+        eq_(datetime.datetime(2012, 1, 1), parse_iso8601("2012-01-01"))
+        eq_(datetime.datetime(2012, 1, 1, 12, 0, 0, 123000, UTC), parse_iso8601("2012-01-01T12:00:00.123Z"))
+        eq_(datetime.datetime(2012, 1, 1, 12, 0, 0, 123456, FixedOffset(-330)), parse_iso8601("2012-01-01T12:00:00.1234567-05:30"))
+        eq_(None, parse_iso8601("qwerty"))
+        eq_(None, parse_iso8601("2012-13-01T12:00:00"))
+
+    def test_parse_iso8601_matches_dateutil(self):
+        for value in ["2012-01-01T12:00:00", "2012-06-30T23:59:59.999999", "2012-01-01T12:00:00+02:00", "1969-12-31T23:59:59.5Z"]:
+            eq_(datetime_to_timestamp(parse(value)), datetime_to_timestamp(parse_iso8601(value)))
+
+    def test_datetime_to_timestamp(self):
+        eq_(1325419200000L, datetime_to_timestamp(datetime.datetime(2012, 1, 1, 12, 0, 0, 0)))
+
+        for dt in [datetime.datetime(2012, 1, 1, 12, 0, 0, 999999), datetime.datetime(1969, 12, 31, 23, 59, 59, 1000),\
+                datetime.datetime(2012, 1, 1, 12, 0, 0, 500, FixedOffset(90)), datetime.datetime(2038, 2, 1, 3, 4, 5, 6)]:
+            eq_(self._slow_timestamp(dt), datetime_to_timestamp(dt))
+
+    def test_datetimes_to_timestamps(self):
+        dts = [datetime.datetime(2012, 1, 1, 12, 0, 0, 0) + datetime.timedelta(milliseconds=i) for i in xrange(5)]
+        eq_([1325419200000L + i for i in xrange(5)], datetimes_to_timestamps(dts))
+
+    def test_datetimes_to_timestamps_aware(self):
+        tz = FixedOffset(90)
+        aware = [datetime.datetime(2012, 1, 1, 13, 30, 0, 500, tz) + datetime.timedelta(milliseconds=i) for i in xrange(5)]
+        eq_([1325419200000L + i for i in xrange(5)], datetimes_to_timestamps(aware))
+
+        mixed = [datetime.datetime(2012, 1, 1, 12, 0, 0), datetime.datetime(2012, 1, 1, 13, 30, 0, 0, tz),\
+                datetime.datetime(2012, 1, 1, 12, 0, 0, 0, FixedOffset(0))]
+        eq_([1325419200000L] * 3, datetimes_to_timestamps(mixed))
+        eq_([], datetimes_to_timestamps([]))
+
+
+class TestPrefetched(object):
+    def test_prefetched(self):
+        eq_(range(10), list(prefetched(xrange(10))))
+
+    @raises(ValueError)
+    def test_prefetched_raises(self):
+        def fail():
+            yield 1
+            raise ValueError()
+        list(prefetched(fail()))
+
+
+class TestRunBatches(object):
+    def test_stops_when_done(self):
+        batches = iter([3, 2, None, 5])
+        eq_(run_batches(lambda: batches.next()), 2)
+        eq_(batches.next(), 5)
+
+    def test_max_batches(self):
+        eq_(run_batches(lambda: 1, max_batches=3), 3)
+
+    def test_per_second(self):
+        started = time.time()
+        eq_(run_batches(lambda: 5, per_second=100, max_batches=2), 2)
+        ok_(time.time() - started >= 0.09)
+
+
+class TestWorkerPool(object):
+    def test_submit(self):
+        pool = WorkerPool(3)
+        futures = [pool.submit(pow, 2, i) for i in xrange(10)]
+
+        eq_([2 ** i for i in xrange(10)], [future.result(timeout=1) for future in futures])
+        ok_(len(pool._threads) <= 3)
+
+    def test_concurrent(self):
+        pool = WorkerPool(2)
+        started = time.time()
+        futures = [pool.submit(time.sleep, 0.1) for i in xrange(2)]
+        for future in futures:
+            future.result(timeout=1)
+
+        ok_(time.time() - started < 0.19)
+
+    @raises(KeyError)
+    def test_submit_raises(self):
+        pool = WorkerPool(1)
+        pool.submit({}.__getitem__, "missing").result(timeout=1)
+
+    @raises(SandsnakeTimeoutException)
+    def test_timeout(self):
+        pool = WorkerPool(1)
+        event = threading.Event()
+        try:
+            pool.submit(event.wait).result(timeout=0.01)
+        finally:
+            event.set()
+
+
+class TestOrderedSet(object):
+    def test_order_and_index(self):
+        ordered = OrderedSet("abcab")
+        eq_(list(ordered), ["a", "b", "c"])
+        eq_(ordered.add("d"), 3)
+        eq_(ordered.add("b"), 1)
+        eq_(ordered.index("c"), 2)
+        eq_(ordered[1], "b")
+        eq_(ordered[1:3], OrderedSet("bc"))
+        eq_(ordered[[0, 3]], OrderedSet("ad"))
+
+    def test_discard_keeps_indexes(self):
+        ordered = OrderedSet(xrange(10))
+        ordered.discard(2)
+        ordered.discard(5)
+        ordered.discard(42)
+        eq_(len(ordered), 8)
+        eq_(ordered.index(6), 4)
+        eq_(ordered[4], 6)
+        eq_(ordered.add(2), 8)
+        eq_(list(ordered), [0, 1, 3, 4, 6, 7, 8, 9, 2])
+        eq_(list(reversed(ordered)), [2, 9, 8, 7, 6, 4, 3, 1, 0])
+
+    def test_pop(self):
+        ordered = OrderedSet(xrange(5))
+        eq_(ordered.pop(), 4)
+        eq_(ordered.pop(last=False), 0)
+        ordered.discard(1)
+        eq_(ordered.pop(last=False), 2)
+        eq_(list(ordered), [3])
+        eq_(ordered.pop(), 3)
+        ordered.add(7)
+        eq_(ordered.pop(last=False), 7)
+
+    @raises(KeyError)
+    def test_pop_empty(self):
+        OrderedSet().pop()
+
+    def test_set_operations(self):
+        ordered = OrderedSet([1, 2, 3])
+        ordered |= [3, 4]
+        eq_(list(ordered), [1, 2, 3, 4])
+        eq_(list(ordered & [4, 2]), [4, 2])
+        eq_(list(ordered | [5]), [1, 2, 3, 4, 5])
+        eq_(list(ordered - [1]), [2, 3, 4])
+        ok_(OrderedSet([1, 2]) <= ordered)
+        ok_(ordered == set([4, 3, 2, 1]))
+        ok_(OrderedSet([2, 1]) != OrderedSet([1, 2]))
+        ok_(isinstance(ordered, collections.MutableSet))
+        ordered.remove(1)
+        eq_(list(ordered), [2, 3, 4])
+
+    def test_reflected_operations(self):
+        ordered = OrderedSet([1, 2, 3])
+        eq_([4, 3, 1] & ordered, OrderedSet([3, 1]))
+        eq_([5, 1] | ordered, OrderedSet([5, 1, 2, 3]))
+        eq_([4, 3, 5] - ordered, OrderedSet([4, 5]))
+        eq_([4, 3] ^ ordered, OrderedSet([4, 1, 2]))
+        ok_(isinstance(set([1]) | ordered, OrderedSet))
+
+    def test_update_and_views(self):
+        ordered = OrderedSet([1, 2, 3])
+        eq_(ordered.update([4]), None)
+        ordered.discard(2)
+        eq_(ordered.items, [1, 3, 4])
+        eq_(ordered.map, {1: 0, 3: 1, 4: 2})
+
+    def test_pickle(self):
+        ordered = OrderedSet(xrange(5))
+        ordered.discard(1)
+        eq_(pickle.loads(pickle.dumps(ordered)), OrderedSet([0, 2, 3, 4]))
+
+    def test_matches_list(self):
+        rand = random.Random(7)
+        ordered, expected = OrderedSet(), []
+        for i in xrange(5000):
+            key = rand.randint(0, 200)
+            operation = rand.random()
+            if operation < 0.5:
+                ordered.add(key)
+                if key not in expected:
+                    expected.append(key)
+            elif operation < 0.9:
+                ordered.discard(key)
+                if key in expected:
+                    expected.remove(key)
+            elif expected:
+                eq_(ordered.pop(last=operation < 0.95), expected.pop(-1 if operation < 0.95 else 0))
+
+            if i % 100 == 0:
+                eq_(list(ordered), expected)
+                eq_([ordered.index(key) for key in expected], range(len(expected)))
+        eq_(len(ordered), len(expected))